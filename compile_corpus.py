@@ -0,0 +1,6 @@
+import sys
+from rule_parser.corpus import main
+
+
+if __name__ == "__main__":
+    sys.exit(main())
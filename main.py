@@ -2,20 +2,90 @@
 
 import traceback
 import sys
-from rule_parser import *
+from rule_parser.cli import get_arg_parser, add_cache_arguments
+
+# every branch imports only the modules it needs, startup is most of the cost of a short run, and
+# xdsl alone takes longer to import than compiling a sentence
 
 
 def main():
     ap = get_arg_parser()
+    add_cache_arguments(ap)
     args = ap.parse_args()
+    if args.lalr_conflicts:
+        from rule_parser.grammar import report_lalr_conflicts
+        report_lalr_conflicts(sys.stdout)
+        return
+    if args.generate_parser:
+        from rule_parser.grammar import STANDALONE_PATH, generate_standalone_parser
+        generate_standalone_parser()
+        print(f"wrote {STANDALONE_PATH}")
+        return
+    if args.serve is not None:
+        from rule_parser.daemon import SocketPathInUse, serve
+        try:
+            serve(args.serve)
+        except SocketPathInUse as e:
+            print(f"error: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+    if args.cache_stats:
+        from rule_parser.compile_cache import CompileCache
+        CompileCache.from_args(args).print_stats(sys.stdout)
+        return
 
     out = sys.stdout if args.o == "-" else open(args.o, "w+")
+    timer = None
+    if args.timing and not args.jsonl:
+        from rule_parser.pass_timing import PassTimer
+        timer = PassTimer()
+    try:
+        compile_input(args, out, timer)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    # the report goes to stderr, stdout holds the output of the compilation
+    if timer is not None:
+        timer.report(sys.stderr, args.timing_format)
+
+def compile_input(args, out, timer=None):
     content = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8")
-    ast = parse("".join(content.readlines()))
+    if args.jsonl:
+        from rule_parser.stream import compile_jsonl_stream
+        compile_jsonl_stream(content, out, args)
+        return
+
+    text = "".join(content.readlines())
+    if args.cache:
+        # a hit is answered from the cache alone, without importing the compiler. --verify needs
+        # the module, it always compiles
+        from rule_parser.compile_cache import CompileCache
+        cache = CompileCache.from_args(args)
+        try:
+            key = cache.key(text, args)
+            output = cache.get(key) if not args.verify else None
+            if output is None:
+                from rule_parser.driver import compile_text
+                try:
+                    output = compile_text(text, args, timer=timer)
+                except Exception:
+                    print(traceback.format_exc())
+                    return
+                cache.put(key, output)
+        finally:
+            cache.close()
+        out.write(output)
+        return
+
+    from rule_parser.driver import ParseBudget, TemplateCache, compile_partial, parse, run_pipeline
+    templates = TemplateCache() if args.template_cache else None
+    if args.partial:
+        out.write(compile_partial(text, args, sentence_cache=templates, timer=timer))
+        return
+    ast = parse(text, fast_path=not args.earley, budget=ParseBudget.from_args(args), inline=args.inline_lowering, sentence_cache=templates)
 
-    printer = Printer(out)
     try:
-        run_pipeline(ast, args, out)
+        run_pipeline(ast, args, out, timer=timer)
     except Exception:
         print(traceback.format_exc())
         print(ast)
@@ -0,0 +1,44 @@
+# Thin client of the compile server started with `main.py --serve SOCKET`. It only imports the
+# standard library, so that a request does not pay for loading lark and xdsl.
+import argparse
+import json
+import socket
+import sys
+
+STAGES = ["unchecked", "type_checked", "canonicalized", "before_printing", "after_events", "after_inline", "before_bounding"]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Send a rule to a running compile server. Pass '-' to read from stdin.")
+    ap.add_argument("socket", help="unix socket of the compile server")
+    ap.add_argument("path", help="path to dump file or '-' for stdin", default="-", nargs="?")
+    ap.add_argument("-o", help="output", default="-", nargs="?")
+    for stage in STAGES:
+        ap.add_argument("--" + stage.replace("_", "-"), action='store_true', default=False)
+    ap.add_argument("--earley", action='store_true', default=False)
+    args = ap.parse_args()
+
+    content = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8")
+    request = {
+        "text": content.read(),
+        "stages": [stage for stage in STAGES if getattr(args, stage)],
+        "earley": args.earley,
+    }
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(args.socket)
+        connection.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        connection.shutdown(socket.SHUT_WR)
+        with connection.makefile("rb") as reply:
+            response = json.loads(reply.readline())
+
+    if "error" in response:
+        print(response["traceback"], file=sys.stderr)
+        return 1
+    out = sys.stdout if args.o == "-" else open(args.o, "w+")
+    out.write(response["output"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,42 @@
-from .dialect import *
-from .rlc_serialize import RLCSerializer
-from .passes import *
-from .semantic_analizer import *
-from .to_ast import *
-from .driver import *
+import importlib
+
+# The submodules are imported on first use rather than here, so that a command that only needs
+# the argument parser or the compile cache never pays for importing xdsl and the dialect.
+# `from rule_parser import *` still imports all of them and exports the same names as before.
+
+# the modules whose names the package exports, in the order of the original star imports, a later
+# module wins when two of them export the same name
+EXPORTED_MODULES = ["dialect", "rlc_serialize", "passes", "semantic_analizer", "to_ast", "grammar", "disambiguate", "budget", "normalize", "prefilter", "sentences", "templates", "ambiguity", "pass_timing", "driver", "compile_cache", "cli"]
+
+# the only names exported from modules that are not star imported
+EXPORTED_NAMES = {"rlc_serialize": ["RLCSerializer"]}
+
+# where a single name is looked up, the modules that do not import xdsl come first
+LOOKUP_ORDER = ["cli", "budget", "disambiguate", "normalize", "grammar", "prefilter", "sentences", "templates", "ambiguity", "pass_timing", "compile_cache", "dialect", "to_ast", "passes", "semantic_analizer", "rlc_serialize", "driver"]
+
+def module_exports(name: str):
+    module = importlib.import_module("." + name, __name__)
+    if name in EXPORTED_NAMES:
+        return {export: getattr(module, export) for export in EXPORTED_NAMES[name]}
+    return {export: value for export, value in vars(module).items() if not export.startswith("_")}
+
+def exports():
+    names = {}
+    for name in EXPORTED_MODULES:
+        names.update(module_exports(name))
+    return names
+
+def __getattr__(name: str):
+    if name == "__all__":
+        names = exports()
+        globals().update(names)
+        globals()["__all__"] = list(names)
+        return globals()["__all__"]
+    if name.startswith("__"):
+        raise AttributeError(name)
+    for module in LOOKUP_ORDER:
+        names = module_exports(module)
+        if name in names:
+            globals()[name] = names[name]
+            return names[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
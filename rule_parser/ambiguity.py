@@ -0,0 +1,127 @@
+from collections import Counter
+from lark import UnexpectedInput
+from lark.parsers.earley_forest import ForestVisitor
+from .budget import ParseMeter, metered
+from .grammar import GRAMMAR_PATH, get_parser, production_name
+from .normalize import normalize_text
+from .prefilter import get_prefilter
+from .sentences import split_sentences
+import json
+
+# a meter that also counts the earley items of every rule of the grammar
+class ChartProfile(ParseMeter):
+    def __init__(self):
+        super().__init__()
+        self.items = Counter()
+
+    def chart_column(self, column, to_scan):
+        super().chart_column(column, to_scan)
+        for item in column:
+            self.items[item.rule] = self.items[item.rule] + 1
+        for item in to_scan:
+            self.items[item.rule] = self.items[item.rule] + 1
+
+# the rules of the derivations of every ambiguous symbol of a forest
+class AmbiguousDerivations(ForestVisitor):
+    def __init__(self):
+        super().__init__(single_visit=True)
+        self.rules = Counter()
+
+    def visit_packed_node_in(self, node):
+        yield node.left
+        yield node.right
+
+    def visit_symbol_node_in(self, node):
+        children = node.children
+        if len(children) > 1:
+            for child in children:
+                self.rules[child.rule] = self.rules[child.rule] + 1
+        return iter(children)
+
+# Parses sentences with the earley parser into their packed forest, and attributes to each
+# production, that is a rule and one of its alternatives, the chart items its earley items took
+# and the derivations it contributed to an ambiguous symbol of the forest. A production can only
+# make parse time go away by being changed, so the productions are sorted by chart items.
+class AmbiguityReport:
+    def __init__(self, grammar_path: str = GRAMMAR_PATH):
+        self.parser = get_parser(grammar_path, parser="earley", ambiguity="forest")
+        # the alternatives without an alias of a rule that has several are told apart by their symbols
+        rules = {}
+        for rule in self.parser.rules:
+            rules.setdefault(production_name(rule), []).append(rule)
+        self.names = {}
+        for name, alternatives in rules.items():
+            for rule in alternatives:
+                if len(alternatives) > 1 and rule.alias is None:
+                    self.names[rule] = f"{name}: {' '.join(symbol.name for symbol in rule.expansion)}"
+                else:
+                    self.names[rule] = name
+        self.prefilter = get_prefilter(grammar_path)
+        self.productions = {}
+        self.sentences = 0
+        self.rejected = 0
+        self.failed = 0
+        self.ambiguous_sentences = 0
+        self.chart_items = 0
+
+    def production(self, name: str):
+        return self.productions.setdefault(name, {"chart_items": 0, "ambiguous_derivations": 0, "ambiguous_sentences": 0})
+
+    # sentences that do not parse still count, their chart took as long to build
+    def add_sentence(self, text: str):
+        self.sentences = self.sentences + 1
+        if self.prefilter.check(text) is not None:
+            self.rejected = self.rejected + 1
+            return
+        profile = ChartProfile()
+        forest = None
+        try:
+            with metered(profile):
+                forest = self.parser.parse(text)
+        except UnexpectedInput:
+            self.failed = self.failed + 1
+        for rule, count in profile.items.items():
+            self.production(self.names[rule])["chart_items"] += count
+            self.chart_items = self.chart_items + count
+        if forest is None:
+            return
+
+        visitor = AmbiguousDerivations()
+        visitor.visit(forest)
+        derivations = Counter()
+        for rule, count in visitor.rules.items():
+            derivations[self.names[rule]] = derivations[self.names[rule]] + count
+        if len(derivations) != 0:
+            self.ambiguous_sentences = self.ambiguous_sentences + 1
+        for name, count in derivations.items():
+            self.production(name)["ambiguous_derivations"] += count
+            self.production(name)["ambiguous_sentences"] += 1
+
+    def add_text(self, text: str):
+        for sentence in split_sentences(normalize_text(text).text):
+            self.add_sentence(sentence.text)
+
+    def rows(self):
+        rows = [{"production": name, **counts} for name, counts in self.productions.items()]
+        return sorted(rows, key=lambda row: (-row["chart_items"], -row["ambiguous_derivations"], row["production"]))
+
+    def to_json(self):
+        return {
+            "sentences": self.sentences,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "ambiguous_sentences": self.ambiguous_sentences,
+            "chart_items": self.chart_items,
+            "productions": self.rows(),
+        }
+
+    def write(self, out, limit: int = None):
+        out.write(f"{self.sentences} sentences, {self.rejected} rejected before parsing, {self.failed} not parsed, {self.ambiguous_sentences} ambiguous, {self.chart_items} chart items\n")
+        out.write(f"{'chart items':>11} {'share':>6} {'ambiguous':>9} {'sentences':>9}  production\n")
+        for row in self.rows()[:limit]:
+            share = row["chart_items"] / self.chart_items if self.chart_items != 0 else 0.0
+            out.write(f"{row['chart_items']:11} {share:6.1%} {row['ambiguous_derivations']:9} {row['ambiguous_sentences']:9}  {row['production']}\n")
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, indent=2)
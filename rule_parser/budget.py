@@ -0,0 +1,111 @@
+from contextlib import contextmanager
+from lark.parsers import xearley
+import lark
+import threading
+import time
+import warnings
+
+# the lark versions whose earley parser MeteredEarleyParser was written against, see meter_earley_parser
+METERED_LARK_VERSIONS = ["1.3"]
+
+# per sentence limits, None is unlimited
+class ParseBudget:
+    def __init__(self, seconds: float = None, chart_items: int = None):
+        self.seconds = seconds
+        self.chart_items = chart_items
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(getattr(args, "max_parse_seconds", None), getattr(args, "max_chart_items", None))
+
+    def __repr__(self):
+        return f"ParseBudget(seconds={self.seconds}, chart_items={self.chart_items})"
+
+class ParseBudgetExceeded(Exception):
+    def __init__(self, limit: str, budget: ParseBudget, seconds: float, chart_items: int, position: int = 0):
+        super().__init__(limit, budget, seconds, chart_items, position)
+        self.limit = limit
+        self.budget = budget
+        self.seconds = seconds
+        self.chart_items = chart_items
+        self.position = position
+
+    def __str__(self):
+        allowed = self.budget.seconds if self.limit == "seconds" else self.budget.chart_items
+        return f"parse budget of {allowed} {self.limit.replace('_', ' ')} exceeded by the sentence at {self.position}, after {self.seconds:.3f}s and {self.chart_items} chart items"
+
+    def to_record(self):
+        return {"limit": self.limit, "position": self.position, "seconds": self.seconds, "chart_items": self.chart_items,
+                "budget": {"seconds": self.budget.seconds, "chart_items": self.budget.chart_items}}
+
+# measures a single sentence, the earley parser reports every column it completes and the
+# ranking of its forest every symbol it expands into the parse tree, so the seconds cover both
+class ParseMeter:
+    def __init__(self, budget: ParseBudget = None):
+        self.budget = budget if budget is not None else ParseBudget()
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.chart_items = 0
+
+    def column(self, items: int):
+        self.chart_items = self.chart_items + items
+        self.seconds = time.perf_counter() - self.started
+        if self.budget.chart_items is not None and self.chart_items > self.budget.chart_items:
+            raise ParseBudgetExceeded("chart_items", self.budget, self.seconds, self.chart_items)
+        if self.budget.seconds is not None and self.seconds > self.budget.seconds:
+            raise ParseBudgetExceeded("seconds", self.budget, self.seconds, self.chart_items)
+
+    def forest_node(self):
+        if self.budget.seconds is not None:
+            self.column(0)
+
+    # the items of a completed column and the ones about to be scanned from it
+    def chart_column(self, column, to_scan):
+        self.column(len(column) + len(to_scan))
+
+    def stop(self):
+        self.seconds = time.perf_counter() - self.started
+
+# the meter of the sentence being parsed by this thread, parsers are shared between the threads
+# of the compile server
+meters = threading.local()
+
+def current_meter():
+    return getattr(meters, "meter", None)
+
+@contextmanager
+def metered(meter: ParseMeter):
+    previous = current_meter()
+    meters.meter = meter
+    try:
+        yield meter
+    finally:
+        meters.meter = previous
+        meter.stop()
+
+class MeteredEarleyParser(xearley.Parser):
+    def predict_and_complete(self, i, to_scan, columns, transitives, node_cache):
+        super().predict_and_complete(i, to_scan, columns, transitives, node_cache)
+        meter = current_meter()
+        if meter is not None:
+            meter.chart_column(columns[i], to_scan)
+
+def meterable_lark_version(version: str = lark.__version__):
+    return ".".join(version.split(".")[:2]) in METERED_LARK_VERSIONS
+
+# lark creates the dynamic lexer earley parser itself and has no option to choose its class, nor a
+# callback the dynamic lexer would call, the metered one is built from the same configuration and
+# takes its place in the frontend. It overrides a method of the parser, with a lark version it was
+# not written for the parser is left as it is and sentences are parsed without a budget
+def meter_earley_parser(parser):
+    frontend = getattr(parser, "parser", None)
+    earley = getattr(frontend, "parser", None)
+    if type(earley) is not xearley.Parser:
+        return parser
+    if not meterable_lark_version():
+        warnings.warn(f"the parse budget does not support lark {lark.__version__}, only {', '.join(METERED_LARK_VERSIONS)}, sentences are parsed without it", RuntimeWarning)
+        return parser
+    frontend.parser = MeteredEarleyParser(
+        earley.lexer_conf, earley.parser_conf, earley.term_matcher, resolve_ambiguity=earley.resolve_ambiguity,
+        complete_lex=earley.complete_lex, debug=earley.debug, tree_class=earley.Tree, ordered_sets=earley.Set is not set)
+    return parser
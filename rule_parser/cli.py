@@ -0,0 +1,63 @@
+import argparse
+
+# Command line arguments only. This module must not import lark, xdsl or the rest of rule_parser,
+# main.py builds its argument parser from it before it knows which of them the command needs.
+
+# the arguments that select what the pipeline prints
+STAGE_FLAGS = ["unchecked", "type_checked", "canonicalized", "before_printing", "after_events", "after_inline", "before_bounding"]
+
+DEFAULT_MAX_CACHE_SIZE = 256 * 1024 * 1024
+
+def add_budget_arguments(ap):
+    ap.add_argument("--max-parse-seconds", type=float, default=None, help="give up on a sentence after parsing it for this many seconds")
+    ap.add_argument("--max-chart-items", type=int, default=None, help="give up on a sentence once its earley chart holds this many items")
+    return ap
+
+def add_stage_arguments(ap):
+    ap.add_argument("--unchecked", action='store_true', default=False)
+    ap.add_argument("--type-checked", action='store_true', default=False)
+    ap.add_argument("--canonicalized", action='store_true', default=False)
+    ap.add_argument("--before-printing", action='store_true', default=False)
+    ap.add_argument("--after-events", action='store_true', default=False)
+    ap.add_argument("--after-inline", action='store_true', default=False)
+    ap.add_argument("--before-bounding", action='store_true', default=False)
+    ap.add_argument("--earley", action='store_true', default=False, help="skip the LALR fast path")
+    ap.add_argument("--inline-lowering", action='store_true', default=False, help="lower the leaves of the parse while the LALR fast path reduces them")
+    ap.add_argument("--partial", action='store_true', default=False, help="compile the sentences that are supported and leave a placeholder comment for the others")
+    ap.add_argument("--template-cache", action='store_true', default=False, help="parse once the sentences that only differ in their numbers, model keywords and unit names")
+    ap.add_argument("--timing", action='store_true', default=False, help="record the time, operation count and peak traced memory of every pass")
+    ap.add_argument("--timing-format", default="table", choices=["table", "json"], help="how --timing reports the passes")
+    add_budget_arguments(ap)
+    return ap
+
+def add_cache_arguments(ap):
+    ap.add_argument("--cache", action='store_true', default=False, help="reuse the output of rules that were already compiled")
+    ap.add_argument("--cache-dir", default=None, help="directory of the compile cache")
+    ap.add_argument("--cache-max-size", type=int, default=DEFAULT_MAX_CACHE_SIZE, help="bytes of output kept before evicting the least recently used rules")
+    ap.add_argument("--cache-stats", action='store_true', default=False, help="print the compile cache statistics and exit")
+    return ap
+
+def get_arg_parser():
+    ap = argparse.ArgumentParser(
+        description="Parse game rules and turns them into rulebook code."
+                    "Pass '-' to read from stdin.")
+    ap.add_argument("path", help="path to dump file or '-' for stdin", default="-", nargs="?")
+    ap.add_argument("-o", help="output", default="-", nargs="?")
+    add_stage_arguments(ap)
+    ap.add_argument("--verify", action='store_true', default=False)
+    ap.add_argument("--jsonl", action='store_true', default=False, help="read one {\"id\", \"text\"} json record per line and write one result record per line")
+    ap.add_argument("--serve", metavar="SOCKET", default=None, help="keep running and compile the requests received on this unix socket")
+    ap.add_argument("--lalr-conflicts", action='store_true', default=False, help="report the productions that keep the grammar from being LALR and exit")
+    ap.add_argument("--generate-parser", action='store_true', default=False, help="write the pregenerated LALR parser module of the grammar and exit")
+    return ap
+
+# builds the argument namespace of a run that prints the selected stages
+def make_stage_args(stages=(), earley=False):
+    ap = add_stage_arguments(argparse.ArgumentParser())
+    args = ap.parse_args([])
+    for stage in stages:
+        if stage not in STAGE_FLAGS:
+            raise ValueError(f"unknown stage {stage}, expected one of {', '.join(STAGE_FLAGS)}")
+        setattr(args, stage, True)
+    args.earley = earley
+    return args
@@ -0,0 +1,158 @@
+from .cli import DEFAULT_MAX_CACHE_SIZE, STAGE_FLAGS, add_cache_arguments
+from .grammar import GRAMMAR_PATH, cache_dir, grammar_file_digest
+import hashlib
+import os
+import sqlite3
+import time
+
+# bump whenever a change to the passes or to the serializer changes the produced output, cached
+# outputs compiled by an older pipeline are then ignored
+PIPELINE_VERSION = 3
+
+# lookups are counted in memory and written, with the order the hits used their entries in, along
+# with the next put or once this many lookups or seconds have gone by. A hit then only reads and
+# never waits for the write lock, the counters and the use order other processes see lag behind
+USE_BATCH = 64
+USE_SECONDS = 1.0
+
+# final pipeline outputs, addressed by the hash of everything that can change them: the rule text,
+# the grammar, the pipeline version and the stage flags. The index lives in sqlite so that every
+# worker of a corpus run can share it.
+class CompileCache:
+    def __init__(self, directory: str = None, max_size: int = DEFAULT_MAX_CACHE_SIZE, grammar_path: str = GRAMMAR_PATH):
+        self.directory = directory if directory is not None else os.path.join(cache_dir(), "compile")
+        self.max_size = max_size
+        self.grammar_path = grammar_path
+        os.makedirs(self.directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.directory, "outputs.sqlite"), timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode only checkpoints are synced, a crash can lose the last outputs but never
+        # corrupts the index, losing an output only costs compiling it again
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, output TEXT NOT NULL, size INTEGER NOT NULL, last_used INTEGER NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.db.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0), ('evictions', 0), ('size', 0), ('clock', 0)")
+        self.pending_hits = 0
+        self.pending_misses = 0
+        self.pending_uses = {}
+        self.pending_since = None
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.cache_dir, args.cache_max_size)
+
+    def key(self, text: str, args) -> str:
+        flags = ",".join(f"{flag}={getattr(args, flag, False)}" for flag in STAGE_FLAGS)
+        # a partial compilation succeeds with a different output where the full one fails, and the
+        # earley parser accepts sentences the LALR fast path does not
+        if getattr(args, "partial", False):
+            flags = flags + ",partial"
+        if getattr(args, "earley", False):
+            flags = flags + ",earley"
+        content = "\0".join([text, grammar_file_digest(self.grammar_path), str(PIPELINE_VERSION), flags])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def increment(self, name: str, amount: int = 1):
+        self.db.execute("UPDATE counters SET value = value + ? WHERE name = ?", (amount, name))
+
+    # a logical clock shared by every process using the cache, orders the entries by last use
+    def tick(self):
+        self.increment("clock")
+        return self.db.execute("SELECT value FROM counters WHERE name = 'clock'").fetchone()[0]
+
+    def get(self, key: str):
+        row = self.db.execute("SELECT output FROM entries WHERE key = ?", (key, )).fetchone()
+        if row is None:
+            self.pending_misses = self.pending_misses + 1
+        else:
+            self.pending_hits = self.pending_hits + 1
+            self.pending_uses.pop(key, None)
+            self.pending_uses[key] = None
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+        if self.pending_hits + self.pending_misses >= USE_BATCH or time.monotonic() - self.pending_since >= USE_SECONDS:
+            self.flush()
+        return None if row is None else row[0]
+
+    # inside a write transaction, the entries used since the last write become the most recent
+    def write_uses(self):
+        self.increment("hits", self.pending_hits)
+        self.increment("misses", self.pending_misses)
+        for key in self.pending_uses:
+            self.db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (self.tick(), key))
+
+    def forget_uses(self):
+        self.pending_hits = 0
+        self.pending_misses = 0
+        self.pending_uses = {}
+        self.pending_since = None
+
+    def flush(self):
+        if self.pending_since is None:
+            return
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.write_uses()
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.forget_uses()
+
+    def put(self, key: str, output: str):
+        size = len(output.encode("utf-8"))
+        if size > self.max_size:
+            return
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.write_uses()
+            row = self.db.execute("SELECT size FROM entries WHERE key = ?", (key, )).fetchone()
+            if row is not None:
+                self.increment("size", -row[0])
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, output, size, self.tick()))
+            self.increment("size", size)
+            self.evict()
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.forget_uses()
+
+    # drops the least recently used outputs until the cache fits in max_size again
+    def evict(self):
+        (total, ) = self.db.execute("SELECT value FROM counters WHERE name = 'size'").fetchone()
+        while total > self.max_size:
+            victims = self.db.execute("SELECT key, size FROM entries ORDER BY last_used LIMIT 64").fetchall()
+            if len(victims) == 0:
+                break
+            for key, size in victims:
+                if total <= self.max_size:
+                    break
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key, ))
+                self.increment("size", -size)
+                self.increment("evictions")
+                total = total - size
+
+    def stats(self):
+        self.flush()
+        counters = dict(self.db.execute("SELECT name, value FROM counters").fetchall())
+        (entries, ) = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()
+        lookups = counters["hits"] + counters["misses"]
+        counters["entries"] = entries
+        counters["hit_rate"] = counters["hits"] / lookups if lookups != 0 else 0.0
+        return counters
+
+    def print_stats(self, out):
+        stats = self.stats()
+        out.write(f"compile cache {self.directory}\n")
+        out.write(f"  entries:   {stats['entries']}\n")
+        out.write(f"  size:      {stats['size']} / {self.max_size} bytes\n")
+        out.write(f"  hits:      {stats['hits']}\n")
+        out.write(f"  misses:    {stats['misses']}\n")
+        out.write(f"  hit rate:  {stats['hit_rate']:.1%}\n")
+        out.write(f"  evictions: {stats['evictions']}\n")
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,318 @@
+from concurrent.futures import ProcessPoolExecutor
+from lark import UnexpectedInput
+from .ambiguity import AmbiguityReport
+from .budget import ParseBudget, ParseBudgetExceeded, ParseMeter
+from .cli import add_cache_arguments, add_stage_arguments
+from .driver import compile_text, describe_error
+from .grammar import get_fast_path_parser, get_parser
+from .compile_cache import CompileCache
+from .normalize import normalize_text
+from .pass_timing import PassTimer
+from .prefilter import RejectedText, get_prefilter
+from .sentences import parse_sentence_metered, split_sentences
+from .templates import TemplateCache
+import argparse
+import copy
+import json
+import multiprocessing.util
+import os
+import pathlib
+import sys
+import time
+import traceback
+
+def get_corpus_arg_parser():
+    ap = argparse.ArgumentParser(
+        description="Compile every rule of a corpus into rulebook code. The input is either a "
+                    "directory, searched recursively for .txt files, or a manifest listing one rule path per line.")
+    ap.add_argument("input", help="directory of rule texts or manifest file")
+    ap.add_argument("-o", help="output directory", default="corpus_output")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    ap.add_argument("--dedup-sentences", action='store_true', default=False, help="parse every distinct sentence of the corpus once, before compiling the rules")
+    ap.add_argument("--ambiguity-report", action='store_true', default=False, help="instead of compiling, parse every sentence keeping all its derivations and report the productions that cost the most chart items")
+    ap.add_argument("--report-limit", type=int, default=30, help="productions printed by --ambiguity-report, ambiguity.json holds all of them")
+    add_stage_arguments(ap)
+    add_cache_arguments(ap)
+    return ap
+
+class CorpusEntry:
+    def __init__(self, path: pathlib.Path, name: str):
+        self.path = path
+        self.name = name
+
+def read_manifest(manifest: pathlib.Path):
+    entries = []
+    with open(manifest, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            path = pathlib.Path(line)
+            if not path.is_absolute():
+                path = manifest.parent / path
+            entries.append(CorpusEntry(path, line))
+    return entries
+
+def collect_entries(input_path: str):
+    root = pathlib.Path(input_path)
+    if root.is_dir():
+        return [CorpusEntry(path, str(path.relative_to(root))) for path in sorted(root.rglob("*.txt"))]
+    return read_manifest(root)
+
+def output_path(output_dir: str, entry: CorpusEntry, suffix: str):
+    name = pathlib.Path(entry.name)
+    if name.is_absolute():
+        name = pathlib.Path(*name.parts[1:])
+    return pathlib.Path(output_dir) / name.with_suffix(suffix)
+
+# runs once in every worker, so that the grammar is loaded before the first rule arrives instead
+# of being paid inside the timing of whatever rule happens to be first.
+def warm_worker(fast_path: bool):
+    if fast_path:
+        get_fast_path_parser()
+    get_parser(parser="earley")
+
+worker_cache = None
+
+# each worker process opens its own connection to the shared cache, and writes the lookups it
+# has not written yet when it exits. Pool workers skip atexit, multiprocessing finalizers run
+def get_worker_cache(args):
+    global worker_cache
+    if not args.cache:
+        return None
+    if worker_cache is None:
+        worker_cache = CompileCache.from_args(args)
+        multiprocessing.util.Finalize(worker_cache, worker_cache.close, exitpriority=10)
+    return worker_cache
+
+def flush_worker_cache():
+    if worker_cache is not None:
+        worker_cache.flush()
+
+worker_templates = None
+
+# the templates are per worker process, they are learnt from the rules the worker compiled before
+def get_worker_templates(args):
+    global worker_templates
+    if not args.template_cache:
+        return None
+    if worker_templates is None:
+        worker_templates = TemplateCache()
+    return worker_templates
+
+# sentences are compared normalized and without their surrounding whitespace, which the grammar ignores
+def sentence_key(text: str):
+    return text.strip()
+
+# the keys of the sentences of every entry, and how many times each of them occurs in the corpus
+def collect_sentences(entries):
+    keys = []
+    occurrences = {}
+    for entry in entries:
+        try:
+            text = entry.path.read_text(encoding="utf-8")
+        except OSError:
+            keys.append([])
+            continue
+        keys.append([sentence_key(sentence.text) for sentence in split_sentences(normalize_text(text).text)])
+        for key in keys[-1]:
+            occurrences[key] = occurrences.get(key, 0) + 1
+    return keys, occurrences
+
+# the parse of a distinct sentence, as the tree, chart size and parse time, or the
+# ParseBudgetExceeded it raised. Sentences the prefilter or the parser reject give None, the rules
+# that contain them parse them again to report their own error.
+def parse_distinct_sentence(key: str, args):
+    fast_path = not args.earley
+    if get_prefilter(fast_path=fast_path).check(key) is not None:
+        return None
+    templates = get_worker_templates(args)
+    try:
+        if templates is not None:
+            tree, meter = templates.parse(key, fast_path, ParseBudget.from_args(args), args.inline_lowering)
+        else:
+            tree, meter = parse_sentence_metered(key, fast_path, ParseBudget.from_args(args), args.inline_lowering)
+    except ParseBudgetExceeded as e:
+        return e
+    except UnexpectedInput:
+        return None
+    return tree, meter.chart_items, meter.seconds
+
+# Answers the sentences of a rule from the parses of the distinct sentences of the corpus, the
+# sentences it does not know are parsed, through the fallback when there is one.
+class SentenceTable:
+    def __init__(self, parsed, fallback=None):
+        self.parsed = parsed
+        self.fallback = fallback
+        self.hits = 0
+
+    def parse(self, text: str, fast_path=True, budget=None, inline=False):
+        parsed = self.parsed.get(sentence_key(text))
+        if parsed is None:
+            if self.fallback is not None:
+                return self.fallback.parse(text, fast_path, budget, inline)
+            return parse_sentence_metered(text, fast_path, budget, inline)
+        self.hits = self.hits + 1
+        if isinstance(parsed, ParseBudgetExceeded):
+            raise copy.copy(parsed)
+        tree, chart_items, seconds = parsed
+        meter = ParseMeter(budget)
+        meter.chart_items = chart_items
+        meter.seconds = seconds
+        return tree, meter
+
+# never raises, a failing rule is recorded and the batch moves on. With sentence deduplication,
+# sentences maps the sentences of the rule to their parse, see parse_distinct_sentence.
+def compile_entry(entry: CorpusEntry, args, output_dir: str, sentences=None):
+    start = time.perf_counter()
+    record = {"name": entry.name, "path": str(entry.path)}
+    stats = []
+    timer = PassTimer() if getattr(args, "timing", False) else None
+    templates = get_worker_templates(args)
+    hits = templates.hits if templates is not None else 0
+    table = SentenceTable(sentences, templates) if sentences is not None else None
+    try:
+        text = entry.path.read_text(encoding="utf-8")
+        output = compile_text(text, args, get_worker_cache(args), stats=stats, sentence_cache=table if table is not None else templates, timer=timer)
+        path = output_path(output_dir, entry, ".rl")
+        record["ok"] = True
+    except Exception as e:
+        output = traceback.format_exc()
+        path = output_path(output_dir, entry, ".err")
+        record["ok"] = False
+        record["error"] = describe_error(e)
+        if isinstance(e, RejectedText):
+            record["rejected"] = e.rejection.reason
+        if isinstance(e, ParseBudgetExceeded):
+            record["budget_exceeded"] = e.to_record()
+            stats.append({"position": e.position, "chart_items": e.chart_items, "seconds": e.seconds})
+
+    # the largest chart of the rule, cached outputs were not parsed and have no chart
+    record["chart_items"] = max((sentence["chart_items"] for sentence in stats), default=0)
+    record["sentences"] = len(stats)
+    record["unsupported"] = [sentence["unsupported"] for sentence in stats if "unsupported" in sentence]
+    record["templated"] = templates.hits - hits if templates is not None else 0
+    record["deduplicated"] = table.hits if table is not None else 0
+    record["seconds"] = time.perf_counter() - start
+    if timer is not None:
+        record["passes"] = timer.records
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(output, encoding="utf-8")
+        record["output"] = str(path)
+    except OSError as e:
+        record["ok"] = False
+        record["error"] = f"could not write {path}: {e}"
+    return record
+
+# large chunks keep the inter process traffic small, while still leaving a few chunks per worker
+# so that a slow rule does not stall a whole core at the end of the batch
+def pool_map(executor, jobs: int):
+    def map(function, *iterables):
+        chunksize = max(1, len(iterables[0]) // (jobs * 4))
+        return executor.map(function, *iterables, chunksize=chunksize)
+    return map
+
+# compiles the entries through map, the builtin one or the one of a process pool, and returns their
+# records and the dedup report. With dedup_sentences, every distinct sentence of the corpus is
+# parsed once, then each rule is compiled from the parses of its sentences.
+def compile_entries(map, entries, args, output_dir: str):
+    count = len(entries)
+    if not getattr(args, "dedup_sentences", False):
+        return list(map(compile_entry, entries, [args] * count, [output_dir] * count)), None
+
+    keys, occurrences = collect_sentences(entries)
+    distinct = list(occurrences)
+    start = time.perf_counter()
+    parsed = dict(zip(distinct, map(parse_distinct_sentence, distinct, [args] * len(distinct))))
+    total = sum(occurrences.values())
+    report = {
+        "sentences": total,
+        "distinct": len(distinct),
+        "ratio": total / len(distinct) if len(distinct) != 0 else 1.0,
+        "parsed": sum(1 for value in parsed.values() if isinstance(value, tuple)),
+        "parse_seconds": time.perf_counter() - start,
+        "most_shared": [{"sentence": key, "occurrences": occurrences[key]} for key in sorted(distinct, key=lambda key: -occurrences[key])[:10]],
+    }
+    sentences = [{key: parsed[key] for key in entry_keys if parsed[key] is not None} for entry_keys in keys]
+    return list(map(compile_entry, entries, [args] * count, [output_dir] * count, sentences)), report
+
+# the passes of every rule of a batch, cached rules ran none
+def batch_pass_timer(records):
+    timer = PassTimer()
+    for record in records:
+        timer.add_records(record.get("passes", []))
+    return timer
+
+def compile_corpus(entries, args, output_dir: str, jobs: int = None):
+    jobs = max(1, jobs or 1)
+    start = time.perf_counter()
+    if jobs == 1:
+        warm_worker(not args.earley)
+        records, dedup = compile_entries(map, entries, args, output_dir)
+        flush_worker_cache()
+    else:
+        with ProcessPoolExecutor(jobs, initializer=warm_worker, initargs=(not args.earley, )) as executor:
+            records, dedup = compile_entries(pool_map(executor, jobs), entries, args, output_dir)
+
+    failed = [record for record in records if not record["ok"]]
+    summary = {
+        "rules": len(records),
+        "compiled": len(records) - len(failed),
+        "failed": len(failed),
+        "rejected": sum(1 for record in failed if "rejected" in record),
+        "budget_exceeded": sum(1 for record in failed if "budget_exceeded" in record),
+        "sentences": sum(record["sentences"] for record in records),
+        "templated": sum(record["templated"] for record in records),
+        "deduplicated": sum(record["deduplicated"] for record in records),
+        "partial": sum(1 for record in records if record["ok"] and len(record["unsupported"]) != 0),
+        "unsupported": sum(len(record["unsupported"]) for record in records),
+        "largest_charts": [{"name": record["name"], "chart_items": record["chart_items"]} for record in sorted(records, key=lambda record: -record["chart_items"])[:10]],
+        "jobs": jobs,
+        "seconds": time.perf_counter() - start,
+        "rule_seconds": sum(record["seconds"] for record in records),
+        "records": records,
+    }
+    if dedup is not None:
+        summary["dedup"] = dedup
+    if getattr(args, "timing", False):
+        summary["passes"] = batch_pass_timer(records).summary()
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+# the analysis runs in this process, the sentences of the corpus are few next to its rules
+def report_ambiguity(entries, output_dir: str, out, limit: int = None):
+    report = AmbiguityReport()
+    for entry in entries:
+        report.add_text(entry.path.read_text(encoding="utf-8"))
+    os.makedirs(output_dir, exist_ok=True)
+    report.dump(os.path.join(output_dir, "ambiguity.json"))
+    report.write(out, limit)
+    return report
+
+def main(argv=None):
+    args = get_corpus_arg_parser().parse_args(argv)
+    if args.cache_stats:
+        CompileCache.from_args(args).print_stats(sys.stdout)
+        return 0
+    entries = collect_entries(args.input)
+    if args.ambiguity_report:
+        report_ambiguity(entries, args.o, sys.stdout, args.report_limit)
+        return 0
+    summary = compile_corpus(entries, args, args.o, args.jobs)
+    print(f"compiled {summary['compiled']}/{summary['rules']} rules in {summary['seconds']:.2f}s with {summary['jobs']} workers, {summary['failed']} failed, {summary['rejected']} of them rejected before parsing, {summary['budget_exceeded']} over the parse budget")
+    if args.template_cache:
+        print(f"{summary['templated']}/{summary['sentences']} sentences instantiated from a template instead of parsed")
+    if args.partial:
+        print(f"{summary['partial']} rules compiled partially, leaving out {summary['unsupported']} unsupported sentences")
+    if args.dedup_sentences:
+        dedup = summary["dedup"]
+        print(f"{dedup['distinct']} distinct sentences out of {dedup['sentences']}, a dedup ratio of {dedup['ratio']:.2f}, {dedup['parsed']} of them parsed in {dedup['parse_seconds']:.2f}s")
+    if args.timing:
+        batch_pass_timer(summary["records"]).report(sys.stdout, args.timing_format)
+    for record in summary["records"]:
+        if not record["ok"]:
+            print(f"  {record['name']}: {record['error']}")
+    return 0 if summary["failed"] == 0 else 1
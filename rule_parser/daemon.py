@@ -0,0 +1,131 @@
+from .driver import compile_text, describe_error, make_context, make_stage_args
+from .grammar import get_fast_path_parser, get_parser
+from .session import CompileSession
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+import traceback
+
+WARM_UP_TEXT = "Each time this model destroys an enemy CHARACTER model, you gain 1CP."
+
+# one json object per line in both directions.
+# request:  {"id": any, "text": str, "stages": ["canonicalized", ...], "earley": bool, "session": str}
+# response: {"id": any, "output": str, "seconds": float} or {"id": any, "error": str, "traceback": str, "seconds": float}
+class CompileRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if line.strip() == b"":
+                continue
+            response = self.server.compile_request(line)
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+class SocketPathInUse(Exception):
+    pass
+
+# a socket left behind by a server that is gone is removed, a server still listening on it or
+# anything that is not a socket is never touched
+def remove_stale_socket(socket_path: str):
+    try:
+        mode = os.lstat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise SocketPathInUse(f"{socket_path} exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+        except ConnectionRefusedError:
+            os.unlink(socket_path)
+            return
+        except OSError as e:
+            raise SocketPathInUse(f"cannot tell whether {socket_path} is in use: {e}") from e
+    raise SocketPathInUse(f"a server is already listening on {socket_path}")
+
+# keeps the parsers and the xdsl context alive between requests, so that a request only pays for
+# parsing its own sentences and running the passes.
+class CompileServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str):
+        remove_stale_socket(socket_path)
+        super().__init__(socket_path, CompileRequestHandler)
+        self.socket_path = socket_path
+        self.ctx = make_context()
+        self.stage_args = {}
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        try:
+            self.warm_up()
+        except BaseException:
+            self.server_close()
+            raise
+
+    def warm_up(self):
+        get_fast_path_parser()
+        get_parser(parser="earley")
+        compile_text(WARM_UP_TEXT, self.get_stage_args((), False), ctx=self.ctx)
+
+    def get_stage_args(self, stages, earley):
+        key = (tuple(sorted(stages)), earley)
+        args = self.stage_args.get(key)
+        if args is None:
+            args = make_stage_args(stages, earley)
+            self.stage_args[key] = args
+        return args
+
+    # requests naming a session, such as the buffer of an editor, only recompile the sentences
+    # that changed since the previous request of that session
+    def get_session(self, name: str, stages, earley):
+        key = (name, tuple(sorted(stages)), earley)
+        with self.sessions_lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = (threading.Lock(), CompileSession(self.get_stage_args(stages, earley), self.ctx))
+                self.sessions[key] = session
+        return session
+
+    def compile_request(self, line: bytes):
+        start = time.perf_counter()
+        response = {}
+        try:
+            request = json.loads(line)
+            response["id"] = request.get("id")
+            stages, earley = request.get("stages", []), request.get("earley", False)
+            if "session" in request:
+                lock, session = self.get_session(request["session"], stages, earley)
+                with lock:
+                    response["output"] = session.compile(request["text"])
+            else:
+                response["output"] = compile_text(request["text"], self.get_stage_args(stages, earley), ctx=self.ctx)
+        except Exception as e:
+            response["error"] = describe_error(e)
+            response["traceback"] = traceback.format_exc()
+        response["seconds"] = time.perf_counter() - start
+        return response
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+def stop_serving(signum, frame):
+    raise SystemExit(0)
+
+# the socket is removed however the server stops, SIGTERM included
+def serve(socket_path: str):
+    signal.signal(signal.SIGTERM, stop_serving)
+    server = CompileServer(socket_path)
+    try:
+        print(f"compile server listening on {socket_path}", file=sys.stderr)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -188,6 +188,20 @@ class Keyword(StrEnum):
 class KeywordAttr(EnumAttribute[Keyword]):
     name = "rul.keyword"
 
+# the values of the unit_name, stratagem and weapon_name entries of the lexicon
+class UnitName(StrEnum):
+    RIPPER_SWARMS = auto()
+    SPORE_MINES = auto()
+    MUCOLID_SPORES = auto()
+
+class StratagemName(StrEnum):
+    RAPID_INGRESS = auto()
+    HEROIC_INTERVENTION = auto()
+    FIRE_OVERWATCH = auto()
+
+class WeaponName(StrEnum):
+    BARBED_OVIPOSITOR = auto()
+
 class Characteristic(StrEnum):
     LEADERSHIP = auto()
     MOVE = auto()
@@ -1192,10 +1206,23 @@ class Targets(IRDLOperation, MappableOntoFunction):
     def make(cls):
         return cls.build(regions=[Region(Block()), Region(Block()), Region(Block())])
 
+# a sentence left out of a partial compilation, the serializer emits it as a comment
+@irdl_op_definition
+class UnsupportedSentence(IRDLOperation):
+    name = "rul.unsupported_sentence"
+    text: Attribute = attr_def(StringAttr)
+    reason: Attribute = attr_def(StringAttr)
+
+    assembly_format = "$text `because` $reason attr-dict"
+
+    @classmethod
+    def make(cls, text: str, reason: str):
+        return cls.build(attributes={"text": StringAttr(text), "reason": StringAttr(reason)})
+
 
 class RulDialect(Dialect):
     def __init__(self):
-        super().__init__(operations=[SelectSubject, EachTimeEffect,BelongsTo, TimedEffect, UntilEffect, IfStatement, RLCFunction, All, ConditionalEffect, TrueOp,HasKeyword, And, IsOwnedBy, ThisSubject, FilterList, IsAttackMadeWeapon, Ability, MovementKindAttr, WeaponQualifierKindAttr, KeywordAttr, CharacteristicAttr, WeaponCharacteristicAttr, WeaponAbilityKindAttr, WeaponAbilityAttr, ObtainWeaponAbility, TimeQualifierAttr, PlayerAttr, BelowHalfStrenght, BelowStartingStrenght, AddUnitToArmy, BattleShocked, UsingAbilitySubject, Leading, LeadedUnit, DestroyedSubject, ObtainCover, ObtainInvulnerableSave, OnTheBattleField, FellBack, SubjectsIn, SuchSubject], attributes=[ModelType, BoolType, AbilityKindAttr, AbilityType, UnitType, StratagemUseType, AbilityUseType, UnknownType, StratagemType, IntegerRangeAttr, DiceExpression, TimeInstantAttr, TimeEventType])
+        super().__init__(operations=[SelectSubject, EachTimeEffect,BelongsTo, TimedEffect, UntilEffect, IfStatement, RLCFunction, All, ConditionalEffect, TrueOp,HasKeyword, And, IsOwnedBy, ThisSubject, FilterList, IsAttackMadeWeapon, Ability, MovementKindAttr, WeaponQualifierKindAttr, KeywordAttr, CharacteristicAttr, WeaponCharacteristicAttr, WeaponAbilityKindAttr, WeaponAbilityAttr, ObtainWeaponAbility, TimeQualifierAttr, PlayerAttr, BelowHalfStrenght, BelowStartingStrenght, AddUnitToArmy, BattleShocked, UsingAbilitySubject, Leading, LeadedUnit, DestroyedSubject, ObtainCover, ObtainInvulnerableSave, OnTheBattleField, FellBack, SubjectsIn, SuchSubject, UnsupportedSentence], attributes=[ModelType, BoolType, AbilityKindAttr, AbilityType, UnitType, StratagemUseType, AbilityUseType, UnknownType, StratagemType, IntegerRangeAttr, DiceExpression, TimeInstantAttr, TimeEventType])
 
 
 if __name__ == "__main__":
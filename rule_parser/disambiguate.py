@@ -0,0 +1,87 @@
+from lark.parsers.earley_forest import ForestVisitor, StableSymbolNode, SymbolNode
+from operator import attrgetter
+from .budget import current_meter
+
+# The earley parser resolves an ambiguity by taking, at every symbol of the forest, the derivation
+# with the highest priority and then the first alternative of the rule. Alternatives come first in
+# the grammar for reasons that have nothing to do with ambiguity, so instead every derivation is
+# ranked by how far its modifiers are from what they modify, the same way a reader attaches "in
+# that unit" in "weapons equipped by models in that unit" to the models and not to the weapons.
+# The subjects a constraint is attached to decide which subject a later "that unit" refers to, so
+# the ranking is also what the semantical analyzer resolves references against.
+#
+# The ranking is a bottom up walk of the part of the packed forest below an ambiguous symbol, done
+# when the parser first expands that symbol into the parse tree. A sentence without ambiguities is
+# never walked, it costs what it cost before the ranking.
+
+UNRANKED = float("-inf")
+
+# characters between a left recursive rule and the modifier it attaches, for a rule `x: x y` that
+# is the length of the inner x, which the forest holds as the intermediate node of `x: x * y`
+def attachment_distance(node):
+    rule = node.rule
+    if node.parent.is_intermediate or len(rule.expansion) != 2 or rule.expansion[0] != rule.origin:
+        return 0
+    if not isinstance(node.left, SymbolNode):
+        return 0
+    return node.left.end - node.left.start
+
+# sets the priority of every node to minus the attachment distance of its best derivation, which
+# is what the parser sorts the derivations by before their rule order. Symbols ranked by an
+# earlier walk are not walked again.
+class RankingVisitor(ForestVisitor):
+    def __init__(self):
+        super().__init__(single_visit=True)
+
+    def visit_packed_node_in(self, node):
+        yield node.left
+        yield node.right
+
+    def visit_symbol_node_in(self, node):
+        if node.priority != UNRANKED:
+            return iter(())
+        if not node.paths_loaded:
+            node.load_paths()
+        return iter(node._children)
+
+    def visit_packed_node_out(self, node):
+        priority = -attachment_distance(node)
+        priority += getattr(node.left, "priority", 0)
+        priority += getattr(node.right, "priority", 0)
+        node.priority = priority
+
+    def visit_symbol_node_out(self, node):
+        if node.priority == UNRANKED:
+            node.priority = max(child.priority for child in node._children)
+
+# the derivations of an ambiguous symbol are ranked before the parser picks one of them, the
+# parser asks every symbol it expands, which is where the parse meter checks the time spent
+class RankedChildren:
+    __slots__ = ()
+
+    @property
+    def children(self):
+        meter = current_meter()
+        if meter is not None:
+            meter.forest_node()
+        if not self.paths_loaded:
+            self.load_paths()
+        if self.priority == UNRANKED and len(self._children) > 1:
+            RankingVisitor().visit(self)
+        return sorted(self._children, key=attrgetter("sort_key"))
+
+class RankedSymbolNode(RankedChildren, SymbolNode):
+    __slots__ = ()
+
+class StableRankedSymbolNode(RankedChildren, StableSymbolNode):
+    __slots__ = ()
+
+RANKED_SYMBOL_NODES = {SymbolNode: RankedSymbolNode, StableSymbolNode: StableRankedSymbolNode}
+
+# a parser without rule priorities of its own resolves its ambiguities by ranking them
+def rank_ambiguities(parser):
+    frontend = getattr(parser, "parser", None)
+    earley = getattr(frontend, "parser", None)
+    if getattr(earley, "resolve_ambiguity", False) and earley.forest_sum_visitor is None:
+        earley.SymbolNode = RANKED_SYMBOL_NODES.get(earley.SymbolNode, earley.SymbolNode)
+    return parser
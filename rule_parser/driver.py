@@ -3,30 +3,21 @@ from .rlc_serialize import *
 from .passes import *
 from .semantic_analizer import *
 from .to_ast import *
+from .grammar import *
+from .normalize import *
+from .sentences import *
+from .templates import *
+from .budget import *
+from .cli import *
+from .pass_timing import *
 import argparse
+import io
 
-def get_arg_parser():
-    ap = argparse.ArgumentParser(
-        description="Parse game rules and turns them into rulebook code."
-                    "Pass '-' to read from stdin.")
-    ap.add_argument("path", help="path to dump file or '-' for stdin", default="-", nargs="?")
-    ap.add_argument("-o", help="output", default="-", nargs="?")
-    ap.add_argument("--unchecked", action='store_true', default=False)
-    ap.add_argument("--type-checked", action='store_true', default=False)
-    ap.add_argument("--canonicalized", action='store_true', default=False)
-    ap.add_argument("--before-printing", action='store_true', default=False)
-    ap.add_argument("--after-events", action='store_true', default=False)
-    ap.add_argument("--after-inline", action='store_true', default=False)
-    ap.add_argument("--before-bounding", action='store_true', default=False)
-    ap.add_argument("--verify", action='store_true', default=False)
-    return ap
-
-def parse(text):
-    with open("./40k.lark", encoding="utf-8") as f:
-        grammar = f.read()
-
-    parser = Lark(grammar, start="start", parser="earley")
-    tree = parser.parse(text)
+# with prefilter, the default, text holding a token that no terminal of the grammar matches raises
+# RejectedText, the UnexpectedCharacters of that token, before any sentence is parsed. Without it
+# the parser raises its own error, at the first token it could not take
+def parse(text, fast_path=True, executor=None, prefilter=True, budget=None, stats=None, inline=False, sentence_cache=None, partial=False):
+    tree = join_sentence_trees(parse_sentences(text, fast_path, executor, prefilter, budget, stats, inline, sentence_cache, partial))
     transformer = ToAst()
     ast = transformer.visit(tree)
     return ast
@@ -70,11 +61,80 @@ def make_pipeline(args, out):
     passes.append(RLCSerializer(out))
     return passes
 
-def run_pipeline(ast: ModuleOp, args, out):
-    pm = PassPipeline(make_pipeline(args, out))
-
+def make_context():
     ctx = Context()
-    pm.apply(ctx, ast)
+    ctx.register_dialect("rul", lambda: RulDialect())
+    return ctx
+
+# the passes are timed by timer when there is one, see PassTimer
+def run_pipeline(ast: ModuleOp, args, out, ctx: Context = None, timer: PassTimer = None):
+    pm = PassPipeline(make_pipeline(args, out), refresh_op_index)
+
+    ctx = ctx if ctx is not None else Context()
+    with indexed_ops(ast):
+        if timer is not None:
+            timer.apply(pm, ctx, ast)
+        else:
+            pm.apply(ctx, ast)
+
+def compile_sentence_trees(trees, args, ctx: Context = None, timer: PassTimer = None) -> str:
+    out = io.StringIO()
+    run_pipeline(ToAst().visit(join_sentence_trees(trees)), args, out, ctx, timer)
+    return out.getvalue()
+
+# the index of the first sentence whose lowering or passes fail, and why, found by compiling
+# longer and longer prefixes of the paragraph
+def first_failing_sentence(trees, args, ctx: Context = None):
+    for end in range(1, len(trees) + 1):
+        try:
+            compile_sentence_trees(trees[:end], args, ctx)
+        except Exception as e:
+            return end - 1, describe_error(e)
+    return None
+
+# Compiles the sentences of text that parse, lower and go through the pipeline, every other one is
+# replaced by an UnsupportedSentence that the serializer emits as a comment. The entries of stats
+# of the replaced sentences record why under "unsupported". Finding the sentence that breaks the
+# lowering or the passes recompiles the paragraph once per sentence, only rules that fail pay it.
+def compile_partial(text: str, args, ctx: Context = None, stats=None, sentence_cache=None, timer: PassTimer = None) -> str:
+    stats = stats if stats is not None else []
+    first = len(stats)
+    trees = parse_sentences(text, fast_path=not args.earley, budget=ParseBudget.from_args(args), stats=stats, inline=args.inline_lowering, sentence_cache=sentence_cache, partial=True)
+    normalized = normalize_text(text)
+    texts = [original_sentence_text(sentence, normalized) for sentence in split_sentences(normalized.text)]
+    while True:
+        try:
+            return compile_sentence_trees(trees, args, ctx, timer)
+        except Exception:
+            failing = first_failing_sentence(trees, args, ctx)
+            if failing is None or "unsupported" in stats[first + failing[0]]:
+                raise
+        (index, reason) = failing
+        trees[index] = unsupported_sentence_tree(texts[index], reason)
+        stats[first + index]["unsupported"] = reason
+
+# a cached output has no module left to verify, with --verify the lookup is skipped and the
+# output compiled again, then stored
+def compile_text(text: str, args, cache=None, ctx: Context = None, stats=None, sentence_cache=None, timer: PassTimer = None) -> str:
+    if cache is not None:
+        key = cache.key(text, args)
+        output = cache.get(key) if not getattr(args, "verify", False) else None
+        if output is not None:
+            return output
+
+    if getattr(args, "partial", False):
+        output = compile_partial(text, args, ctx, stats, sentence_cache, timer)
+    else:
+        out = io.StringIO()
+        ast = parse(text, fast_path=not args.earley, budget=ParseBudget.from_args(args), stats=stats, inline=args.inline_lowering, sentence_cache=sentence_cache)
+        run_pipeline(ast, args, out, ctx, timer)
+        if getattr(args, "verify", False):
+            ast.verify()
+        output = out.getvalue()
+
+    if cache is not None:
+        cache.put(key, output)
+    return output
 
 def run_on_file(file_path: str, out):
     content = open(file_path, encoding="utf-8")
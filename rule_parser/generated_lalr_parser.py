@@ -0,0 +1,3574 @@
+# generated by main.py --generate-parser from 40k.lark, do not edit
+GRAMMAR_DIGEST = 'efca164bfd364b86f3820b14af038924166a4de7449755b4a23ad1145d6fe55c'
+# The file was automatically generated by Lark v1.3.1
+__version__ = "1.3.1"
+
+#
+#
+#   Lark Stand-alone Generator Tool
+# ----------------------------------
+# Generates a stand-alone LALR(1) parser
+#
+# Git:    https://github.com/erezsh/lark
+# Author: Erez Shinan (erezshin@gmail.com)
+#
+#
+#    >>> LICENSE
+#
+#    This tool and its generated code use a separate license from Lark,
+#    and are subject to the terms of the Mozilla Public License, v. 2.0.
+#    If a copy of the MPL was not distributed with this
+#    file, You can obtain one at https://mozilla.org/MPL/2.0/.
+#
+#    If you wish to purchase a commercial license for this tool and its
+#    generated code, you may contact me via email or otherwise.
+#
+#    If MPL2 is incompatible with your free or open-source project,
+#    contact me and we'll work it out.
+#
+#
+
+from copy import deepcopy
+from abc import ABC, abstractmethod
+from types import ModuleType
+from typing import (
+    TypeVar, Generic, Type, Tuple, List, Dict, Iterator, Collection, Callable, Optional, FrozenSet, Any,
+    Union, Iterable, IO, TYPE_CHECKING, overload, Sequence,
+    Pattern as REPattern, ClassVar, Set, Mapping
+)
+
+
+class LarkError(Exception):
+    pass
+
+
+class ConfigurationError(LarkError, ValueError):
+    pass
+
+
+def assert_config(value, options: Collection, msg='Got %r, expected one of %s'):
+    if value not in options:
+        raise ConfigurationError(msg % (value, options))
+
+
+class GrammarError(LarkError):
+    pass
+
+
+class ParseError(LarkError):
+    pass
+
+
+class LexError(LarkError):
+    pass
+
+T = TypeVar('T')
+
+class UnexpectedInput(LarkError):
+    #--
+    line: int
+    column: int
+    pos_in_stream = None
+    state: Any
+    _terminals_by_name = None
+    interactive_parser: 'InteractiveParser'
+
+    def get_context(self, text: str, span: int=40) -> str:
+        #--
+        pos = self.pos_in_stream or 0
+        start = max(pos - span, 0)
+        end = pos + span
+        if not isinstance(text, bytes):
+            before = text[start:pos].rsplit('\n', 1)[-1]
+            after = text[pos:end].split('\n', 1)[0]
+            return before + after + '\n' + ' ' * len(before.expandtabs()) + '^\n'
+        else:
+            before = text[start:pos].rsplit(b'\n', 1)[-1]
+            after = text[pos:end].split(b'\n', 1)[0]
+            return (before + after + b'\n' + b' ' * len(before.expandtabs()) + b'^\n').decode("ascii", "backslashreplace")
+
+    def match_examples(self, parse_fn: 'Callable[[str], Tree]',
+                             examples: Union[Mapping[T, Iterable[str]], Iterable[Tuple[T, Iterable[str]]]],
+                             token_type_match_fallback: bool=False,
+                             use_accepts: bool=True
+                         ) -> Optional[T]:
+        #--
+        assert self.state is not None, "Not supported for this exception"
+
+        if isinstance(examples, Mapping):
+            examples = examples.items()
+
+        candidate = (None, False)
+        for i, (label, example) in enumerate(examples):
+            assert not isinstance(example, str), "Expecting a list"
+
+            for j, malformed in enumerate(example):
+                try:
+                    parse_fn(malformed)
+                except UnexpectedInput as ut:
+                    if ut.state == self.state:
+                        if (
+                            use_accepts
+                            and isinstance(self, UnexpectedToken)
+                            and isinstance(ut, UnexpectedToken)
+                            and ut.accepts != self.accepts
+                        ):
+                            logger.debug("Different accepts with same state[%d]: %s != %s at example [%s][%s]" %
+                                         (self.state, self.accepts, ut.accepts, i, j))
+                            continue
+                        if (
+                            isinstance(self, (UnexpectedToken, UnexpectedEOF))
+                            and isinstance(ut, (UnexpectedToken, UnexpectedEOF))
+                        ):
+                            if ut.token == self.token:  ##
+
+                                logger.debug("Exact Match at example [%s][%s]" % (i, j))
+                                return label
+
+                            if token_type_match_fallback:
+                                ##
+
+                                if (ut.token.type == self.token.type) and not candidate[-1]:
+                                    logger.debug("Token Type Fallback at example [%s][%s]" % (i, j))
+                                    candidate = label, True
+
+                        if candidate[0] is None:
+                            logger.debug("Same State match at example [%s][%s]" % (i, j))
+                            candidate = label, False
+
+        return candidate[0]
+
+    def _format_expected(self, expected):
+        if self._terminals_by_name:
+            d = self._terminals_by_name
+            expected = [d[t_name].user_repr() if t_name in d else t_name for t_name in expected]
+        return "Expected one of: \n\t* %s\n" % '\n\t* '.join(expected)
+
+
+class UnexpectedEOF(ParseError, UnexpectedInput):
+    #--
+    expected: 'List[Token]'
+
+    def __init__(self, expected, state=None, terminals_by_name=None):
+        super(UnexpectedEOF, self).__init__()
+
+        self.expected = expected
+        self.state = state
+        from .lexer import Token
+        self.token = Token("<EOF>", "")  ##
+
+        self.pos_in_stream = -1
+        self.line = -1
+        self.column = -1
+        self._terminals_by_name = terminals_by_name
+
+
+    def __str__(self):
+        message = "Unexpected end-of-input. "
+        message += self._format_expected(self.expected)
+        return message
+
+
+class UnexpectedCharacters(LexError, UnexpectedInput):
+    #--
+
+    allowed: Set[str]
+    considered_tokens: Set[Any]
+
+    def __init__(self, seq, lex_pos, line, column, allowed=None, considered_tokens=None, state=None, token_history=None,
+                 terminals_by_name=None, considered_rules=None):
+        super(UnexpectedCharacters, self).__init__()
+
+        ##
+
+        self.line = line
+        self.column = column
+        self.pos_in_stream = lex_pos
+        self.state = state
+        self._terminals_by_name = terminals_by_name
+
+        self.allowed = allowed
+        self.considered_tokens = considered_tokens
+        self.considered_rules = considered_rules
+        self.token_history = token_history
+
+        if isinstance(seq, bytes):
+            self.char = seq[lex_pos:lex_pos + 1].decode("ascii", "backslashreplace")
+        else:
+            self.char = seq[lex_pos]
+        self._context = self.get_context(seq)
+
+
+    def __str__(self):
+        message = "No terminal matches '%s' in the current parser context, at line %d col %d" % (self.char, self.line, self.column)
+        message += '\n\n' + self._context
+        if self.allowed:
+            message += self._format_expected(self.allowed)
+        if self.token_history:
+            message += '\nPrevious tokens: %s\n' % ', '.join(repr(t) for t in self.token_history)
+        return message
+
+
+class UnexpectedToken(ParseError, UnexpectedInput):
+    #--
+
+    expected: Set[str]
+    considered_rules: Set[str]
+
+    def __init__(self, token, expected, considered_rules=None, state=None, interactive_parser=None, terminals_by_name=None, token_history=None):
+        super(UnexpectedToken, self).__init__()
+
+        ##
+
+        self.line = getattr(token, 'line', '?')
+        self.column = getattr(token, 'column', '?')
+        self.pos_in_stream = getattr(token, 'start_pos', None)
+        self.state = state
+
+        self.token = token
+        self.expected = expected  ##
+
+        self._accepts = NO_VALUE
+        self.considered_rules = considered_rules
+        self.interactive_parser = interactive_parser
+        self._terminals_by_name = terminals_by_name
+        self.token_history = token_history
+
+
+    @property
+    def accepts(self) -> Set[str]:
+        if self._accepts is NO_VALUE:
+            self._accepts = self.interactive_parser and self.interactive_parser.accepts()
+        return self._accepts
+
+    def __str__(self):
+        message = ("Unexpected token %r at line %s, column %s.\n%s"
+                   % (self.token, self.line, self.column, self._format_expected(self.accepts or self.expected)))
+        if self.token_history:
+            message += "Previous tokens: %r\n" % self.token_history
+
+        return message
+
+
+
+class VisitError(LarkError):
+    #--
+
+    obj: 'Union[Tree, Token]'
+    orig_exc: Exception
+
+    def __init__(self, rule, obj, orig_exc):
+        message = 'Error trying to process rule "%s":\n\n%s' % (rule, orig_exc)
+        super(VisitError, self).__init__(message)
+
+        self.rule = rule
+        self.obj = obj
+        self.orig_exc = orig_exc
+
+
+class MissingVariableError(LarkError):
+    pass
+
+
+import sys, re
+import logging
+from dataclasses import dataclass
+from typing import Generic, AnyStr
+
+logger: logging.Logger = logging.getLogger("lark")
+logger.addHandler(logging.StreamHandler())
+##
+
+##
+
+logger.setLevel(logging.CRITICAL)
+
+
+NO_VALUE = object()
+
+T = TypeVar("T")
+
+
+def classify(seq: Iterable, key: Optional[Callable] = None, value: Optional[Callable] = None) -> Dict:
+    d: Dict[Any, Any] = {}
+    for item in seq:
+        k = key(item) if (key is not None) else item
+        v = value(item) if (value is not None) else item
+        try:
+            d[k].append(v)
+        except KeyError:
+            d[k] = [v]
+    return d
+
+
+def _deserialize(data: Any, namespace: Dict[str, Any], memo: Dict) -> Any:
+    if isinstance(data, dict):
+        if '__type__' in data:  ##
+
+            class_ = namespace[data['__type__']]
+            return class_.deserialize(data, memo)
+        elif '@' in data:
+            return memo[data['@']]
+        return {key:_deserialize(value, namespace, memo) for key, value in data.items()}
+    elif isinstance(data, list):
+        return [_deserialize(value, namespace, memo) for value in data]
+    return data
+
+
+_T = TypeVar("_T", bound="Serialize")
+
+class Serialize:
+    #--
+
+    def memo_serialize(self, types_to_memoize: List) -> Any:
+        memo = SerializeMemoizer(types_to_memoize)
+        return self.serialize(memo), memo.serialize()
+
+    def serialize(self, memo = None) -> Dict[str, Any]:
+        if memo and memo.in_types(self):
+            return {'@': memo.memoized.get(self)}
+
+        fields = getattr(self, '__serialize_fields__')
+        res = {f: _serialize(getattr(self, f), memo) for f in fields}
+        res['__type__'] = type(self).__name__
+        if hasattr(self, '_serialize'):
+            self._serialize(res, memo)
+        return res
+
+    @classmethod
+    def deserialize(cls: Type[_T], data: Dict[str, Any], memo: Dict[int, Any]) -> _T:
+        namespace = getattr(cls, '__serialize_namespace__', [])
+        namespace = {c.__name__:c for c in namespace}
+
+        fields = getattr(cls, '__serialize_fields__')
+
+        if '@' in data:
+            return memo[data['@']]
+
+        inst = cls.__new__(cls)
+        for f in fields:
+            try:
+                setattr(inst, f, _deserialize(data[f], namespace, memo))
+            except KeyError as e:
+                raise KeyError("Cannot find key for class", cls, e)
+
+        if hasattr(inst, '_deserialize'):
+            inst._deserialize()
+
+        return inst
+
+
+class SerializeMemoizer(Serialize):
+    #--
+
+    __serialize_fields__ = 'memoized',
+
+    def __init__(self, types_to_memoize: List) -> None:
+        self.types_to_memoize = tuple(types_to_memoize)
+        self.memoized = Enumerator()
+
+    def in_types(self, value: Serialize) -> bool:
+        return isinstance(value, self.types_to_memoize)
+
+    def serialize(self) -> Dict[int, Any]:  ##
+
+        return _serialize(self.memoized.reversed(), None)
+
+    @classmethod
+    def deserialize(cls, data: Dict[int, Any], namespace: Dict[str, Any], memo: Dict[Any, Any]) -> Dict[int, Any]:  ##
+
+        return _deserialize(data, namespace, memo)
+
+
+try:
+    import regex
+    _has_regex = True
+except ImportError:
+    _has_regex = False
+
+if sys.version_info >= (3, 11):
+    import re._parser as sre_parse
+    import re._constants as sre_constants
+else:
+    import sre_parse
+    import sre_constants
+
+categ_pattern = re.compile(r'\\p{[A-Za-z_]+}')
+
+def get_regexp_width(expr: str) -> Union[Tuple[int, int], List[int]]:
+    if _has_regex:
+        ##
+
+        ##
+
+        ##
+
+        regexp_final = re.sub(categ_pattern, 'A', expr)
+    else:
+        if re.search(categ_pattern, expr):
+            raise ImportError('`regex` module must be installed in order to use Unicode categories.', expr)
+        regexp_final = expr
+    try:
+        ##
+
+        return [int(x) for x in sre_parse.parse(regexp_final).getwidth()]
+    except sre_constants.error:
+        if not _has_regex:
+            raise ValueError(expr)
+        else:
+            ##
+
+            ##
+
+            c = regex.compile(regexp_final)
+            ##
+
+            ##
+
+            MAXWIDTH = getattr(sre_parse, "MAXWIDTH", sre_constants.MAXREPEAT)
+            if c.match('') is None:
+                ##
+
+                return 1, int(MAXWIDTH)
+            else:
+                return 0, int(MAXWIDTH)
+
+
+@dataclass(frozen=True)
+class TextSlice(Generic[AnyStr]):
+    #--
+    text: AnyStr
+    start: int
+    end: int
+
+    def __post_init__(self):
+        if not isinstance(self.text, (str, bytes)):
+            raise TypeError("text must be str or bytes")
+
+        if self.start < 0:
+            object.__setattr__(self, 'start', self.start + len(self.text))
+            assert self.start >=0
+
+        if self.end is None:
+            object.__setattr__(self, 'end', len(self.text))
+        elif self.end < 0:
+            object.__setattr__(self, 'end', self.end + len(self.text))
+            assert self.end <= len(self.text)
+
+    @classmethod
+    def cast_from(cls, text: 'TextOrSlice') -> 'TextSlice[AnyStr]':
+        if isinstance(text, TextSlice):
+            return text
+
+        return cls(text, 0, len(text))
+
+    def is_complete_text(self):
+        return self.start == 0 and self.end == len(self.text)
+
+    def __len__(self):
+        return self.end - self.start
+
+    def count(self, substr: AnyStr):
+        return self.text.count(substr, self.start, self.end)
+
+    def rindex(self, substr: AnyStr):
+        return self.text.rindex(substr, self.start, self.end)
+
+
+TextOrSlice = Union[AnyStr, 'TextSlice[AnyStr]']
+LarkInput = Union[AnyStr, TextSlice[AnyStr], Any]
+
+
+
+class Meta:
+
+    empty: bool
+    line: int
+    column: int
+    start_pos: int
+    end_line: int
+    end_column: int
+    end_pos: int
+    orig_expansion: 'List[TerminalDef]'
+    match_tree: bool
+
+    def __init__(self):
+        self.empty = True
+
+
+_Leaf_T = TypeVar("_Leaf_T")
+Branch = Union[_Leaf_T, 'Tree[_Leaf_T]']
+
+
+class Tree(Generic[_Leaf_T]):
+    #--
+
+    data: str
+    children: 'List[Branch[_Leaf_T]]'
+
+    def __init__(self, data: str, children: 'List[Branch[_Leaf_T]]', meta: Optional[Meta]=None) -> None:
+        self.data = data
+        self.children = children
+        self._meta = meta
+
+    @property
+    def meta(self) -> Meta:
+        if self._meta is None:
+            self._meta = Meta()
+        return self._meta
+
+    def __repr__(self):
+        return 'Tree(%r, %r)' % (self.data, self.children)
+
+    __match_args__ = ("data", "children")
+
+    def _pretty_label(self):
+        return self.data
+
+    def _pretty(self, level, indent_str):
+        yield f'{indent_str*level}{self._pretty_label()}'
+        if len(self.children) == 1 and not isinstance(self.children[0], Tree):
+            yield f'\t{self.children[0]}\n'
+        else:
+            yield '\n'
+            for n in self.children:
+                if isinstance(n, Tree):
+                    yield from n._pretty(level+1, indent_str)
+                else:
+                    yield f'{indent_str*(level+1)}{n}\n'
+
+    def pretty(self, indent_str: str='  ') -> str:
+        #--
+        return ''.join(self._pretty(0, indent_str))
+
+    def __rich__(self, parent:Optional['rich.tree.Tree']=None) -> 'rich.tree.Tree':
+        #--
+        return self._rich(parent)
+
+    def _rich(self, parent):
+        if parent:
+            tree = parent.add(f'[bold]{self.data}[/bold]')
+        else:
+            import rich.tree
+            tree = rich.tree.Tree(self.data)
+
+        for c in self.children:
+            if isinstance(c, Tree):
+                c._rich(tree)
+            else:
+                tree.add(f'[green]{c}[/green]')
+
+        return tree
+
+    def __eq__(self, other):
+        try:
+            return self.data == other.data and self.children == other.children
+        except AttributeError:
+            return False
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self) -> int:
+        return hash((self.data, tuple(self.children)))
+
+    def iter_subtrees(self) -> 'Iterator[Tree[_Leaf_T]]':
+        #--
+        queue = [self]
+        subtrees = dict()
+        for subtree in queue:
+            subtrees[id(subtree)] = subtree
+            queue += [c for c in reversed(subtree.children)
+                      if isinstance(c, Tree) and id(c) not in subtrees]
+
+        del queue
+        return reversed(list(subtrees.values()))
+
+    def iter_subtrees_topdown(self):
+        #--
+        stack = [self]
+        stack_append = stack.append
+        stack_pop = stack.pop
+        while stack:
+            node = stack_pop()
+            if not isinstance(node, Tree):
+                continue
+            yield node
+            for child in reversed(node.children):
+                stack_append(child)
+
+    def find_pred(self, pred: 'Callable[[Tree[_Leaf_T]], bool]') -> 'Iterator[Tree[_Leaf_T]]':
+        #--
+        return filter(pred, self.iter_subtrees())
+
+    def find_data(self, data: str) -> 'Iterator[Tree[_Leaf_T]]':
+        #--
+        return self.find_pred(lambda t: t.data == data)
+
+
+from functools import wraps, update_wrapper
+from inspect import getmembers, getmro
+
+_Return_T = TypeVar('_Return_T')
+_Return_V = TypeVar('_Return_V')
+_Leaf_T = TypeVar('_Leaf_T')
+_Leaf_U = TypeVar('_Leaf_U')
+_R = TypeVar('_R')
+_FUNC = Callable[..., _Return_T]
+_DECORATED = Union[_FUNC, type]
+
+class _DiscardType:
+    #--
+
+    def __repr__(self):
+        return "lark.visitors.Discard"
+
+Discard = _DiscardType()
+
+##
+
+
+class _Decoratable:
+    #--
+
+    @classmethod
+    def _apply_v_args(cls, visit_wrapper):
+        mro = getmro(cls)
+        assert mro[0] is cls
+        libmembers = {name for _cls in mro[1:] for name, _ in getmembers(_cls)}
+        for name, value in getmembers(cls):
+
+            ##
+
+            if name.startswith('_') or (name in libmembers and name not in cls.__dict__):
+                continue
+            if not callable(value):
+                continue
+
+            ##
+
+            if isinstance(cls.__dict__[name], _VArgsWrapper):
+                continue
+
+            setattr(cls, name, _VArgsWrapper(cls.__dict__[name], visit_wrapper))
+        return cls
+
+    def __class_getitem__(cls, _):
+        return cls
+
+
+class Transformer(_Decoratable, ABC, Generic[_Leaf_T, _Return_T]):
+    #--
+    __visit_tokens__ = True   ##
+
+
+    def __init__(self,  visit_tokens: bool=True) -> None:
+        self.__visit_tokens__ = visit_tokens
+
+    def _call_userfunc(self, tree, new_children=None):
+        ##
+
+        children = new_children if new_children is not None else tree.children
+        try:
+            f = getattr(self, tree.data)
+        except AttributeError:
+            return self.__default__(tree.data, children, tree.meta)
+        else:
+            try:
+                wrapper = getattr(f, 'visit_wrapper', None)
+                if wrapper is not None:
+                    return f.visit_wrapper(f, tree.data, children, tree.meta)
+                else:
+                    return f(children)
+            except GrammarError:
+                raise
+            except Exception as e:
+                raise VisitError(tree.data, tree, e)
+
+    def _call_userfunc_token(self, token):
+        try:
+            f = getattr(self, token.type)
+        except AttributeError:
+            return self.__default_token__(token)
+        else:
+            try:
+                return f(token)
+            except GrammarError:
+                raise
+            except Exception as e:
+                raise VisitError(token.type, token, e)
+
+    def _transform_children(self, children):
+        for c in children:
+            if isinstance(c, Tree):
+                res = self._transform_tree(c)
+            elif self.__visit_tokens__ and isinstance(c, Token):
+                res = self._call_userfunc_token(c)
+            else:
+                res = c
+
+            if res is not Discard:
+                yield res
+
+    def _transform_tree(self, tree):
+        children = list(self._transform_children(tree.children))
+        return self._call_userfunc(tree, children)
+
+    def transform(self, tree: Tree[_Leaf_T]) -> _Return_T:
+        #--
+        res = list(self._transform_children([tree]))
+        if not res:
+            return None     ##
+
+        assert len(res) == 1
+        return res[0]
+
+    def __mul__(
+            self: 'Transformer[_Leaf_T, Tree[_Leaf_U]]',
+            other: 'Union[Transformer[_Leaf_U, _Return_V], TransformerChain[_Leaf_U, _Return_V,]]'
+    ) -> 'TransformerChain[_Leaf_T, _Return_V]':
+        #--
+        return TransformerChain(self, other)
+
+    def __default__(self, data, children, meta):
+        #--
+        return Tree(data, children, meta)
+
+    def __default_token__(self, token):
+        #--
+        return token
+
+
+def merge_transformers(base_transformer=None, **transformers_to_merge):
+    #--
+    if base_transformer is None:
+        base_transformer = Transformer()
+    for prefix, transformer in transformers_to_merge.items():
+        for method_name in dir(transformer):
+            method = getattr(transformer, method_name)
+            if not callable(method):
+                continue
+            if method_name.startswith("_") or method_name == "transform":
+                continue
+            prefixed_method = prefix + "__" + method_name
+            if hasattr(base_transformer, prefixed_method):
+                raise AttributeError("Cannot merge: method '%s' appears more than once" % prefixed_method)
+
+            setattr(base_transformer, prefixed_method, method)
+
+    return base_transformer
+
+
+class InlineTransformer(Transformer):   ##
+
+    def _call_userfunc(self, tree, new_children=None):
+        ##
+
+        children = new_children if new_children is not None else tree.children
+        try:
+            f = getattr(self, tree.data)
+        except AttributeError:
+            return self.__default__(tree.data, children, tree.meta)
+        else:
+            return f(*children)
+
+
+class TransformerChain(Generic[_Leaf_T, _Return_T]):
+
+    transformers: 'Tuple[Union[Transformer, TransformerChain], ...]'
+
+    def __init__(self, *transformers: 'Union[Transformer, TransformerChain]') -> None:
+        self.transformers = transformers
+
+    def transform(self, tree: Tree[_Leaf_T]) -> _Return_T:
+        for t in self.transformers:
+            tree = t.transform(tree)
+        return cast(_Return_T, tree)
+
+    def __mul__(
+            self: 'TransformerChain[_Leaf_T, Tree[_Leaf_U]]',
+            other: 'Union[Transformer[_Leaf_U, _Return_V], TransformerChain[_Leaf_U, _Return_V]]'
+    ) -> 'TransformerChain[_Leaf_T, _Return_V]':
+        return TransformerChain(*self.transformers + (other,))
+
+
+class Transformer_InPlace(Transformer[_Leaf_T, _Return_T]):
+    #--
+    def _transform_tree(self, tree):           ##
+
+        return self._call_userfunc(tree)
+
+    def transform(self, tree: Tree[_Leaf_T]) -> _Return_T:
+        for subtree in tree.iter_subtrees():
+            subtree.children = list(self._transform_children(subtree.children))
+
+        return self._transform_tree(tree)
+
+
+class Transformer_NonRecursive(Transformer[_Leaf_T, _Return_T]):
+    #--
+
+    def transform(self, tree: Tree[_Leaf_T]) -> _Return_T:
+        ##
+
+        rev_postfix = []
+        q: List[Branch[_Leaf_T]] = [tree]
+        while q:
+            t = q.pop()
+            rev_postfix.append(t)
+            if isinstance(t, Tree):
+                q += t.children
+
+        ##
+
+        stack: List = []
+        for x in reversed(rev_postfix):
+            if isinstance(x, Tree):
+                size = len(x.children)
+                if size:
+                    args = stack[-size:]
+                    del stack[-size:]
+                else:
+                    args = []
+
+                res = self._call_userfunc(x, args)
+                if res is not Discard:
+                    stack.append(res)
+
+            elif self.__visit_tokens__ and isinstance(x, Token):
+                res = self._call_userfunc_token(x)
+                if res is not Discard:
+                    stack.append(res)
+            else:
+                stack.append(x)
+
+        result, = stack  ##
+
+        ##
+
+        ##
+
+        ##
+
+        return cast(_Return_T, result)
+
+
+class Transformer_InPlaceRecursive(Transformer[_Leaf_T, _Return_T]):
+    #--
+    def _transform_tree(self, tree):
+        tree.children = list(self._transform_children(tree.children))
+        return self._call_userfunc(tree)
+
+
+##
+
+
+class VisitorBase:
+    def _call_userfunc(self, tree):
+        return getattr(self, tree.data, self.__default__)(tree)
+
+    def __default__(self, tree):
+        #--
+        return tree
+
+    def __class_getitem__(cls, _):
+        return cls
+
+
+class Visitor(VisitorBase, ABC, Generic[_Leaf_T]):
+    #--
+
+    def visit(self, tree: Tree[_Leaf_T]) -> Tree[_Leaf_T]:
+        #--
+        for subtree in tree.iter_subtrees():
+            self._call_userfunc(subtree)
+        return tree
+
+    def visit_topdown(self, tree: Tree[_Leaf_T]) -> Tree[_Leaf_T]:
+        #--
+        for subtree in tree.iter_subtrees_topdown():
+            self._call_userfunc(subtree)
+        return tree
+
+
+class Visitor_Recursive(VisitorBase, Generic[_Leaf_T]):
+    #--
+
+    def visit(self, tree: Tree[_Leaf_T]) -> Tree[_Leaf_T]:
+        #--
+        for child in tree.children:
+            if isinstance(child, Tree):
+                self.visit(child)
+
+        self._call_userfunc(tree)
+        return tree
+
+    def visit_topdown(self,tree: Tree[_Leaf_T]) -> Tree[_Leaf_T]:
+        #--
+        self._call_userfunc(tree)
+
+        for child in tree.children:
+            if isinstance(child, Tree):
+                self.visit_topdown(child)
+
+        return tree
+
+
+class Interpreter(_Decoratable, ABC, Generic[_Leaf_T, _Return_T]):
+    #--
+
+    def visit(self, tree: Tree[_Leaf_T]) -> _Return_T:
+        ##
+
+        ##
+
+        ##
+
+        return self._visit_tree(tree)
+
+    def _visit_tree(self, tree: Tree[_Leaf_T]):
+        f = getattr(self, tree.data)
+        wrapper = getattr(f, 'visit_wrapper', None)
+        if wrapper is not None:
+            return f.visit_wrapper(f, tree.data, tree.children, tree.meta)
+        else:
+            return f(tree)
+
+    def visit_children(self, tree: Tree[_Leaf_T]) -> List:
+        return [self._visit_tree(child) if isinstance(child, Tree) else child
+                for child in tree.children]
+
+    def __getattr__(self, name):
+        return self.__default__
+
+    def __default__(self, tree):
+        return self.visit_children(tree)
+
+
+_InterMethod = Callable[[Type[Interpreter], _Return_T], _R]
+
+def visit_children_decor(func: _InterMethod) -> _InterMethod:
+    #--
+    @wraps(func)
+    def inner(cls, tree):
+        values = cls.visit_children(tree)
+        return func(cls, values)
+    return inner
+
+##
+
+
+def _apply_v_args(obj, visit_wrapper):
+    try:
+        _apply = obj._apply_v_args
+    except AttributeError:
+        return _VArgsWrapper(obj, visit_wrapper)
+    else:
+        return _apply(visit_wrapper)
+
+
+class _VArgsWrapper:
+    #--
+    base_func: Callable
+
+    def __init__(self, func: Callable, visit_wrapper: Callable[[Callable, str, list, Any], Any]):
+        if isinstance(func, _VArgsWrapper):
+            func = func.base_func
+        self.base_func = func
+        self.visit_wrapper = visit_wrapper
+        update_wrapper(self, func)
+
+    def __call__(self, *args, **kwargs):
+        return self.base_func(*args, **kwargs)
+
+    def __get__(self, instance, owner=None):
+        try:
+            ##
+
+            ##
+
+            g = type(self.base_func).__get__
+        except AttributeError:
+            return self
+        else:
+            return _VArgsWrapper(g(self.base_func, instance, owner), self.visit_wrapper)
+
+    def __set_name__(self, owner, name):
+        try:
+            f = type(self.base_func).__set_name__
+        except AttributeError:
+            return
+        else:
+            f(self.base_func, owner, name)
+
+
+def _vargs_inline(f, _data, children, _meta):
+    return f(*children)
+def _vargs_meta_inline(f, _data, children, meta):
+    return f(meta, *children)
+def _vargs_meta(f, _data, children, meta):
+    return f(meta, children)
+def _vargs_tree(f, data, children, meta):
+    return f(Tree(data, children, meta))
+
+
+def v_args(inline: bool = False, meta: bool = False, tree: bool = False, wrapper: Optional[Callable] = None) -> Callable[[_DECORATED], _DECORATED]:
+    #--
+    if tree and (meta or inline):
+        raise ValueError("Visitor functions cannot combine 'tree' with 'meta' or 'inline'.")
+
+    func = None
+    if meta:
+        if inline:
+            func = _vargs_meta_inline
+        else:
+            func = _vargs_meta
+    elif inline:
+        func = _vargs_inline
+    elif tree:
+        func = _vargs_tree
+
+    if wrapper is not None:
+        if func is not None:
+            raise ValueError("Cannot use 'wrapper' along with 'tree', 'meta' or 'inline'.")
+        func = wrapper
+
+    def _visitor_args_dec(obj):
+        return _apply_v_args(obj, func)
+    return _visitor_args_dec
+
+
+
+TOKEN_DEFAULT_PRIORITY = 0
+
+
+class Symbol(Serialize):
+    __slots__ = ('name',)
+
+    name: str
+    is_term: ClassVar[bool] = NotImplemented
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __eq__(self, other):
+        if not isinstance(other, Symbol):
+            return NotImplemented
+        return self.is_term == other.is_term and self.name == other.name
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.name)
+
+    fullrepr = property(__repr__)
+
+    def renamed(self, f):
+        return type(self)(f(self.name))
+
+
+class Terminal(Symbol):
+    __serialize_fields__ = 'name', 'filter_out'
+
+    is_term: ClassVar[bool] = True
+
+    def __init__(self, name: str, filter_out: bool = False) -> None:
+        self.name = name
+        self.filter_out = filter_out
+
+    @property
+    def fullrepr(self):
+        return '%s(%r, %r)' % (type(self).__name__, self.name, self.filter_out)
+
+    def renamed(self, f):
+        return type(self)(f(self.name), self.filter_out)
+
+
+class NonTerminal(Symbol):
+    __serialize_fields__ = 'name',
+
+    is_term: ClassVar[bool] = False
+
+    def serialize(self, memo=None) -> Dict[str, Any]:
+        ##
+
+        ##
+
+        return {'name': str(self.name), '__type__': 'NonTerminal'}
+
+
+class RuleOptions(Serialize):
+    __serialize_fields__ = 'keep_all_tokens', 'expand1', 'priority', 'template_source', 'empty_indices'
+
+    keep_all_tokens: bool
+    expand1: bool
+    priority: Optional[int]
+    template_source: Optional[str]
+    empty_indices: Tuple[bool, ...]
+
+    def __init__(self, keep_all_tokens: bool=False, expand1: bool=False, priority: Optional[int]=None, template_source: Optional[str]=None, empty_indices: Tuple[bool, ...]=()) -> None:
+        self.keep_all_tokens = keep_all_tokens
+        self.expand1 = expand1
+        self.priority = priority
+        self.template_source = template_source
+        self.empty_indices = empty_indices
+
+    def __repr__(self):
+        return 'RuleOptions(%r, %r, %r, %r)' % (
+            self.keep_all_tokens,
+            self.expand1,
+            self.priority,
+            self.template_source
+        )
+
+
+class Rule(Serialize):
+    #--
+    __slots__ = ('origin', 'expansion', 'alias', 'options', 'order', '_hash')
+
+    __serialize_fields__ = 'origin', 'expansion', 'order', 'alias', 'options'
+    __serialize_namespace__ = Terminal, NonTerminal, RuleOptions
+
+    origin: NonTerminal
+    expansion: Sequence[Symbol]
+    order: int
+    alias: Optional[str]
+    options: RuleOptions
+    _hash: int
+
+    def __init__(self, origin: NonTerminal, expansion: Sequence[Symbol],
+                 order: int=0, alias: Optional[str]=None, options: Optional[RuleOptions]=None):
+        self.origin = origin
+        self.expansion = expansion
+        self.alias = alias
+        self.order = order
+        self.options = options or RuleOptions()
+        self._hash = hash((self.origin, tuple(self.expansion)))
+
+    def _deserialize(self):
+        self._hash = hash((self.origin, tuple(self.expansion)))
+
+    def __str__(self):
+        return '<%s : %s>' % (self.origin.name, ' '.join(x.name for x in self.expansion))
+
+    def __repr__(self):
+        return 'Rule(%r, %r, %r, %r)' % (self.origin, self.expansion, self.alias, self.options)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, Rule):
+            return False
+        return self.origin == other.origin and self.expansion == other.expansion
+
+
+
+from contextlib import suppress
+from copy import copy
+
+try:  ##
+
+    has_interegular = bool(interegular)
+except NameError:
+    has_interegular = False
+
+class Pattern(Serialize, ABC):
+    #--
+
+    value: str
+    flags: Collection[str]
+    raw: Optional[str]
+    type: ClassVar[str]
+
+    def __init__(self, value: str, flags: Collection[str] = (), raw: Optional[str] = None) -> None:
+        self.value = value
+        self.flags = frozenset(flags)
+        self.raw = raw
+
+    def __repr__(self):
+        return repr(self.to_regexp())
+
+    ##
+
+    def __hash__(self):
+        return hash((type(self), self.value, self.flags))
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.value == other.value and self.flags == other.flags
+
+    @abstractmethod
+    def to_regexp(self) -> str:
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def min_width(self) -> int:
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def max_width(self) -> int:
+        raise NotImplementedError()
+
+    def _get_flags(self, value):
+        for f in self.flags:
+            value = ('(?%s:%s)' % (f, value))
+        return value
+
+
+class PatternStr(Pattern):
+    __serialize_fields__ = 'value', 'flags', 'raw'
+
+    type: ClassVar[str] = "str"
+
+    def to_regexp(self) -> str:
+        return self._get_flags(re.escape(self.value))
+
+    @property
+    def min_width(self) -> int:
+        return len(self.value)
+
+    @property
+    def max_width(self) -> int:
+        return len(self.value)
+
+
+class PatternRE(Pattern):
+    __serialize_fields__ = 'value', 'flags', 'raw', '_width'
+
+    type: ClassVar[str] = "re"
+
+    def to_regexp(self) -> str:
+        return self._get_flags(self.value)
+
+    _width = None
+    def _get_width(self):
+        if self._width is None:
+            self._width = get_regexp_width(self.to_regexp())
+        return self._width
+
+    @property
+    def min_width(self) -> int:
+        return self._get_width()[0]
+
+    @property
+    def max_width(self) -> int:
+        return self._get_width()[1]
+
+
+class TerminalDef(Serialize):
+    #--
+    __serialize_fields__ = 'name', 'pattern', 'priority'
+    __serialize_namespace__ = PatternStr, PatternRE
+
+    name: str
+    pattern: Pattern
+    priority: int
+
+    def __init__(self, name: str, pattern: Pattern, priority: int = TOKEN_DEFAULT_PRIORITY) -> None:
+        assert isinstance(pattern, Pattern), pattern
+        self.name = name
+        self.pattern = pattern
+        self.priority = priority
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (type(self).__name__, self.name, self.pattern)
+
+    def user_repr(self) -> str:
+        if self.name.startswith('__'):  ##
+
+            return self.pattern.raw or self.name
+        else:
+            return self.name
+
+_T = TypeVar('_T', bound="Token")
+
+class Token(str):
+    #--
+    __slots__ = ('type', 'start_pos', 'value', 'line', 'column', 'end_line', 'end_column', 'end_pos')
+
+    __match_args__ = ('type', 'value')
+
+    type: str
+    start_pos: Optional[int]
+    value: Any
+    line: Optional[int]
+    column: Optional[int]
+    end_line: Optional[int]
+    end_column: Optional[int]
+    end_pos: Optional[int]
+
+
+    @overload
+    def __new__(
+            cls,
+            type: str,
+            value: Any,
+            start_pos: Optional[int] = None,
+            line: Optional[int] = None,
+            column: Optional[int] = None,
+            end_line: Optional[int] = None,
+            end_column: Optional[int] = None,
+            end_pos: Optional[int] = None
+    ) -> 'Token':
+        ...
+
+    @overload
+    def __new__(
+            cls,
+            type_: str,
+            value: Any,
+            start_pos: Optional[int] = None,
+            line: Optional[int] = None,
+            column: Optional[int] = None,
+            end_line: Optional[int] = None,
+            end_column: Optional[int] = None,
+            end_pos: Optional[int] = None
+    ) -> 'Token':        ...
+
+    def __new__(cls, *args, **kwargs):
+        if "type_" in kwargs:
+            warnings.warn("`type_` is deprecated use `type` instead", DeprecationWarning)
+
+            if "type" in kwargs:
+                raise TypeError("Error: using both 'type' and the deprecated 'type_' as arguments.")
+            kwargs["type"] = kwargs.pop("type_")
+
+        return cls._future_new(*args, **kwargs)
+
+
+    @classmethod
+    def _future_new(cls, type, value, start_pos=None, line=None, column=None, end_line=None, end_column=None, end_pos=None):
+        inst = super(Token, cls).__new__(cls, value)
+
+        inst.type = type
+        inst.start_pos = start_pos
+        inst.value = value
+        inst.line = line
+        inst.column = column
+        inst.end_line = end_line
+        inst.end_column = end_column
+        inst.end_pos = end_pos
+        return inst
+
+    @overload
+    def update(self, type: Optional[str] = None, value: Optional[Any] = None) -> 'Token':
+        ...
+
+    @overload
+    def update(self, type_: Optional[str] = None, value: Optional[Any] = None) -> 'Token':
+        ...
+
+    def update(self, *args, **kwargs):
+        if "type_" in kwargs:
+            warnings.warn("`type_` is deprecated use `type` instead", DeprecationWarning)
+
+            if "type" in kwargs:
+                raise TypeError("Error: using both 'type' and the deprecated 'type_' as arguments.")
+            kwargs["type"] = kwargs.pop("type_")
+
+        return self._future_update(*args, **kwargs)
+
+    def _future_update(self, type: Optional[str] = None, value: Optional[Any] = None) -> 'Token':
+        return Token.new_borrow_pos(
+            type if type is not None else self.type,
+            value if value is not None else self.value,
+            self
+        )
+
+    @classmethod
+    def new_borrow_pos(cls: Type[_T], type_: str, value: Any, borrow_t: 'Token') -> _T:
+        return cls(type_, value, borrow_t.start_pos, borrow_t.line, borrow_t.column, borrow_t.end_line, borrow_t.end_column, borrow_t.end_pos)
+
+    def __reduce__(self):
+        return (self.__class__, (self.type, self.value, self.start_pos, self.line, self.column))
+
+    def __repr__(self):
+        return 'Token(%r, %r)' % (self.type, self.value)
+
+    def __deepcopy__(self, memo):
+        return Token(self.type, self.value, self.start_pos, self.line, self.column)
+
+    def __eq__(self, other):
+        if isinstance(other, Token) and self.type != other.type:
+            return False
+
+        return str.__eq__(self, other)
+
+    __hash__ = str.__hash__
+
+
+class LineCounter:
+    #--
+
+    __slots__ = 'char_pos', 'line', 'column', 'line_start_pos', 'newline_char'
+
+    def __init__(self, newline_char):
+        self.newline_char = newline_char
+        self.char_pos = 0
+        self.line = 1
+        self.column = 1
+        self.line_start_pos = 0
+
+    def __eq__(self, other):
+        if not isinstance(other, LineCounter):
+            return NotImplemented
+
+        return self.char_pos == other.char_pos and self.newline_char == other.newline_char
+
+    def feed(self, token: TextOrSlice, test_newline=True):
+        #--
+        if test_newline:
+            newlines = token.count(self.newline_char)
+            if newlines:
+                self.line += newlines
+                self.line_start_pos = self.char_pos + token.rindex(self.newline_char) + 1
+
+        self.char_pos += len(token)
+        self.column = self.char_pos - self.line_start_pos + 1
+
+
+class UnlessCallback:
+    def __init__(self, scanner: 'Scanner'):
+        self.scanner = scanner
+
+    def __call__(self, t: Token):
+        res = self.scanner.fullmatch(t.value)
+        if res is not None:
+            t.type = res
+        return t
+
+
+class CallChain:
+    def __init__(self, callback1, callback2, cond):
+        self.callback1 = callback1
+        self.callback2 = callback2
+        self.cond = cond
+
+    def __call__(self, t):
+        t2 = self.callback1(t)
+        return self.callback2(t) if self.cond(t2) else t2
+
+
+def _get_match(re_, regexp, s, flags):
+    m = re_.match(regexp, s, flags)
+    if m:
+        return m.group(0)
+
+def _create_unless(terminals, g_regex_flags, re_, use_bytes):
+    tokens_by_type = classify(terminals, lambda t: type(t.pattern))
+    assert len(tokens_by_type) <= 2, tokens_by_type.keys()
+    embedded_strs = set()
+    callback = {}
+    for retok in tokens_by_type.get(PatternRE, []):
+        unless = []
+        for strtok in tokens_by_type.get(PatternStr, []):
+            if strtok.priority != retok.priority:
+                continue
+            s = strtok.pattern.value
+            if s == _get_match(re_, retok.pattern.to_regexp(), s, g_regex_flags):
+                unless.append(strtok)
+                if strtok.pattern.flags <= retok.pattern.flags:
+                    embedded_strs.add(strtok)
+        if unless:
+            callback[retok.name] = UnlessCallback(Scanner(unless, g_regex_flags, re_, use_bytes=use_bytes))
+
+    new_terminals = [t for t in terminals if t not in embedded_strs]
+    return new_terminals, callback
+
+
+class Scanner:
+    def __init__(self, terminals, g_regex_flags, re_, use_bytes):
+        self.terminals = terminals
+        self.g_regex_flags = g_regex_flags
+        self.re_ = re_
+        self.use_bytes = use_bytes
+
+        self.allowed_types = {t.name for t in self.terminals}
+
+        self._mres = self._build_mres(terminals, len(terminals))
+
+    def _build_mres(self, terminals, max_size):
+        ##
+
+        ##
+
+        ##
+
+        mres = []
+        while terminals:
+            pattern = u'|'.join(u'(?P<%s>%s)' % (t.name, t.pattern.to_regexp()) for t in terminals[:max_size])
+            if self.use_bytes:
+                pattern = pattern.encode('latin-1')
+            try:
+                mre = self.re_.compile(pattern, self.g_regex_flags)
+            except AssertionError:  ##
+
+                return self._build_mres(terminals, max_size // 2)
+
+            mres.append(mre)
+            terminals = terminals[max_size:]
+        return mres
+
+    def match(self, text: TextSlice, pos):
+        for mre in self._mres:
+            m = mre.match(text.text, pos, text.end)
+            if m:
+                return m.group(0), m.lastgroup
+
+
+    def fullmatch(self, text: str) -> Optional[str]:
+        for mre in self._mres:
+            m = mre.fullmatch(text)
+            if m:
+                return m.lastgroup
+        return None
+
+def _regexp_has_newline(r: str):
+    #--
+    return '\n' in r or '\\n' in r or '\\s' in r or '[^' in r or ('(?s' in r and '.' in r)
+
+
+class LexerState:
+    #--
+
+    __slots__ = 'text', 'line_ctr', 'last_token'
+
+    text: TextSlice
+    line_ctr: LineCounter
+    last_token: Optional[Token]
+
+    def __init__(self, text: TextSlice, line_ctr: Optional[LineCounter] = None, last_token: Optional[Token]=None):
+        if isinstance(text, TextSlice):
+            if line_ctr is None:
+                line_ctr = LineCounter(b'\n' if isinstance(text.text, bytes) else '\n')
+
+                if text.start > 0:
+                    ##
+
+                    line_ctr.feed(TextSlice(text.text, 0, text.start))
+
+            if not (text.start <= line_ctr.char_pos <= text.end):
+                raise ValueError("LineCounter.char_pos is out of bounds")
+
+        self.text = text
+        self.line_ctr = line_ctr
+        self.last_token = last_token
+
+
+    def __eq__(self, other):
+        if not isinstance(other, LexerState):
+            return NotImplemented
+
+        return self.text == other.text and self.line_ctr == other.line_ctr and self.last_token == other.last_token
+
+    def __copy__(self):
+        return type(self)(self.text, copy(self.line_ctr), self.last_token)
+
+
+class LexerThread:
+    #--
+
+    def __init__(self, lexer: 'Lexer', lexer_state: Optional[LexerState]):
+        self.lexer = lexer
+        self.state = lexer_state
+
+    @classmethod
+    def from_text(cls, lexer: 'Lexer', text_or_slice: TextOrSlice) -> 'LexerThread':
+        text = TextSlice.cast_from(text_or_slice)
+        return cls(lexer, LexerState(text))
+
+    @classmethod
+    def from_custom_input(cls, lexer: 'Lexer', text: Any) -> 'LexerThread':
+        return cls(lexer, LexerState(text))
+
+    def lex(self, parser_state):
+        if self.state is None:
+            raise TypeError("Cannot lex: No text assigned to lexer state")
+        return self.lexer.lex(self.state, parser_state)
+
+    def __copy__(self):
+        return type(self)(self.lexer, copy(self.state))
+
+    _Token = Token
+
+
+_Callback = Callable[[Token], Token]
+
+class Lexer(ABC):
+    #--
+    @abstractmethod
+    def lex(self, lexer_state: LexerState, parser_state: Any) -> Iterator[Token]:
+        return NotImplemented
+
+    def make_lexer_state(self, text: str):
+        #--
+        return LexerState(TextSlice.cast_from(text))
+
+
+def _check_regex_collisions(terminal_to_regexp: Dict[TerminalDef, str], comparator, strict_mode, max_collisions_to_show=8):
+    if not comparator:
+        comparator = interegular.Comparator.from_regexes(terminal_to_regexp)
+
+    ##
+
+    ##
+
+    max_time = 2 if strict_mode else 0.2
+
+    ##
+
+    if comparator.count_marked_pairs() >= max_collisions_to_show:
+        return
+    for group in classify(terminal_to_regexp, lambda t: t.priority).values():
+        for a, b in comparator.check(group, skip_marked=True):
+            assert a.priority == b.priority
+            ##
+
+            comparator.mark(a, b)
+
+            ##
+
+            message = f"Collision between Terminals {a.name} and {b.name}. "
+            try:
+                example = comparator.get_example_overlap(a, b, max_time).format_multiline()
+            except ValueError:
+                ##
+
+                example = "No example could be found fast enough. However, the collision does still exists"
+            if strict_mode:
+                raise LexError(f"{message}\n{example}")
+            logger.warning("%s The lexer will choose between them arbitrarily.\n%s", message, example)
+            if comparator.count_marked_pairs() >= max_collisions_to_show:
+                logger.warning("Found 8 regex collisions, will not check for more.")
+                return
+
+
+class AbstractBasicLexer(Lexer):
+    terminals_by_name: Dict[str, TerminalDef]
+
+    @abstractmethod
+    def __init__(self, conf: 'LexerConf', comparator=None) -> None:
+        ...
+
+    @abstractmethod
+    def next_token(self, lex_state: LexerState, parser_state: Any = None) -> Token:
+        ...
+
+    def lex(self, state: LexerState, parser_state: Any) -> Iterator[Token]:
+        with suppress(EOFError):
+            while True:
+                yield self.next_token(state, parser_state)
+
+
+class BasicLexer(AbstractBasicLexer):
+    terminals: Collection[TerminalDef]
+    ignore_types: FrozenSet[str]
+    newline_types: FrozenSet[str]
+    user_callbacks: Dict[str, _Callback]
+    callback: Dict[str, _Callback]
+    re: ModuleType
+
+    def __init__(self, conf: 'LexerConf', comparator=None) -> None:
+        terminals = list(conf.terminals)
+        assert all(isinstance(t, TerminalDef) for t in terminals), terminals
+
+        self.re = conf.re_module
+
+        if not conf.skip_validation:
+            ##
+
+            terminal_to_regexp = {}
+            for t in terminals:
+                regexp = t.pattern.to_regexp()
+                try:
+                    self.re.compile(regexp, conf.g_regex_flags)
+                except self.re.error:
+                    raise LexError("Cannot compile token %s: %s" % (t.name, t.pattern))
+
+                if t.pattern.min_width == 0:
+                    raise LexError("Lexer does not allow zero-width terminals. (%s: %s)" % (t.name, t.pattern))
+                if t.pattern.type == "re":
+                    terminal_to_regexp[t] = regexp
+
+            if not (set(conf.ignore) <= {t.name for t in terminals}):
+                raise LexError("Ignore terminals are not defined: %s" % (set(conf.ignore) - {t.name for t in terminals}))
+
+            if has_interegular:
+                _check_regex_collisions(terminal_to_regexp, comparator, conf.strict)
+            elif conf.strict:
+                raise LexError("interegular must be installed for strict mode. Use `pip install 'lark[interegular]'`.")
+
+        ##
+
+        self.newline_types = frozenset(t.name for t in terminals if _regexp_has_newline(t.pattern.to_regexp()))
+        self.ignore_types = frozenset(conf.ignore)
+
+        terminals.sort(key=lambda x: (-x.priority, -x.pattern.max_width, -len(x.pattern.value), x.name))
+        self.terminals = terminals
+        self.user_callbacks = conf.callbacks
+        self.g_regex_flags = conf.g_regex_flags
+        self.use_bytes = conf.use_bytes
+        self.terminals_by_name = conf.terminals_by_name
+
+        self._scanner: Optional[Scanner] = None
+
+    def _build_scanner(self) -> Scanner:
+        terminals, self.callback = _create_unless(self.terminals, self.g_regex_flags, self.re, self.use_bytes)
+        assert all(self.callback.values())
+
+        for type_, f in self.user_callbacks.items():
+            if type_ in self.callback:
+                ##
+
+                self.callback[type_] = CallChain(self.callback[type_], f, lambda t: t.type == type_)
+            else:
+                self.callback[type_] = f
+
+        return Scanner(terminals, self.g_regex_flags, self.re, self.use_bytes)
+
+    @property
+    def scanner(self) -> Scanner:
+        if self._scanner is None:
+            self._scanner = self._build_scanner()
+        return self._scanner
+
+    def match(self, text, pos):
+        return self.scanner.match(text, pos)
+
+    def next_token(self, lex_state: LexerState, parser_state: Any = None) -> Token:
+        line_ctr = lex_state.line_ctr
+        while line_ctr.char_pos < lex_state.text.end:
+            res = self.match(lex_state.text, line_ctr.char_pos)
+            if not res:
+                allowed = self.scanner.allowed_types - self.ignore_types
+                if not allowed:
+                    allowed = {"<END-OF-FILE>"}
+                raise UnexpectedCharacters(lex_state.text.text, line_ctr.char_pos, line_ctr.line, line_ctr.column,
+                                           allowed=allowed, token_history=lex_state.last_token and [lex_state.last_token],
+                                           state=parser_state, terminals_by_name=self.terminals_by_name)
+
+            value, type_ = res
+
+            ignored = type_ in self.ignore_types
+            t = None
+            if not ignored or type_ in self.callback:
+                t = Token(type_, value, line_ctr.char_pos, line_ctr.line, line_ctr.column)
+            line_ctr.feed(value, type_ in self.newline_types)
+            if t is not None:
+                t.end_line = line_ctr.line
+                t.end_column = line_ctr.column
+                t.end_pos = line_ctr.char_pos
+                if t.type in self.callback:
+                    t = self.callback[t.type](t)
+                if not ignored:
+                    if not isinstance(t, Token):
+                        raise LexError("Callbacks must return a token (returned %r)" % t)
+                    lex_state.last_token = t
+                    return t
+
+        ##
+
+        raise EOFError(self)
+
+
+class ContextualLexer(Lexer):
+    lexers: Dict[int, AbstractBasicLexer]
+    root_lexer: AbstractBasicLexer
+
+    BasicLexer: Type[AbstractBasicLexer] = BasicLexer
+
+    def __init__(self, conf: 'LexerConf', states: Dict[int, Collection[str]], always_accept: Collection[str]=()) -> None:
+        terminals = list(conf.terminals)
+        terminals_by_name = conf.terminals_by_name
+
+        trad_conf = copy(conf)
+        trad_conf.terminals = terminals
+
+        if has_interegular and not conf.skip_validation:
+            comparator = interegular.Comparator.from_regexes({t: t.pattern.to_regexp() for t in terminals})
+        else:
+            comparator = None
+        lexer_by_tokens: Dict[FrozenSet[str], AbstractBasicLexer] = {}
+        self.lexers = {}
+        for state, accepts in states.items():
+            key = frozenset(accepts)
+            try:
+                lexer = lexer_by_tokens[key]
+            except KeyError:
+                accepts = set(accepts) | set(conf.ignore) | set(always_accept)
+                lexer_conf = copy(trad_conf)
+                lexer_conf.terminals = [terminals_by_name[n] for n in accepts if n in terminals_by_name]
+                lexer = self.BasicLexer(lexer_conf, comparator)
+                lexer_by_tokens[key] = lexer
+
+            self.lexers[state] = lexer
+
+        assert trad_conf.terminals is terminals
+        trad_conf.skip_validation = True  ##
+
+        self.root_lexer = self.BasicLexer(trad_conf, comparator)
+
+    def lex(self, lexer_state: LexerState, parser_state: 'ParserState') -> Iterator[Token]:
+        try:
+            while True:
+                lexer = self.lexers[parser_state.position]
+                yield lexer.next_token(lexer_state, parser_state)
+        except EOFError:
+            pass
+        except UnexpectedCharacters as e:
+            ##
+
+            ##
+
+            try:
+                last_token = lexer_state.last_token  ##
+
+                token = self.root_lexer.next_token(lexer_state, parser_state)
+                raise UnexpectedToken(token, e.allowed, state=parser_state, token_history=[last_token], terminals_by_name=self.root_lexer.terminals_by_name)
+            except UnexpectedCharacters:
+                raise e  ##
+
+
+
+
+_ParserArgType: 'TypeAlias' = 'Literal["earley", "lalr", "cyk", "auto"]'
+_LexerArgType: 'TypeAlias' = 'Union[Literal["auto", "basic", "contextual", "dynamic", "dynamic_complete"], Type[Lexer]]'
+_LexerCallback = Callable[[Token], Token]
+ParserCallbacks = Dict[str, Callable]
+
+class LexerConf(Serialize):
+    __serialize_fields__ = 'terminals', 'ignore', 'g_regex_flags', 'use_bytes', 'lexer_type'
+    __serialize_namespace__ = TerminalDef,
+
+    terminals: Collection[TerminalDef]
+    re_module: ModuleType
+    ignore: Collection[str]
+    postlex: 'Optional[PostLex]'
+    callbacks: Dict[str, _LexerCallback]
+    g_regex_flags: int
+    skip_validation: bool
+    use_bytes: bool
+    lexer_type: Optional[_LexerArgType]
+    strict: bool
+
+    def __init__(self, terminals: Collection[TerminalDef], re_module: ModuleType, ignore: Collection[str]=(), postlex: 'Optional[PostLex]'=None,
+                 callbacks: Optional[Dict[str, _LexerCallback]]=None, g_regex_flags: int=0, skip_validation: bool=False, use_bytes: bool=False, strict: bool=False):
+        self.terminals = terminals
+        self.terminals_by_name = {t.name: t for t in self.terminals}
+        assert len(self.terminals) == len(self.terminals_by_name)
+        self.ignore = ignore
+        self.postlex = postlex
+        self.callbacks = callbacks or {}
+        self.g_regex_flags = g_regex_flags
+        self.re_module = re_module
+        self.skip_validation = skip_validation
+        self.use_bytes = use_bytes
+        self.strict = strict
+        self.lexer_type = None
+
+    def _deserialize(self):
+        self.terminals_by_name = {t.name: t for t in self.terminals}
+
+    def __deepcopy__(self, memo=None):
+        return type(self)(
+            deepcopy(self.terminals, memo),
+            self.re_module,
+            deepcopy(self.ignore, memo),
+            deepcopy(self.postlex, memo),
+            deepcopy(self.callbacks, memo),
+            deepcopy(self.g_regex_flags, memo),
+            deepcopy(self.skip_validation, memo),
+            deepcopy(self.use_bytes, memo),
+        )
+
+class ParserConf(Serialize):
+    __serialize_fields__ = 'rules', 'start', 'parser_type'
+
+    rules: List['Rule']
+    callbacks: ParserCallbacks
+    start: List[str]
+    parser_type: _ParserArgType
+
+    def __init__(self, rules: List['Rule'], callbacks: ParserCallbacks, start: List[str]):
+        assert isinstance(start, list)
+        self.rules = rules
+        self.callbacks = callbacks
+        self.start = start
+
+
+from functools import partial, wraps
+from itertools import product
+
+
+class ExpandSingleChild:
+    def __init__(self, node_builder):
+        self.node_builder = node_builder
+
+    def __call__(self, children):
+        if len(children) == 1:
+            return children[0]
+        else:
+            return self.node_builder(children)
+
+
+
+class PropagatePositions:
+    def __init__(self, node_builder, node_filter=None):
+        self.node_builder = node_builder
+        self.node_filter = node_filter
+
+    def __call__(self, children):
+        res = self.node_builder(children)
+
+        if isinstance(res, Tree):
+            ##
+
+            ##
+
+            ##
+
+            ##
+
+
+            res_meta = res.meta
+
+            first_meta = self._pp_get_meta(children)
+            if first_meta is not None:
+                if not hasattr(res_meta, 'line'):
+                    ##
+
+                    res_meta.line = getattr(first_meta, 'container_line', first_meta.line)
+                    res_meta.column = getattr(first_meta, 'container_column', first_meta.column)
+                    res_meta.start_pos = getattr(first_meta, 'container_start_pos', first_meta.start_pos)
+                    res_meta.empty = False
+
+                res_meta.container_line = getattr(first_meta, 'container_line', first_meta.line)
+                res_meta.container_column = getattr(first_meta, 'container_column', first_meta.column)
+                res_meta.container_start_pos = getattr(first_meta, 'container_start_pos', first_meta.start_pos)
+
+            last_meta = self._pp_get_meta(reversed(children))
+            if last_meta is not None:
+                if not hasattr(res_meta, 'end_line'):
+                    res_meta.end_line = getattr(last_meta, 'container_end_line', last_meta.end_line)
+                    res_meta.end_column = getattr(last_meta, 'container_end_column', last_meta.end_column)
+                    res_meta.end_pos = getattr(last_meta, 'container_end_pos', last_meta.end_pos)
+                    res_meta.empty = False
+
+                res_meta.container_end_line = getattr(last_meta, 'container_end_line', last_meta.end_line)
+                res_meta.container_end_column = getattr(last_meta, 'container_end_column', last_meta.end_column)
+                res_meta.container_end_pos = getattr(last_meta, 'container_end_pos', last_meta.end_pos)
+
+        return res
+
+    def _pp_get_meta(self, children):
+        for c in children:
+            if self.node_filter is not None and not self.node_filter(c):
+                continue
+            if isinstance(c, Tree):
+                if not c.meta.empty:
+                    return c.meta
+            elif isinstance(c, Token):
+                return c
+            elif hasattr(c, '__lark_meta__'):
+                return c.__lark_meta__()
+
+def make_propagate_positions(option):
+    if callable(option):
+        return partial(PropagatePositions, node_filter=option)
+    elif option is True:
+        return PropagatePositions
+    elif option is False:
+        return None
+
+    raise ConfigurationError('Invalid option for propagate_positions: %r' % option)
+
+
+class ChildFilter:
+    def __init__(self, to_include, append_none, node_builder):
+        self.node_builder = node_builder
+        self.to_include = to_include
+        self.append_none = append_none
+
+    def __call__(self, children):
+        filtered = []
+
+        for i, to_expand, add_none in self.to_include:
+            if add_none:
+                filtered += [None] * add_none
+            if to_expand:
+                filtered += children[i].children
+            else:
+                filtered.append(children[i])
+
+        if self.append_none:
+            filtered += [None] * self.append_none
+
+        return self.node_builder(filtered)
+
+
+class ChildFilterLALR(ChildFilter):
+    #--
+
+    def __call__(self, children):
+        filtered = []
+        for i, to_expand, add_none in self.to_include:
+            if add_none:
+                filtered += [None] * add_none
+            if to_expand:
+                if filtered:
+                    filtered += children[i].children
+                else:   ##
+
+                    filtered = children[i].children
+            else:
+                filtered.append(children[i])
+
+        if self.append_none:
+            filtered += [None] * self.append_none
+
+        return self.node_builder(filtered)
+
+
+class ChildFilterLALR_NoPlaceholders(ChildFilter):
+    #--
+    def __init__(self, to_include, node_builder):
+        self.node_builder = node_builder
+        self.to_include = to_include
+
+    def __call__(self, children):
+        filtered = []
+        for i, to_expand in self.to_include:
+            if to_expand:
+                if filtered:
+                    filtered += children[i].children
+                else:   ##
+
+                    filtered = children[i].children
+            else:
+                filtered.append(children[i])
+        return self.node_builder(filtered)
+
+
+def _should_expand(sym):
+    return not sym.is_term and sym.name.startswith('_')
+
+
+def maybe_create_child_filter(expansion, keep_all_tokens, ambiguous, _empty_indices: List[bool]):
+    ##
+
+    if _empty_indices:
+        assert _empty_indices.count(False) == len(expansion)
+        s = ''.join(str(int(b)) for b in _empty_indices)
+        empty_indices = [len(ones) for ones in s.split('0')]
+        assert len(empty_indices) == len(expansion)+1, (empty_indices, len(expansion))
+    else:
+        empty_indices = [0] * (len(expansion)+1)
+
+    to_include = []
+    nones_to_add = 0
+    for i, sym in enumerate(expansion):
+        nones_to_add += empty_indices[i]
+        if keep_all_tokens or not (sym.is_term and sym.filter_out):
+            to_include.append((i, _should_expand(sym), nones_to_add))
+            nones_to_add = 0
+
+    nones_to_add += empty_indices[len(expansion)]
+
+    if _empty_indices or len(to_include) < len(expansion) or any(to_expand for i, to_expand,_ in to_include):
+        if _empty_indices or ambiguous:
+            return partial(ChildFilter if ambiguous else ChildFilterLALR, to_include, nones_to_add)
+        else:
+            ##
+
+            return partial(ChildFilterLALR_NoPlaceholders, [(i, x) for i,x,_ in to_include])
+
+
+class AmbiguousExpander:
+    #--
+    def __init__(self, to_expand, tree_class, node_builder):
+        self.node_builder = node_builder
+        self.tree_class = tree_class
+        self.to_expand = to_expand
+
+    def __call__(self, children):
+        def _is_ambig_tree(t):
+            return hasattr(t, 'data') and t.data == '_ambig'
+
+        ##
+
+        ##
+
+        ##
+
+        ##
+
+        ambiguous = []
+        for i, child in enumerate(children):
+            if _is_ambig_tree(child):
+                if i in self.to_expand:
+                    ambiguous.append(i)
+
+                child.expand_kids_by_data('_ambig')
+
+        if not ambiguous:
+            return self.node_builder(children)
+
+        expand = [child.children if i in ambiguous else (child,) for i, child in enumerate(children)]
+        return self.tree_class('_ambig', [self.node_builder(list(f)) for f in product(*expand)])
+
+
+def maybe_create_ambiguous_expander(tree_class, expansion, keep_all_tokens):
+    to_expand = [i for i, sym in enumerate(expansion)
+                 if keep_all_tokens or ((not (sym.is_term and sym.filter_out)) and _should_expand(sym))]
+    if to_expand:
+        return partial(AmbiguousExpander, to_expand, tree_class)
+
+
+class AmbiguousIntermediateExpander:
+    #--
+
+    def __init__(self, tree_class, node_builder):
+        self.node_builder = node_builder
+        self.tree_class = tree_class
+
+    def __call__(self, children):
+        def _is_iambig_tree(child):
+            return hasattr(child, 'data') and child.data == '_iambig'
+
+        def _collapse_iambig(children):
+            #--
+
+            ##
+
+            ##
+
+            if children and _is_iambig_tree(children[0]):
+                iambig_node = children[0]
+                result = []
+                for grandchild in iambig_node.children:
+                    collapsed = _collapse_iambig(grandchild.children)
+                    if collapsed:
+                        for child in collapsed:
+                            child.children += children[1:]
+                        result += collapsed
+                    else:
+                        new_tree = self.tree_class('_inter', grandchild.children + children[1:])
+                        result.append(new_tree)
+                return result
+
+        collapsed = _collapse_iambig(children)
+        if collapsed:
+            processed_nodes = [self.node_builder(c.children) for c in collapsed]
+            return self.tree_class('_ambig', processed_nodes)
+
+        return self.node_builder(children)
+
+
+
+def inplace_transformer(func):
+    @wraps(func)
+    def f(children):
+        ##
+
+        tree = Tree(func.__name__, children)
+        return func(tree)
+    return f
+
+
+def apply_visit_wrapper(func, name, wrapper):
+    if wrapper is _vargs_meta or wrapper is _vargs_meta_inline:
+        raise NotImplementedError("Meta args not supported for internal transformer; use YourTransformer().transform(parser.parse()) instead")
+
+    @wraps(func)
+    def f(children):
+        return wrapper(func, name, children, None)
+    return f
+
+
+class ParseTreeBuilder:
+    def __init__(self, rules, tree_class, propagate_positions=False, ambiguous=False, maybe_placeholders=False):
+        self.tree_class = tree_class
+        self.propagate_positions = propagate_positions
+        self.ambiguous = ambiguous
+        self.maybe_placeholders = maybe_placeholders
+
+        self.rule_builders = list(self._init_builders(rules))
+
+    def _init_builders(self, rules):
+        propagate_positions = make_propagate_positions(self.propagate_positions)
+
+        for rule in rules:
+            options = rule.options
+            keep_all_tokens = options.keep_all_tokens
+            expand_single_child = options.expand1
+
+            wrapper_chain = list(filter(None, [
+                (expand_single_child and not rule.alias) and ExpandSingleChild,
+                maybe_create_child_filter(rule.expansion, keep_all_tokens, self.ambiguous, options.empty_indices if self.maybe_placeholders else None),
+                propagate_positions,
+                self.ambiguous and maybe_create_ambiguous_expander(self.tree_class, rule.expansion, keep_all_tokens),
+                self.ambiguous and partial(AmbiguousIntermediateExpander, self.tree_class)
+            ]))
+
+            yield rule, wrapper_chain
+
+    def create_callback(self, transformer=None):
+        callbacks = {}
+
+        default_handler = getattr(transformer, '__default__', None)
+        if default_handler:
+            def default_callback(data, children):
+                return default_handler(data, children, None)
+        else:
+            default_callback = self.tree_class
+
+        for rule, wrapper_chain in self.rule_builders:
+
+            user_callback_name = rule.alias or rule.options.template_source or rule.origin.name
+            try:
+                f = getattr(transformer, user_callback_name)
+                wrapper = getattr(f, 'visit_wrapper', None)
+                if wrapper is not None:
+                    f = apply_visit_wrapper(f, user_callback_name, wrapper)
+                elif isinstance(transformer, Transformer_InPlace):
+                    f = inplace_transformer(f)
+            except AttributeError:
+                f = partial(default_callback, user_callback_name)
+
+            for w in wrapper_chain:
+                f = w(f)
+
+            if rule in callbacks:
+                raise GrammarError("Rule '%s' already exists" % (rule,))
+
+            callbacks[rule] = f
+
+        return callbacks
+
+
+
+class Action:
+    def __init__(self, name):
+        self.name = name
+    def __str__(self):
+        return self.name
+    def __repr__(self):
+        return str(self)
+
+Shift = Action('Shift')
+Reduce = Action('Reduce')
+
+StateT = TypeVar("StateT")
+
+class ParseTableBase(Generic[StateT]):
+    states: Dict[StateT, Dict[str, Tuple]]
+    start_states: Dict[str, StateT]
+    end_states: Dict[str, StateT]
+
+    def __init__(self, states, start_states, end_states):
+        self.states = states
+        self.start_states = start_states
+        self.end_states = end_states
+
+    def serialize(self, memo):
+        tokens = Enumerator()
+
+        states = {
+            state: {tokens.get(token): ((1, arg.serialize(memo)) if action is Reduce else (0, arg))
+                    for token, (action, arg) in actions.items()}
+            for state, actions in self.states.items()
+        }
+
+        return {
+            'tokens': tokens.reversed(),
+            'states': states,
+            'start_states': self.start_states,
+            'end_states': self.end_states,
+        }
+
+    @classmethod
+    def deserialize(cls, data, memo):
+        tokens = data['tokens']
+        states = {
+            state: {tokens[token]: ((Reduce, Rule.deserialize(arg, memo)) if action==1 else (Shift, arg))
+                    for token, (action, arg) in actions.items()}
+            for state, actions in data['states'].items()
+        }
+        return cls(states, data['start_states'], data['end_states'])
+
+class ParseTable(ParseTableBase['State']):
+    #--
+    pass
+
+
+class IntParseTable(ParseTableBase[int]):
+    #--
+
+    @classmethod
+    def from_ParseTable(cls, parse_table: ParseTable):
+        enum = list(parse_table.states)
+        state_to_idx: Dict['State', int] = {s:i for i,s in enumerate(enum)}
+        int_states = {}
+
+        for s, la in parse_table.states.items():
+            la = {k:(v[0], state_to_idx[v[1]]) if v[0] is Shift else v
+                  for k,v in la.items()}
+            int_states[ state_to_idx[s] ] = la
+
+
+        start_states = {start:state_to_idx[s] for start, s in parse_table.start_states.items()}
+        end_states = {start:state_to_idx[s] for start, s in parse_table.end_states.items()}
+        return cls(int_states, start_states, end_states)
+
+
+
+class ParseConf(Generic[StateT]):
+    __slots__ = 'parse_table', 'callbacks', 'start', 'start_state', 'end_state', 'states'
+
+    parse_table: ParseTableBase[StateT]
+    callbacks: ParserCallbacks
+    start: str
+
+    start_state: StateT
+    end_state: StateT
+    states: Dict[StateT, Dict[str, tuple]]
+
+    def __init__(self, parse_table: ParseTableBase[StateT], callbacks: ParserCallbacks, start: str):
+        self.parse_table = parse_table
+
+        self.start_state = self.parse_table.start_states[start]
+        self.end_state = self.parse_table.end_states[start]
+        self.states = self.parse_table.states
+
+        self.callbacks = callbacks
+        self.start = start
+
+class ParserState(Generic[StateT]):
+    __slots__ = 'parse_conf', 'lexer', 'state_stack', 'value_stack'
+
+    parse_conf: ParseConf[StateT]
+    lexer: LexerThread
+    state_stack: List[StateT]
+    value_stack: list
+
+    def __init__(self, parse_conf: ParseConf[StateT], lexer: LexerThread, state_stack=None, value_stack=None):
+        self.parse_conf = parse_conf
+        self.lexer = lexer
+        self.state_stack = state_stack or [self.parse_conf.start_state]
+        self.value_stack = value_stack or []
+
+    @property
+    def position(self) -> StateT:
+        return self.state_stack[-1]
+
+    ##
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ParserState):
+            return NotImplemented
+        return len(self.state_stack) == len(other.state_stack) and self.position == other.position
+
+    def __copy__(self):
+        return self.copy()
+
+    def copy(self, deepcopy_values=True) -> 'ParserState[StateT]':
+        return type(self)(
+            self.parse_conf,
+            self.lexer, ##
+
+            copy(self.state_stack),
+            deepcopy(self.value_stack) if deepcopy_values else copy(self.value_stack),
+        )
+
+    def feed_token(self, token: Token, is_end=False) -> Any:
+        state_stack = self.state_stack
+        value_stack = self.value_stack
+        states = self.parse_conf.states
+        end_state = self.parse_conf.end_state
+        callbacks = self.parse_conf.callbacks
+
+        while True:
+            state = state_stack[-1]
+            try:
+                action, arg = states[state][token.type]
+            except KeyError:
+                expected = {s for s in states[state].keys() if s.isupper()}
+                raise UnexpectedToken(token, expected, state=self, interactive_parser=None)
+
+            assert arg != end_state
+
+            if action is Shift:
+                ##
+
+                assert not is_end
+                state_stack.append(arg)
+                value_stack.append(token if token.type not in callbacks else callbacks[token.type](token))
+                return
+            else:
+                ##
+
+                rule = arg
+                size = len(rule.expansion)
+                if size:
+                    s = value_stack[-size:]
+                    del state_stack[-size:]
+                    del value_stack[-size:]
+                else:
+                    s = []
+
+                value = callbacks[rule](s) if callbacks else s
+
+                _action, new_state = states[state_stack[-1]][rule.origin.name]
+                assert _action is Shift
+                state_stack.append(new_state)
+                value_stack.append(value)
+
+                if is_end and state_stack[-1] == end_state:
+                    return value_stack[-1]
+
+
+class LALR_Parser(Serialize):
+    def __init__(self, parser_conf: ParserConf, debug: bool=False, strict: bool=False):
+        analysis = LALR_Analyzer(parser_conf, debug=debug, strict=strict)
+        analysis.compute_lalr()
+        callbacks = parser_conf.callbacks
+
+        self._parse_table = analysis.parse_table
+        self.parser_conf = parser_conf
+        self.parser = _Parser(analysis.parse_table, callbacks, debug)
+
+    @classmethod
+    def deserialize(cls, data, memo, callbacks, debug=False):
+        inst = cls.__new__(cls)
+        inst._parse_table = IntParseTable.deserialize(data, memo)
+        inst.parser = _Parser(inst._parse_table, callbacks, debug)
+        return inst
+
+    def serialize(self, memo: Any = None) -> Dict[str, Any]:
+        return self._parse_table.serialize(memo)
+
+    def parse_interactive(self, lexer: LexerThread, start: str):
+        return self.parser.parse(lexer, start, start_interactive=True)
+
+    def parse(self, lexer, start, on_error=None):
+        try:
+            return self.parser.parse(lexer, start)
+        except UnexpectedInput as e:
+            if on_error is None:
+                raise
+
+            while True:
+                if isinstance(e, UnexpectedCharacters):
+                    s = e.interactive_parser.lexer_thread.state
+                    p = s.line_ctr.char_pos
+
+                if not on_error(e):
+                    raise e
+
+                if isinstance(e, UnexpectedCharacters):
+                    ##
+
+                    if p == s.line_ctr.char_pos:
+                        s.line_ctr.feed(s.text.text[p:p+1])
+
+                try:
+                    return e.interactive_parser.resume_parse()
+                except UnexpectedToken as e2:
+                    if (isinstance(e, UnexpectedToken)
+                        and e.token.type == e2.token.type == '$END'
+                        and e.interactive_parser == e2.interactive_parser):
+                        ##
+
+                        raise e2
+                    e = e2
+                except UnexpectedCharacters as e2:
+                    e = e2
+
+
+class _Parser:
+    parse_table: ParseTableBase
+    callbacks: ParserCallbacks
+    debug: bool
+
+    def __init__(self, parse_table: ParseTableBase, callbacks: ParserCallbacks, debug: bool=False):
+        self.parse_table = parse_table
+        self.callbacks = callbacks
+        self.debug = debug
+
+    def parse(self, lexer: LexerThread, start: str, value_stack=None, state_stack=None, start_interactive=False):
+        parse_conf = ParseConf(self.parse_table, self.callbacks, start)
+        parser_state = ParserState(parse_conf, lexer, state_stack, value_stack)
+        if start_interactive:
+            return InteractiveParser(self, parser_state, parser_state.lexer)
+        return self.parse_from_state(parser_state)
+
+
+    def parse_from_state(self, state: ParserState, last_token: Optional[Token]=None):
+        #--
+        try:
+            token = last_token
+            for token in state.lexer.lex(state):
+                assert token is not None
+                state.feed_token(token)
+
+            end_token = Token.new_borrow_pos('$END', '', token) if token else Token('$END', '', 0, 1, 1)
+            return state.feed_token(end_token, True)
+        except UnexpectedInput as e:
+            try:
+                e.interactive_parser = InteractiveParser(self, state, state.lexer)
+            except NameError:
+                pass
+            raise e
+        except Exception as e:
+            if self.debug:
+                print("")
+                print("STATE STACK DUMP")
+                print("----------------")
+                for i, s in enumerate(state.state_stack):
+                    print('%d)' % i , s)
+                print("")
+
+            raise
+
+
+class InteractiveParser:
+    #--
+    def __init__(self, parser, parser_state: ParserState, lexer_thread: LexerThread):
+        self.parser = parser
+        self.parser_state = parser_state
+        self.lexer_thread = lexer_thread
+        self.result = None
+
+    @property
+    def lexer_state(self) -> LexerThread:
+        warnings.warn("lexer_state will be removed in subsequent releases. Use lexer_thread instead.", DeprecationWarning)
+        return self.lexer_thread
+
+    def feed_token(self, token: Token):
+        #--
+        return self.parser_state.feed_token(token, token.type == '$END')
+
+    def iter_parse(self) -> Iterator[Token]:
+        #--
+        for token in self.lexer_thread.lex(self.parser_state):
+            yield token
+            self.result = self.feed_token(token)
+
+    def exhaust_lexer(self) -> List[Token]:
+        #--
+        return list(self.iter_parse())
+
+
+    def feed_eof(self, last_token=None):
+        #--
+        eof = Token.new_borrow_pos('$END', '', last_token) if last_token is not None else self.lexer_thread._Token('$END', '', 0, 1, 1)
+        return self.feed_token(eof)
+
+
+    def __copy__(self):
+        #--
+        return self.copy()
+
+    def copy(self, deepcopy_values=True):
+        return type(self)(
+            self.parser,
+            self.parser_state.copy(deepcopy_values=deepcopy_values),
+            copy(self.lexer_thread),
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, InteractiveParser):
+            return False
+
+        return self.parser_state == other.parser_state and self.lexer_thread == other.lexer_thread
+
+    def as_immutable(self):
+        #--
+        p = copy(self)
+        return ImmutableInteractiveParser(p.parser, p.parser_state, p.lexer_thread)
+
+    def pretty(self):
+        #--
+        out = ["Parser choices:"]
+        for k, v in self.choices().items():
+            out.append('\t- %s -> %r' % (k, v))
+        out.append('stack size: %s' % len(self.parser_state.state_stack))
+        return '\n'.join(out)
+
+    def choices(self):
+        #--
+        return self.parser_state.parse_conf.parse_table.states[self.parser_state.position]
+
+    def accepts(self):
+        #--
+        accepts = set()
+        conf_no_callbacks = copy(self.parser_state.parse_conf)
+        ##
+
+        ##
+
+        conf_no_callbacks.callbacks = {}
+        for t in self.choices():
+            if t.isupper(): ##
+
+                new_cursor = self.copy(deepcopy_values=False)
+                new_cursor.parser_state.parse_conf = conf_no_callbacks
+                try:
+                    new_cursor.feed_token(self.lexer_thread._Token(t, ''))
+                except UnexpectedToken:
+                    pass
+                else:
+                    accepts.add(t)
+        return accepts
+
+    def resume_parse(self):
+        #--
+        return self.parser.parse_from_state(self.parser_state, last_token=self.lexer_thread.state.last_token)
+
+
+
+class ImmutableInteractiveParser(InteractiveParser):
+    #--
+
+    result = None
+
+    def __hash__(self):
+        return hash((self.parser_state, self.lexer_thread))
+
+    def feed_token(self, token):
+        c = copy(self)
+        c.result = InteractiveParser.feed_token(c, token)
+        return c
+
+    def exhaust_lexer(self):
+        #--
+        cursor = self.as_mutable()
+        cursor.exhaust_lexer()
+        return cursor.as_immutable()
+
+    def as_mutable(self):
+        #--
+        p = copy(self)
+        return InteractiveParser(p.parser, p.parser_state, p.lexer_thread)
+
+
+
+def _wrap_lexer(lexer_class):
+    future_interface = getattr(lexer_class, '__future_interface__', 0)
+    if future_interface == 2:
+        return lexer_class
+    elif future_interface == 1:
+        class CustomLexerWrapper1(Lexer):
+            def __init__(self, lexer_conf):
+                self.lexer = lexer_class(lexer_conf)
+            def lex(self, lexer_state, parser_state):
+                if isinstance(lexer_state.text, TextSlice) and not lexer_state.text.is_complete_text():
+                    raise TypeError("Interface=1 Custom Lexer don't support TextSlice")
+                lexer_state.text = lexer_state.text
+                return self.lexer.lex(lexer_state, parser_state)
+        return CustomLexerWrapper1
+    elif future_interface == 0:
+        class CustomLexerWrapper0(Lexer):
+            def __init__(self, lexer_conf):
+                self.lexer = lexer_class(lexer_conf)
+
+            def lex(self, lexer_state, parser_state):
+                if isinstance(lexer_state.text, TextSlice):
+                    if not lexer_state.text.is_complete_text():
+                        raise TypeError("Interface=0 Custom Lexer don't support TextSlice")
+                    return self.lexer.lex(lexer_state.text.text)
+                return self.lexer.lex(lexer_state.text)
+        return CustomLexerWrapper0
+    else:
+        raise ValueError(f"Unknown __future_interface__ value {future_interface}, integer 0-2 expected")
+
+
+def _deserialize_parsing_frontend(data, memo, lexer_conf, callbacks, options):
+    parser_conf = ParserConf.deserialize(data['parser_conf'], memo)
+    cls = (options and options._plugins.get('LALR_Parser')) or LALR_Parser
+    parser = cls.deserialize(data['parser'], memo, callbacks, options.debug)
+    parser_conf.callbacks = callbacks
+    return ParsingFrontend(lexer_conf, parser_conf, options, parser=parser)
+
+
+_parser_creators: 'Dict[str, Callable[[LexerConf, Any, Any], Any]]' = {}
+
+
+class ParsingFrontend(Serialize):
+    __serialize_fields__ = 'lexer_conf', 'parser_conf', 'parser'
+
+    lexer_conf: LexerConf
+    parser_conf: ParserConf
+    options: Any
+
+    def __init__(self, lexer_conf: LexerConf, parser_conf: ParserConf, options, parser=None):
+        self.parser_conf = parser_conf
+        self.lexer_conf = lexer_conf
+        self.options = options
+
+        ##
+
+        if parser:  ##
+
+            self.parser = parser
+        else:
+            create_parser = _parser_creators.get(parser_conf.parser_type)
+            assert create_parser is not None, "{} is not supported in standalone mode".format(
+                    parser_conf.parser_type
+                )
+            self.parser = create_parser(lexer_conf, parser_conf, options)
+
+        ##
+
+        lexer_type = lexer_conf.lexer_type
+        self.skip_lexer = False
+        if lexer_type in ('dynamic', 'dynamic_complete'):
+            assert lexer_conf.postlex is None
+            self.skip_lexer = True
+            return
+
+        if isinstance(lexer_type, type):
+            assert issubclass(lexer_type, Lexer)
+            self.lexer = _wrap_lexer(lexer_type)(lexer_conf)
+        elif isinstance(lexer_type, str):
+            create_lexer = {
+                'basic': create_basic_lexer,
+                'contextual': create_contextual_lexer,
+            }[lexer_type]
+            self.lexer = create_lexer(lexer_conf, self.parser, lexer_conf.postlex, options)
+        else:
+            raise TypeError("Bad value for lexer_type: {lexer_type}")
+
+        if lexer_conf.postlex:
+            self.lexer = PostLexConnector(self.lexer, lexer_conf.postlex)
+
+    def _verify_start(self, start=None):
+        if start is None:
+            start_decls = self.parser_conf.start
+            if len(start_decls) > 1:
+                raise ConfigurationError("Lark initialized with more than 1 possible start rule. Must specify which start rule to parse", start_decls)
+            start ,= start_decls
+        elif start not in self.parser_conf.start:
+            raise ConfigurationError("Unknown start rule %s. Must be one of %r" % (start, self.parser_conf.start))
+        return start
+
+    def _make_lexer_thread(self, text: Optional[LarkInput]) -> Union[LarkInput, LexerThread, None]:
+        cls = (self.options and self.options._plugins.get('LexerThread')) or LexerThread
+        if self.skip_lexer:
+            return text
+        if text is None:
+            return cls(self.lexer, None)
+        if isinstance(text, (str, bytes, TextSlice)):
+            return cls.from_text(self.lexer, text)
+        return cls.from_custom_input(self.lexer, text)
+
+    def parse(self, text: Optional[LarkInput], start=None, on_error=None):
+        if self.lexer_conf.lexer_type in ("dynamic", "dynamic_complete"):
+            if isinstance(text, TextSlice) and not text.is_complete_text():
+                raise TypeError(f"Lexer {self.lexer_conf.lexer_type} does not support text slices.")
+
+        chosen_start = self._verify_start(start)
+        kw = {} if on_error is None else {'on_error': on_error}
+        stream = self._make_lexer_thread(text)
+        return self.parser.parse(stream, chosen_start, **kw)
+
+    def parse_interactive(self, text: Optional[TextOrSlice]=None, start=None):
+        ##
+
+        ##
+
+        chosen_start = self._verify_start(start)
+        if self.parser_conf.parser_type != 'lalr':
+            raise ConfigurationError("parse_interactive() currently only works with parser='lalr' ")
+        stream = self._make_lexer_thread(text)
+        return self.parser.parse_interactive(stream, chosen_start)
+
+
+def _validate_frontend_args(parser, lexer) -> None:
+    assert_config(parser, ('lalr', 'earley', 'cyk'))
+    if not isinstance(lexer, type):     ##
+
+        expected = {
+            'lalr': ('basic', 'contextual'),
+            'earley': ('basic', 'dynamic', 'dynamic_complete'),
+            'cyk': ('basic', ),
+         }[parser]
+        assert_config(lexer, expected, 'Parser %r does not support lexer %%r, expected one of %%s' % parser)
+
+
+def _get_lexer_callbacks(transformer, terminals):
+    result = {}
+    for terminal in terminals:
+        callback = getattr(transformer, terminal.name, None)
+        if callback is not None:
+            result[terminal.name] = callback
+    return result
+
+class PostLexConnector:
+    def __init__(self, lexer, postlexer):
+        self.lexer = lexer
+        self.postlexer = postlexer
+
+    def lex(self, lexer_state, parser_state):
+        i = self.lexer.lex(lexer_state, parser_state)
+        return self.postlexer.process(i)
+
+
+
+def create_basic_lexer(lexer_conf, parser, postlex, options) -> BasicLexer:
+    cls = (options and options._plugins.get('BasicLexer')) or BasicLexer
+    return cls(lexer_conf)
+
+def create_contextual_lexer(lexer_conf: LexerConf, parser, postlex, options) -> ContextualLexer:
+    cls = (options and options._plugins.get('ContextualLexer')) or ContextualLexer
+    parse_table: ParseTableBase[int] = parser._parse_table
+    states: Dict[int, Collection[str]] = {idx:list(t.keys()) for idx, t in parse_table.states.items()}
+    always_accept: Collection[str] = postlex.always_accept if postlex else ()
+    return cls(lexer_conf, states, always_accept=always_accept)
+
+def create_lalr_parser(lexer_conf: LexerConf, parser_conf: ParserConf, options=None) -> LALR_Parser:
+    debug = options.debug if options else False
+    strict = options.strict if options else False
+    cls = (options and options._plugins.get('LALR_Parser')) or LALR_Parser
+    return cls(parser_conf, debug=debug, strict=strict)
+
+_parser_creators['lalr'] = create_lalr_parser
+
+
+
+
+class PostLex(ABC):
+    @abstractmethod
+    def process(self, stream: Iterator[Token]) -> Iterator[Token]:
+        return stream
+
+    always_accept: Iterable[str] = ()
+
+class LarkOptions(Serialize):
+    #--
+
+    start: List[str]
+    debug: bool
+    strict: bool
+    transformer: 'Optional[Transformer]'
+    propagate_positions: Union[bool, str]
+    maybe_placeholders: bool
+    cache: Union[bool, str]
+    cache_grammar: bool
+    regex: bool
+    g_regex_flags: int
+    keep_all_tokens: bool
+    tree_class: Optional[Callable[[str, List], Any]]
+    parser: _ParserArgType
+    lexer: _LexerArgType
+    ambiguity: 'Literal["auto", "resolve", "explicit", "forest"]'
+    postlex: Optional[PostLex]
+    priority: 'Optional[Literal["auto", "normal", "invert"]]'
+    lexer_callbacks: Dict[str, Callable[[Token], Token]]
+    use_bytes: bool
+    ordered_sets: bool
+    edit_terminals: Optional[Callable[[TerminalDef], TerminalDef]]
+    import_paths: 'List[Union[str, Callable[[Union[None, str, PackageResource], str], Tuple[str, str]]]]'
+    source_path: Optional[str]
+
+    OPTIONS_DOC = r"""
+    **===  General Options  ===**
+
+    start
+            The start symbol. Either a string, or a list of strings for multiple possible starts (Default: "start")
+    debug
+            Display debug information and extra warnings. Use only when debugging (Default: ``False``)
+            When used with Earley, it generates a forest graph as "sppf.png", if 'dot' is installed.
+    strict
+            Throw an exception on any potential ambiguity, including shift/reduce conflicts, and regex collisions.
+    transformer
+            Applies the transformer to every parse tree (equivalent to applying it after the parse, but faster)
+    propagate_positions
+            Propagates positional attributes into the 'meta' attribute of all tree branches.
+            Sets attributes: (line, column, end_line, end_column, start_pos, end_pos,
+                              container_line, container_column, container_end_line, container_end_column)
+            Accepts ``False``, ``True``, or a callable, which will filter which nodes to ignore when propagating.
+    maybe_placeholders
+            When ``True``, the ``[]`` operator returns ``None`` when not matched.
+            When ``False``,  ``[]`` behaves like the ``?`` operator, and returns no value at all.
+            (default= ``True``)
+    cache
+            Cache the results of the Lark grammar analysis, for x2 to x3 faster loading. LALR only for now.
+
+            - When ``False``, does nothing (default)
+            - When ``True``, caches to a temporary file in the local directory
+            - When given a string, caches to the path pointed by the string
+    cache_grammar
+            For use with ``cache`` option. When ``True``, the unanalyzed grammar is also included in the cache.
+            Useful for classes that require the ``Lark.grammar`` to be present (e.g. Reconstructor).
+            (default= ``False``)
+    regex
+            When True, uses the ``regex`` module instead of the stdlib ``re``.
+    g_regex_flags
+            Flags that are applied to all terminals (both regex and strings)
+    keep_all_tokens
+            Prevent the tree builder from automagically removing "punctuation" tokens (Default: ``False``)
+    tree_class
+            Lark will produce trees comprised of instances of this class instead of the default ``lark.Tree``.
+
+    **=== Algorithm Options ===**
+
+    parser
+            Decides which parser engine to use. Accepts "earley" or "lalr". (Default: "earley").
+            (there is also a "cyk" option for legacy)
+    lexer
+            Decides whether or not to use a lexer stage
+
+            - "auto" (default): Choose for me based on the parser
+            - "basic": Use a basic lexer
+            - "contextual": Stronger lexer (only works with parser="lalr")
+            - "dynamic": Flexible and powerful (only with parser="earley")
+            - "dynamic_complete": Same as dynamic, but tries *every* variation of tokenizing possible.
+    ambiguity
+            Decides how to handle ambiguity in the parse. Only relevant if parser="earley"
+
+            - "resolve": The parser will automatically choose the simplest derivation
+              (it chooses consistently: greedy for tokens, non-greedy for rules)
+            - "explicit": The parser will return all derivations wrapped in "_ambig" tree nodes (i.e. a forest).
+            - "forest": The parser will return the root of the shared packed parse forest.
+
+    **=== Misc. / Domain Specific Options ===**
+
+    postlex
+            Lexer post-processing (Default: ``None``) Only works with the basic and contextual lexers.
+    priority
+            How priorities should be evaluated - "auto", ``None``, "normal", "invert" (Default: "auto")
+    lexer_callbacks
+            Dictionary of callbacks for the lexer. May alter tokens during lexing. Use with caution.
+    use_bytes
+            Accept an input of type ``bytes`` instead of ``str``.
+    ordered_sets
+            Should Earley use ordered-sets to achieve stable output (~10% slower than regular sets. Default: True)
+    edit_terminals
+            A callback for editing the terminals before parse.
+    import_paths
+            A List of either paths or loader functions to specify from where grammars are imported
+    source_path
+            Override the source of from where the grammar was loaded. Useful for relative imports and unconventional grammar loading
+    **=== End of Options ===**
+    """
+    if __doc__:
+        __doc__ += OPTIONS_DOC
+
+
+    ##
+
+    ##
+
+    ##
+
+    ##
+
+    ##
+
+    ##
+
+    _defaults: Dict[str, Any] = {
+        'debug': False,
+        'strict': False,
+        'keep_all_tokens': False,
+        'tree_class': None,
+        'cache': False,
+        'cache_grammar': False,
+        'postlex': None,
+        'parser': 'earley',
+        'lexer': 'auto',
+        'transformer': None,
+        'start': 'start',
+        'priority': 'auto',
+        'ambiguity': 'auto',
+        'regex': False,
+        'propagate_positions': False,
+        'lexer_callbacks': {},
+        'maybe_placeholders': True,
+        'edit_terminals': None,
+        'g_regex_flags': 0,
+        'use_bytes': False,
+        'ordered_sets': True,
+        'import_paths': [],
+        'source_path': None,
+        '_plugins': {},
+    }
+
+    def __init__(self, options_dict: Dict[str, Any]) -> None:
+        o = dict(options_dict)
+
+        options = {}
+        for name, default in self._defaults.items():
+            if name in o:
+                value = o.pop(name)
+                if isinstance(default, bool) and name not in ('cache', 'use_bytes', 'propagate_positions'):
+                    value = bool(value)
+            else:
+                value = default
+
+            options[name] = value
+
+        if isinstance(options['start'], str):
+            options['start'] = [options['start']]
+
+        self.__dict__['options'] = options
+
+
+        assert_config(self.parser, ('earley', 'lalr', 'cyk', None))
+
+        if self.parser == 'earley' and self.transformer:
+            raise ConfigurationError('Cannot specify an embedded transformer when using the Earley algorithm. '
+                             'Please use your transformer on the resulting parse tree, or use a different algorithm (i.e. LALR)')
+
+        if self.cache_grammar and not self.cache:
+            raise ConfigurationError('cache_grammar cannot be set when cache is disabled')
+
+        if o:
+            raise ConfigurationError("Unknown options: %s" % o.keys())
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self.__dict__['options'][name]
+        except KeyError as e:
+            raise AttributeError(e)
+
+    def __setattr__(self, name: str, value: str) -> None:
+        assert_config(name, self.options.keys(), "%r isn't a valid option. Expected one of: %s")
+        self.options[name] = value
+
+    def serialize(self, memo = None) -> Dict[str, Any]:
+        return self.options
+
+    @classmethod
+    def deserialize(cls, data: Dict[str, Any], memo: Dict[int, Union[TerminalDef, Rule]]) -> "LarkOptions":
+        return cls(data)
+
+
+##
+
+##
+
+_LOAD_ALLOWED_OPTIONS = {'postlex', 'transformer', 'lexer_callbacks', 'use_bytes', 'debug', 'g_regex_flags', 'regex', 'propagate_positions', 'tree_class', '_plugins'}
+
+_VALID_PRIORITY_OPTIONS = ('auto', 'normal', 'invert', None)
+_VALID_AMBIGUITY_OPTIONS = ('auto', 'resolve', 'explicit', 'forest')
+
+
+_T = TypeVar('_T', bound="Lark")
+
+class Lark(Serialize):
+    #--
+
+    source_path: str
+    source_grammar: str
+    grammar: 'Grammar'
+    options: LarkOptions
+    lexer: Lexer
+    parser: 'ParsingFrontend'
+    terminals: Collection[TerminalDef]
+
+    __serialize_fields__ = ['parser', 'rules', 'options']
+
+    def __init__(self, grammar: 'Union[Grammar, str, IO[str]]', **options) -> None:
+        self.options = LarkOptions(options)
+        re_module: types.ModuleType
+
+        ##
+
+        if self.options.cache_grammar:
+            self.__serialize_fields__ = self.__serialize_fields__ + ['grammar']
+
+        ##
+
+        use_regex = self.options.regex
+        if use_regex:
+            if _has_regex:
+                re_module = regex
+            else:
+                raise ImportError('`regex` module must be installed if calling `Lark(regex=True)`.')
+        else:
+            re_module = re
+
+        ##
+
+        if self.options.source_path is None:
+            try:
+                self.source_path = grammar.name  ##
+
+            except AttributeError:
+                self.source_path = '<string>'
+        else:
+            self.source_path = self.options.source_path
+
+        ##
+
+        try:
+            read = grammar.read  ##
+
+        except AttributeError:
+            pass
+        else:
+            grammar = read()
+
+        cache_fn = None
+        cache_sha256 = None
+        if isinstance(grammar, str):
+            self.source_grammar = grammar
+            if self.options.use_bytes:
+                if not grammar.isascii():
+                    raise ConfigurationError("Grammar must be ascii only, when use_bytes=True")
+
+            if self.options.cache:
+                if self.options.parser != 'lalr':
+                    raise ConfigurationError("cache only works with parser='lalr' for now")
+
+                unhashable = ('transformer', 'postlex', 'lexer_callbacks', 'edit_terminals', '_plugins')
+                options_str = ''.join(k+str(v) for k, v in options.items() if k not in unhashable)
+                from . import __version__
+                s = grammar + options_str + __version__ + str(sys.version_info[:2])
+                cache_sha256 = sha256_digest(s)
+
+                if isinstance(self.options.cache, str):
+                    cache_fn = self.options.cache
+                else:
+                    if self.options.cache is not True:
+                        raise ConfigurationError("cache argument must be bool or str")
+
+                    try:
+                        username = getpass.getuser()
+                    except Exception:
+                        ##
+
+                        ##
+
+                        ##
+
+                        username = "unknown"
+
+
+                    cache_fn = tempfile.gettempdir() + "/.lark_%s_%s_%s_%s_%s.tmp" % (
+                        "cache_grammar" if self.options.cache_grammar else "cache", username, cache_sha256, *sys.version_info[:2])
+
+                old_options = self.options
+                try:
+                    with FS.open(cache_fn, 'rb') as f:
+                        logger.debug('Loading grammar from cache: %s', cache_fn)
+                        ##
+
+                        for name in (set(options) - _LOAD_ALLOWED_OPTIONS):
+                            del options[name]
+                        file_sha256 = f.readline().rstrip(b'\n')
+                        cached_used_files = pickle.load(f)
+                        if file_sha256 == cache_sha256.encode('utf8') and verify_used_files(cached_used_files):
+                            cached_parser_data = pickle.load(f)
+                            self._load(cached_parser_data, **options)
+                            return
+                except FileNotFoundError:
+                    ##
+
+                    pass
+                except Exception: ##
+
+                    logger.exception("Failed to load Lark from cache: %r. We will try to carry on.", cache_fn)
+
+                    ##
+
+                    ##
+
+                    self.options = old_options
+
+
+            ##
+
+            self.grammar, used_files = load_grammar(grammar, self.source_path, self.options.import_paths, self.options.keep_all_tokens)
+        else:
+            assert isinstance(grammar, Grammar)
+            self.grammar = grammar
+
+
+        if self.options.lexer == 'auto':
+            if self.options.parser == 'lalr':
+                self.options.lexer = 'contextual'
+            elif self.options.parser == 'earley':
+                if self.options.postlex is not None:
+                    logger.info("postlex can't be used with the dynamic lexer, so we use 'basic' instead. "
+                                "Consider using lalr with contextual instead of earley")
+                    self.options.lexer = 'basic'
+                else:
+                    self.options.lexer = 'dynamic'
+            elif self.options.parser == 'cyk':
+                self.options.lexer = 'basic'
+            else:
+                assert False, self.options.parser
+        lexer = self.options.lexer
+        if isinstance(lexer, type):
+            assert issubclass(lexer, Lexer)     ##
+
+        else:
+            assert_config(lexer, ('basic', 'contextual', 'dynamic', 'dynamic_complete'))
+            if self.options.postlex is not None and 'dynamic' in lexer:
+                raise ConfigurationError("Can't use postlex with a dynamic lexer. Use basic or contextual instead")
+
+        if self.options.ambiguity == 'auto':
+            if self.options.parser == 'earley':
+                self.options.ambiguity = 'resolve'
+        else:
+            assert_config(self.options.parser, ('earley', 'cyk'), "%r doesn't support disambiguation. Use one of these parsers instead: %s")
+
+        if self.options.priority == 'auto':
+            self.options.priority = 'normal'
+
+        if self.options.priority not in _VALID_PRIORITY_OPTIONS:
+            raise ConfigurationError("invalid priority option: %r. Must be one of %r" % (self.options.priority, _VALID_PRIORITY_OPTIONS))
+        if self.options.ambiguity not in _VALID_AMBIGUITY_OPTIONS:
+            raise ConfigurationError("invalid ambiguity option: %r. Must be one of %r" % (self.options.ambiguity, _VALID_AMBIGUITY_OPTIONS))
+
+        if self.options.parser is None:
+            terminals_to_keep = '*'     ##
+
+        elif self.options.postlex is not None:
+            terminals_to_keep = set(self.options.postlex.always_accept)
+        else:
+            terminals_to_keep = set()
+
+        ##
+
+        self.terminals, self.rules, self.ignore_tokens = self.grammar.compile(self.options.start, terminals_to_keep)
+
+        if self.options.edit_terminals:
+            for t in self.terminals:
+                self.options.edit_terminals(t)
+
+        self._terminals_dict = {t.name: t for t in self.terminals}
+
+        ##
+
+        if self.options.priority == 'invert':
+            for rule in self.rules:
+                if rule.options.priority is not None:
+                    rule.options.priority = -rule.options.priority
+            for term in self.terminals:
+                term.priority = -term.priority
+        ##
+
+        ##
+
+        ##
+
+        elif self.options.priority is None:
+            for rule in self.rules:
+                if rule.options.priority is not None:
+                    rule.options.priority = None
+            for term in self.terminals:
+                term.priority = 0
+
+        ##
+
+        self.lexer_conf = LexerConf(
+                self.terminals, re_module, self.ignore_tokens, self.options.postlex,
+                self.options.lexer_callbacks, self.options.g_regex_flags, use_bytes=self.options.use_bytes, strict=self.options.strict
+            )
+
+        if self.options.parser:
+            self.parser = self._build_parser()
+        elif lexer:
+            self.lexer = self._build_lexer()
+
+        if cache_fn:
+            logger.debug('Saving grammar to cache: %s', cache_fn)
+            try:
+                with FS.open(cache_fn, 'wb') as f:
+                    assert cache_sha256 is not None
+                    f.write(cache_sha256.encode('utf8') + b'\n')
+                    pickle.dump(used_files, f)
+                    self.save(f, _LOAD_ALLOWED_OPTIONS)
+            except IOError as e:
+                logger.exception("Failed to save Lark to cache: %r.", cache_fn, e)
+
+    if __doc__:
+        __doc__ += "\n\n" + LarkOptions.OPTIONS_DOC
+
+    def _build_lexer(self, dont_ignore: bool=False) -> BasicLexer:
+        lexer_conf = self.lexer_conf
+        if dont_ignore:
+            from copy import copy
+            lexer_conf = copy(lexer_conf)
+            lexer_conf.ignore = ()
+        return BasicLexer(lexer_conf)
+
+    def _prepare_callbacks(self) -> None:
+        self._callbacks = {}
+        ##
+
+        if self.options.ambiguity != 'forest':
+            self._parse_tree_builder = ParseTreeBuilder(
+                    self.rules,
+                    self.options.tree_class or Tree,
+                    self.options.propagate_positions,
+                    self.options.parser != 'lalr' and self.options.ambiguity == 'explicit',
+                    self.options.maybe_placeholders
+                )
+            self._callbacks = self._parse_tree_builder.create_callback(self.options.transformer)
+        self._callbacks.update(_get_lexer_callbacks(self.options.transformer, self.terminals))
+
+    def _build_parser(self) -> "ParsingFrontend":
+        self._prepare_callbacks()
+        _validate_frontend_args(self.options.parser, self.options.lexer)
+        parser_conf = ParserConf(self.rules, self._callbacks, self.options.start)
+        return _construct_parsing_frontend(
+            self.options.parser,
+            self.options.lexer,
+            self.lexer_conf,
+            parser_conf,
+            options=self.options
+        )
+
+    def save(self, f, exclude_options: Collection[str] = ()) -> None:
+        #--
+        if self.options.parser != 'lalr':
+            raise NotImplementedError("Lark.save() is only implemented for the LALR(1) parser.")
+        data, m = self.memo_serialize([TerminalDef, Rule])
+        if exclude_options:
+            data["options"] = {n: v for n, v in data["options"].items() if n not in exclude_options}
+        pickle.dump({'data': data, 'memo': m}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls: Type[_T], f) -> _T:
+        #--
+        inst = cls.__new__(cls)
+        return inst._load(f)
+
+    def _deserialize_lexer_conf(self, data: Dict[str, Any], memo: Dict[int, Union[TerminalDef, Rule]], options: LarkOptions) -> LexerConf:
+        lexer_conf = LexerConf.deserialize(data['lexer_conf'], memo)
+        lexer_conf.callbacks = options.lexer_callbacks or {}
+        lexer_conf.re_module = regex if options.regex else re
+        lexer_conf.use_bytes = options.use_bytes
+        lexer_conf.g_regex_flags = options.g_regex_flags
+        lexer_conf.skip_validation = True
+        lexer_conf.postlex = options.postlex
+        return lexer_conf
+
+    def _load(self: _T, f: Any, **kwargs) -> _T:
+        if isinstance(f, dict):
+            d = f
+        else:
+            d = pickle.load(f)
+        memo_json = d['memo']
+        data = d['data']
+
+        assert memo_json
+        memo = SerializeMemoizer.deserialize(memo_json, {'Rule': Rule, 'TerminalDef': TerminalDef}, {})
+        if 'grammar' in data:
+            self.grammar = Grammar.deserialize(data['grammar'], memo)
+        options = dict(data['options'])
+        if (set(kwargs) - _LOAD_ALLOWED_OPTIONS) & set(LarkOptions._defaults):
+            raise ConfigurationError("Some options are not allowed when loading a Parser: {}"
+                             .format(set(kwargs) - _LOAD_ALLOWED_OPTIONS))
+        options.update(kwargs)
+        self.options = LarkOptions.deserialize(options, memo)
+        self.rules = [Rule.deserialize(r, memo) for r in data['rules']]
+        self.source_path = '<deserialized>'
+        _validate_frontend_args(self.options.parser, self.options.lexer)
+        self.lexer_conf = self._deserialize_lexer_conf(data['parser'], memo, self.options)
+        self.terminals = self.lexer_conf.terminals
+        self._prepare_callbacks()
+        self._terminals_dict = {t.name: t for t in self.terminals}
+        self.parser = _deserialize_parsing_frontend(
+            data['parser'],
+            memo,
+            self.lexer_conf,
+            self._callbacks,
+            self.options,  ##
+
+        )
+        return self
+
+    @classmethod
+    def _load_from_dict(cls, data, memo, **kwargs):
+        inst = cls.__new__(cls)
+        return inst._load({'data': data, 'memo': memo}, **kwargs)
+
+    @classmethod
+    def open(cls: Type[_T], grammar_filename: str, rel_to: Optional[str]=None, **options) -> _T:
+        #--
+        if rel_to:
+            basepath = os.path.dirname(rel_to)
+            grammar_filename = os.path.join(basepath, grammar_filename)
+        with open(grammar_filename, encoding='utf8') as f:
+            return cls(f, **options)
+
+    @classmethod
+    def open_from_package(cls: Type[_T], package: str, grammar_path: str, search_paths: 'Sequence[str]'=[""], **options) -> _T:
+        #--
+        package_loader = FromPackageLoader(package, search_paths)
+        full_path, text = package_loader(None, grammar_path)
+        options.setdefault('source_path', full_path)
+        options.setdefault('import_paths', [])
+        options['import_paths'].append(package_loader)
+        return cls(text, **options)
+
+    def __repr__(self):
+        return 'Lark(open(%r), parser=%r, lexer=%r, ...)' % (self.source_path, self.options.parser, self.options.lexer)
+
+
+    def lex(self, text: TextOrSlice, dont_ignore: bool=False) -> Iterator[Token]:
+        #--
+        lexer: Lexer
+        if not hasattr(self, 'lexer') or dont_ignore:
+            lexer = self._build_lexer(dont_ignore)
+        else:
+            lexer = self.lexer
+        lexer_thread = LexerThread.from_text(lexer, text)
+        stream = lexer_thread.lex(None)
+        if self.options.postlex:
+            return self.options.postlex.process(stream)
+        return stream
+
+    def get_terminal(self, name: str) -> TerminalDef:
+        #--
+        return self._terminals_dict[name]
+
+    def parse_interactive(self, text: Optional[LarkInput]=None, start: Optional[str]=None) -> 'InteractiveParser':
+        #--
+        return self.parser.parse_interactive(text, start=start)
+
+    def parse(self, text: LarkInput, start: Optional[str]=None, on_error: 'Optional[Callable[[UnexpectedInput], bool]]'=None) -> 'ParseTree':
+        #--
+        if on_error is not None and self.options.parser != 'lalr':
+            raise NotImplementedError("The on_error option is only implemented for the LALR(1) parser.")
+        return self.parser.parse(text, start=start, on_error=on_error)
+
+
+
+
+class DedentError(LarkError):
+    pass
+
+class Indenter(PostLex, ABC):
+    #--
+    paren_level: int
+    indent_level: List[int]
+
+    def __init__(self) -> None:
+        self.paren_level = 0
+        self.indent_level = [0]
+        assert self.tab_len > 0
+
+    def handle_NL(self, token: Token) -> Iterator[Token]:
+        if self.paren_level > 0:
+            return
+
+        yield token
+
+        indent_str = token.rsplit('\n', 1)[1] ##
+
+        indent = indent_str.count(' ') + indent_str.count('\t') * self.tab_len
+
+        if indent > self.indent_level[-1]:
+            self.indent_level.append(indent)
+            yield Token.new_borrow_pos(self.INDENT_type, indent_str, token)
+        else:
+            while indent < self.indent_level[-1]:
+                self.indent_level.pop()
+                yield Token.new_borrow_pos(self.DEDENT_type, indent_str, token)
+
+            if indent != self.indent_level[-1]:
+                raise DedentError('Unexpected dedent to column %s. Expected dedent to %s' % (indent, self.indent_level[-1]))
+
+    def _process(self, stream):
+        token = None
+        for token in stream:
+            if token.type == self.NL_type:
+                yield from self.handle_NL(token)
+            else:
+                yield token
+
+            if token.type in self.OPEN_PAREN_types:
+                self.paren_level += 1
+            elif token.type in self.CLOSE_PAREN_types:
+                self.paren_level -= 1
+                assert self.paren_level >= 0
+
+        while len(self.indent_level) > 1:
+            self.indent_level.pop()
+            yield Token.new_borrow_pos(self.DEDENT_type, '', token) if token else Token(self.DEDENT_type, '', 0, 0, 0, 0, 0, 0)
+
+        assert self.indent_level == [0], self.indent_level
+
+    def process(self, stream):
+        self.paren_level = 0
+        self.indent_level = [0]
+        return self._process(stream)
+
+    ##
+
+    @property
+    def always_accept(self):
+        return (self.NL_type,)
+
+    @property
+    @abstractmethod
+    def NL_type(self) -> str:
+        #--
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def OPEN_PAREN_types(self) -> List[str]:
+        #--
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def CLOSE_PAREN_types(self) -> List[str]:
+        #--
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def INDENT_type(self) -> str:
+        #--
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def DEDENT_type(self) -> str:
+        #--
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def tab_len(self) -> int:
+        #--
+        raise NotImplementedError()
+
+
+class PythonIndenter(Indenter):
+    #--
+
+    NL_type = '_NEWLINE'
+    OPEN_PAREN_types = ['LPAR', 'LSQB', 'LBRACE']
+    CLOSE_PAREN_types = ['RPAR', 'RSQB', 'RBRACE']
+    INDENT_type = '_INDENT'
+    DEDENT_type = '_DEDENT'
+    tab_len = 8
+
+
+import pickle, zlib, base64
+DATA = (
+{'parser': {'lexer_conf': {'terminals': [{'@': 0}, {'@': 1}, {'@': 2}, {'@': 3}, {'@': 4}, {'@': 5}, {'@': 6}, {'@': 7}, {'@': 8}, {'@': 9}, {'@': 10}, {'@': 11}, {'@': 12}, {'@': 13}, {'@': 14}, {'@': 15}, {'@': 16}, {'@': 17}, {'@': 18}, {'@': 19}, {'@': 20}, {'@': 21}, {'@': 22}, {'@': 23}, {'@': 24}, {'@': 25}, {'@': 26}, {'@': 27}, {'@': 28}, {'@': 29}, {'@': 30}, {'@': 31}, {'@': 32}, {'@': 33}, {'@': 34}, {'@': 35}, {'@': 36}, {'@': 37}, {'@': 38}, {'@': 39}, {'@': 40}, {'@': 41}, {'@': 42}, {'@': 43}, {'@': 44}, {'@': 45}, {'@': 46}, {'@': 47}, {'@': 48}, {'@': 49}, {'@': 50}, {'@': 51}, {'@': 52}, {'@': 53}, {'@': 54}, {'@': 55}, {'@': 56}, {'@': 57}, {'@': 58}, {'@': 59}, {'@': 60}, {'@': 61}, {'@': 62}, {'@': 63}, {'@': 64}, {'@': 65}, {'@': 66}, {'@': 67}, {'@': 68}, {'@': 69}, {'@': 70}, {'@': 71}, {'@': 72}, {'@': 73}, {'@': 74}, {'@': 75}, {'@': 76}, {'@': 77}, {'@': 78}, {'@': 79}, {'@': 80}, {'@': 81}, {'@': 82}, {'@': 83}, {'@': 84}, {'@': 85}, {'@': 86}, {'@': 87}, {'@': 88}, {'@': 89}, {'@': 90}, {'@': 91}, {'@': 92}], 'ignore': ['WS'], 'g_regex_flags': 0, 'use_bytes': False, 'lexer_type': 'contextual', '__type__': 'LexerConf'}, 'parser_conf': {'rules': [{'@': 93}, {'@': 94}, {'@': 95}, {'@': 96}, {'@': 97}, {'@': 98}, {'@': 99}, {'@': 100}, {'@': 101}, {'@': 102}, {'@': 103}, {'@': 104}, {'@': 105}, {'@': 106}, {'@': 107}, {'@': 108}, {'@': 109}, {'@': 110}, {'@': 111}, {'@': 112}, {'@': 113}, {'@': 114}, {'@': 115}, {'@': 116}, {'@': 117}, {'@': 118}, {'@': 119}, {'@': 120}, {'@': 121}, {'@': 122}, {'@': 123}, {'@': 124}, {'@': 125}, {'@': 126}, {'@': 127}, {'@': 128}, {'@': 129}, {'@': 130}, {'@': 131}, {'@': 132}, {'@': 133}, {'@': 134}, {'@': 135}, {'@': 136}, {'@': 137}, {'@': 138}, {'@': 139}, {'@': 140}, {'@': 141}, {'@': 142}, {'@': 143}, {'@': 144}, {'@': 145}, {'@': 146}, {'@': 147}, {'@': 148}, {'@': 149}, {'@': 150}, {'@': 151}, {'@': 152}, {'@': 153}, {'@': 154}, {'@': 155}, {'@': 156}, {'@': 157}, {'@': 158}, {'@': 159}, {'@': 160}, {'@': 161}, {'@': 162}, {'@': 163}, {'@': 164}, {'@': 165}, {'@': 166}, {'@': 167}, {'@': 168}, {'@': 169}, {'@': 170}, {'@': 171}, {'@': 172}, {'@': 173}, {'@': 174}, {'@': 175}, {'@': 176}, {'@': 177}, {'@': 178}, {'@': 179}, {'@': 180}, {'@': 181}, {'@': 182}, {'@': 183}, {'@': 184}, {'@': 185}, {'@': 186}, {'@': 187}, {'@': 188}, {'@': 189}, {'@': 190}, {'@': 191}, {'@': 192}, {'@': 193}, {'@': 194}, {'@': 195}, {'@': 196}, {'@': 197}, {'@': 198}, {'@': 199}, {'@': 200}, {'@': 201}, {'@': 202}, {'@': 203}, {'@': 204}, {'@': 205}, {'@': 206}, {'@': 207}], 'start': ['start'], 'parser_type': 'lalr', '__type__': 'ParserConf'}, 'parser': {'tokens': {0: '__ANON_18', 1: 'COMMA', 2: 'BY', 3: 'DESTROYS', 4: '__ANON_37', 5: 'IN', 6: 'WITHIN', 7: '__ANON_19', 8: '__ANON_33', 9: 'LEADING', 10: '__ANON_35', 11: 'AND', 12: '__ANON_28', 13: 'DOT', 14: '__ANON_30', 15: 'IS', 16: '__ANON_34', 17: 'HAS', 18: 'WHEN', 19: '__ANON_38', 20: 'ABILITY', 21: 'FRIENDLY', 22: 'subject_type', 23: 'AN', 24: 'LEXICON_MODEL_KEYWORD', 25: 'MODEL', 26: 'subject', 27: 'MODELS', 28: 'constrained_subject', 29: 'SUCH', 30: 'ALLIED', 31: 'model_keyword', 32: 'IT', 33: 'forward_constraint', 34: 'ONE', 35: 'THAT', 36: 'A', 37: 'ENEMY', 38: 'STRATAGEM', 39: 'base_subject', 40: 'UNIT', 41: 'THIS', 42: 'D', 43: 'word_quantity', 44: '__raw_number_plus_0', 45: 'WORDNUM', 46: 'raw_number', 47: '__ANON_4', 48: 'DIGIT', 49: 'quantity', 50: 'MELEE', 51: '__ANON_13', 52: 'AT', 53: 'obtainable_property', 54: '__ANON_16', 55: '__ANON_25', 56: 'effect', 57: 'timed_effect', 58: '__ANON_17', 59: '__ANON_26', 60: 'modified_effect', 61: 'weapon_qualifier', 62: '__ANON_29', 63: 'UNTIL', 64: 'SUBTRACT', 65: 'WHILE', 66: 'select_effect', 67: 'single_effect', 68: 'additional_effect', 69: 'imperative_rule', 70: 'temporary_effect', 71: '__ANON_32', 72: 'IF', 73: '__ANON_23', 74: '__ANON_15', 75: 'conditional_effect', 76: 'RANGED', 77: '__ANON_27', 78: 'boolean_expression', 79: 'MINUS', 80: '__ANON_36', 81: 'PLUS', 82: 'RSQB', 83: '__ANON_31', 84: 'CP', 85: '__ANON_24', 86: 'ROLL', 87: '__effect_seq_star_2', 88: 'phase_instant', 89: '__ANON_0', 90: 'COMMAND', 91: '__ANON_2', 92: 'PHASE', 93: '__ANON_1', 94: 'constraint', 95: 'is_constraint', 96: '__effect_star_3', 97: 'START', 98: 'END', 99: 'time_qualifier', 100: '__ANON_3', 101: 'step_instant', 102: 'event', 103: 'THE', 104: 'time_condition', 105: '$END', 106: 'weapon_ability', 107: '__ANON_10', 108: '__ANON_8', 109: '__ANON_6', 110: '__ANON_11', 111: '__ANON_20', 112: '__ANON_22', 113: '__ANON_21', 114: 'start', 115: 'effect_seq', 116: 'characteristic', 117: 'LEADERSHIP', 118: '__ANON_7', 119: '__ANON_9', 120: 'ADVANCE', 121: 'HIT', 122: 'CHARGE', 123: 'roll_kind', 124: 'WOUND', 125: '__word_quantity_star_1', 126: 'STEP', 127: 'BATTLE', 128: '__ANON_14', 129: 'use_limit', 130: 'TURN'}, 'states': {0: {0: (1, {'@': 193}), 1: (1, {'@': 193}), 2: (1, {'@': 193}), 3: (1, {'@': 193}), 4: (1, {'@': 193}), 5: (1, {'@': 193}), 6: (1, {'@': 193}), 7: (1, {'@': 193}), 8: (1, {'@': 193}), 9: (1, {'@': 193}), 10: (1, {'@': 193}), 11: (1, {'@': 193}), 12: (1, {'@': 193}), 13: (1, {'@': 193}), 14: (1, {'@': 193}), 15: (1, {'@': 193}), 16: (1, {'@': 193}), 17: (1, {'@': 193}), 18: (1, {'@': 193}), 19: (1, {'@': 193})}, 1: {20: (1, {'@': 119})}, 2: {1: (1, {'@': 100})}, 3: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 26: (0, 167), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 4: {20: (0, 34)}, 5: {42: (0, 127), 43: (0, 154), 44: (0, 178), 45: (0, 168), 46: (0, 59), 47: (0, 141), 48: (0, 47), 49: (0, 37)}, 6: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 50: (0, 77), 24: (0, 205), 51: (0, 211), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 56: (0, 135), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 67: (0, 206), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150)}, 7: {1: (0, 165)}, 8: {1: (1, {'@': 102})}, 9: {1: (0, 58)}, 10: {42: (0, 127), 43: (0, 154), 44: (0, 178), 45: (0, 168), 46: (0, 59), 47: (0, 141), 48: (0, 47), 49: (0, 170)}, 11: {20: (1, {'@': 118})}, 12: {77: (0, 95)}, 13: {18: (1, {'@': 162}), 11: (1, {'@': 162}), 13: (1, {'@': 162})}, 14: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 78: (0, 7), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 26: (0, 45), 41: (0, 150)}, 15: {79: (1, {'@': 201}), 42: (1, {'@': 201}), 45: (1, {'@': 201}), 80: (1, {'@': 201}), 81: (1, {'@': 201}), 11: (1, {'@': 201}), 13: (1, {'@': 201}), 82: (1, {'@': 201}), 83: (1, {'@': 201}), 84: (1, {'@': 201}), 18: (1, {'@': 201}), 85: (1, {'@': 201})}, 16: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 26: (0, 64), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 17: {14: (0, 3), 12: (0, 121), 17: (0, 162)}, 18: {16: (1, {'@': 170}), 4: (1, {'@': 170}), 5: (1, {'@': 170}), 6: (1, {'@': 170}), 9: (1, {'@': 170}), 18: (1, {'@': 170}), 10: (1, {'@': 170}), 19: (1, {'@': 170}), 11: (1, {'@': 170}), 13: (1, {'@': 170}), 14: (1, {'@': 170}), 17: (1, {'@': 170}), 12: (1, {'@': 170}), 15: (1, {'@': 170}), 1: (1, {'@': 170}), 0: (1, {'@': 170}), 2: (1, {'@': 170}), 3: (1, {'@': 170}), 7: (1, {'@': 170}), 8: (1, {'@': 170})}, 19: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 26: (0, 42), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 20: {16: (1, {'@': 175}), 4: (1, {'@': 175}), 5: (1, {'@': 175}), 6: (1, {'@': 175}), 9: (1, {'@': 175}), 18: (1, {'@': 175}), 10: (1, {'@': 175}), 19: (1, {'@': 175}), 11: (1, {'@': 175}), 13: (1, {'@': 175}), 14: (1, {'@': 175}), 17: (1, {'@': 175}), 12: (1, {'@': 175}), 15: (1, {'@': 175}), 1: (1, {'@': 175}), 0: (1, {'@': 175}), 2: (1, {'@': 175}), 3: (1, {'@': 175}), 7: (1, {'@': 175}), 8: (1, {'@': 175})}, 21: {0: (0, 202), 7: (0, 61), 3: (0, 16)}, 22: {86: (1, {'@': 94})}, 23: {86: (1, {'@': 97})}, 24: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 50: (0, 77), 24: (0, 205), 51: (0, 211), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 56: (0, 48), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 67: (0, 206), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150)}, 25: {1: (0, 200)}, 26: {18: (1, {'@': 163}), 11: (1, {'@': 163}), 13: (1, {'@': 163})}, 27: {24: (1, {'@': 185}), 27: (1, {'@': 185}), 29: (1, {'@': 185}), 30: (1, {'@': 185}), 32: (1, {'@': 185}), 35: (1, {'@': 185}), 38: (1, {'@': 185}), 40: (1, {'@': 185}), 25: (1, {'@': 185}), 21: (1, {'@': 185}), 41: (1, {'@': 185}), 20: (1, {'@': 185}), 37: (1, {'@': 185})}, 28: {0: (1, {'@': 189}), 1: (1, {'@': 189}), 2: (1, {'@': 189}), 3: (1, {'@': 189}), 4: (1, {'@': 189}), 5: (1, {'@': 189}), 6: (1, {'@': 189}), 7: (1, {'@': 189}), 8: (1, {'@': 189}), 9: (1, {'@': 189}), 10: (1, {'@': 189}), 11: (1, {'@': 189}), 12: (1, {'@': 189}), 13: (1, {'@': 189}), 14: (1, {'@': 189}), 15: (1, {'@': 189}), 16: (1, {'@': 189}), 17: (1, {'@': 189}), 18: (1, {'@': 189}), 19: (1, {'@': 189})}, 29: {16: (1, {'@': 173}), 4: (1, {'@': 173}), 5: (1, {'@': 173}), 6: (1, {'@': 173}), 9: (1, {'@': 173}), 18: (1, {'@': 173}), 10: (1, {'@': 173}), 19: (1, {'@': 173}), 11: (1, {'@': 173}), 13: (1, {'@': 173}), 14: (1, {'@': 173}), 17: (1, {'@': 173}), 12: (1, {'@': 173}), 15: (1, {'@': 173}), 1: (1, {'@': 173}), 0: (1, {'@': 173}), 2: (1, {'@': 173}), 3: (1, {'@': 173}), 7: (1, {'@': 173}), 8: (1, {'@': 173})}, 30: {13: (0, 75), 87: (0, 182), 18: (0, 174)}, 31: {42: (0, 127), 43: (0, 154), 44: (0, 178), 45: (0, 168), 49: (0, 180), 46: (0, 59), 47: (0, 141), 48: (0, 47)}, 32: {8: (0, 76)}, 33: {16: (1, {'@': 180}), 5: (1, {'@': 180}), 4: (1, {'@': 180}), 6: (1, {'@': 180}), 9: (1, {'@': 180}), 18: (1, {'@': 180}), 10: (1, {'@': 180}), 19: (1, {'@': 180}), 11: (1, {'@': 180}), 13: (1, {'@': 180}), 14: (1, {'@': 180}), 17: (1, {'@': 180}), 12: (1, {'@': 180}), 15: (1, {'@': 180}), 1: (1, {'@': 180}), 0: (1, {'@': 180}), 2: (1, {'@': 180}), 3: (1, {'@': 180}), 7: (1, {'@': 180}), 8: (1, {'@': 180})}, 34: {18: (1, {'@': 164}), 11: (1, {'@': 164}), 13: (1, {'@': 164})}, 35: {8: (0, 155)}, 36: {18: (1, {'@': 155}), 11: (1, {'@': 155}), 13: (1, {'@': 155})}, 37: {82: (1, {'@': 108}), 83: (1, {'@': 108}), 84: (1, {'@': 108}), 18: (1, {'@': 108}), 85: (1, {'@': 108}), 80: (1, {'@': 108}), 81: (1, {'@': 108}), 11: (1, {'@': 108}), 13: (1, {'@': 108})}, 38: {1: (1, {'@': 148})}, 39: {45: (0, 177)}, 40: {86: (1, {'@': 95})}, 41: {1: (1, {'@': 149})}, 42: {0: (1, {'@': 194}), 1: (1, {'@': 194}), 2: (1, {'@': 194}), 3: (1, {'@': 194}), 4: (1, {'@': 194}), 5: (1, {'@': 194}), 6: (1, {'@': 194}), 7: (1, {'@': 194}), 8: (1, {'@': 194}), 9: (1, {'@': 194}), 10: (1, {'@': 194}), 11: (1, {'@': 194}), 12: (1, {'@': 194}), 13: (1, {'@': 194}), 14: (1, {'@': 194}), 15: (1, {'@': 194}), 16: (1, {'@': 194}), 17: (1, {'@': 194}), 18: (1, {'@': 194}), 19: (1, {'@': 194})}, 43: {18: (1, {'@': 127}), 11: (1, {'@': 127}), 13: (1, {'@': 127})}, 44: {18: (1, {'@': 126}), 11: (1, {'@': 126}), 13: (1, {'@': 126})}, 45: {15: (0, 83)}, 46: {88: (0, 41), 89: (0, 86), 90: (0, 146), 91: (0, 173), 92: (0, 103), 93: (0, 2)}, 47: {82: (1, {'@': 196}), 83: (1, {'@': 196}), 84: (1, {'@': 196}), 18: (1, {'@': 196}), 85: (1, {'@': 196}), 80: (1, {'@': 196}), 48: (1, {'@': 196}), 81: (1, {'@': 196}), 11: (1, {'@': 196}), 13: (1, {'@': 196})}, 48: {11: (1, {'@': 137}), 13: (1, {'@': 137})}, 49: {42: (0, 127), 43: (0, 154), 44: (0, 178), 45: (0, 168), 49: (0, 184), 46: (0, 59), 47: (0, 141), 48: (0, 47)}, 50: {11: (1, {'@': 142}), 13: (1, {'@': 142})}, 51: {94: (0, 18), 95: (0, 102), 18: (1, {'@': 168}), 11: (1, {'@': 168}), 13: (1, {'@': 168}), 17: (1, {'@': 168}), 14: (1, {'@': 168}), 12: (1, {'@': 168}), 15: (1, {'@': 168}), 1: (1, {'@': 168}), 0: (1, {'@': 168}), 2: (1, {'@': 168}), 3: (1, {'@': 168}), 7: (1, {'@': 168}), 8: (1, {'@': 168})}, 52: {84: (0, 195)}, 53: {16: (1, {'@': 177}), 4: (1, {'@': 177}), 5: (1, {'@': 177}), 6: (1, {'@': 177}), 9: (1, {'@': 177}), 18: (1, {'@': 177}), 10: (1, {'@': 177}), 19: (1, {'@': 177}), 11: (1, {'@': 177}), 13: (1, {'@': 177}), 14: (1, {'@': 177}), 17: (1, {'@': 177}), 12: (1, {'@': 177}), 15: (1, {'@': 177}), 1: (1, {'@': 177}), 0: (1, {'@': 177}), 2: (1, {'@': 177}), 3: (1, {'@': 177}), 7: (1, {'@': 177}), 8: (1, {'@': 177})}, 54: {96: (0, 128), 13: (1, {'@': 133})}, 55: {16: (1, {'@': 179}), 5: (1, {'@': 179}), 4: (1, {'@': 179}), 6: (1, {'@': 179}), 9: (1, {'@': 179}), 18: (1, {'@': 179}), 10: (1, {'@': 179}), 19: (1, {'@': 179}), 11: (1, {'@': 179}), 13: (1, {'@': 179}), 14: (1, {'@': 179}), 17: (1, {'@': 179}), 12: (1, {'@': 179}), 15: (1, {'@': 179}), 1: (1, {'@': 179}), 0: (1, {'@': 179}), 2: (1, {'@': 179}), 3: (1, {'@': 179}), 7: (1, {'@': 179}), 8: (1, {'@': 179})}, 56: {97: (0, 129), 98: (0, 122), 99: (0, 78), 100: (0, 201), 101: (0, 85)}, 57: {94: (0, 18), 95: (0, 102), 18: (1, {'@': 169}), 11: (1, {'@': 169}), 13: (1, {'@': 169}), 17: (1, {'@': 169}), 14: (1, {'@': 169}), 12: (1, {'@': 169}), 15: (1, {'@': 169}), 1: (1, {'@': 169}), 0: (1, {'@': 169}), 2: (1, {'@': 169}), 3: (1, {'@': 169}), 7: (1, {'@': 169}), 8: (1, {'@': 169})}, 58: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 56: (0, 50), 50: (0, 77), 24: (0, 205), 51: (0, 211), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 67: (0, 206), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150)}, 59: {82: (1, {'@': 106}), 83: (1, {'@': 106}), 84: (1, {'@': 106}), 18: (1, {'@': 106}), 85: (1, {'@': 106}), 80: (1, {'@': 106}), 81: (1, {'@': 106}), 11: (1, {'@': 106}), 13: (1, {'@': 106})}, 60: {18: (0, 174), 13: (1, {'@': 204})}, 61: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 26: (0, 125), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 62: {21: (0, 139), 22: (0, 140), 23: (0, 152), 26: (0, 21), 24: (0, 205), 102: (0, 120), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 63: {42: (0, 127), 43: (0, 154), 44: (0, 178), 45: (0, 168), 49: (0, 105), 46: (0, 59), 47: (0, 141), 48: (0, 47)}, 64: {1: (1, {'@': 145}), 18: (1, {'@': 145}), 11: (1, {'@': 145}), 13: (1, {'@': 145})}, 65: {103: (0, 56), 104: (0, 98)}, 66: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 26: (0, 35), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 67: {16: (1, {'@': 172}), 4: (1, {'@': 172}), 5: (1, {'@': 172}), 6: (1, {'@': 172}), 9: (1, {'@': 172}), 18: (1, {'@': 172}), 10: (1, {'@': 172}), 19: (1, {'@': 172}), 11: (1, {'@': 172}), 13: (1, {'@': 172}), 14: (1, {'@': 172}), 17: (1, {'@': 172}), 12: (1, {'@': 172}), 15: (1, {'@': 172}), 1: (1, {'@': 172}), 0: (1, {'@': 172}), 2: (1, {'@': 172}), 3: (1, {'@': 172}), 7: (1, {'@': 172}), 8: (1, {'@': 172})}, 68: {11: (1, {'@': 141}), 13: (1, {'@': 141})}, 69: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 26: (0, 109), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 70: {45: (0, 15)}, 71: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 26: (0, 156), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 72: {16: (1, {'@': 178}), 4: (1, {'@': 178}), 5: (1, {'@': 178}), 6: (1, {'@': 178}), 9: (1, {'@': 178}), 18: (1, {'@': 178}), 10: (1, {'@': 178}), 19: (1, {'@': 178}), 11: (1, {'@': 178}), 13: (1, {'@': 178}), 14: (1, {'@': 178}), 17: (1, {'@': 178}), 12: (1, {'@': 178}), 15: (1, {'@': 178}), 1: (1, {'@': 178}), 0: (1, {'@': 178}), 2: (1, {'@': 178}), 3: (1, {'@': 178}), 7: (1, {'@': 178}), 8: (1, {'@': 178})}, 73: {82: (1, {'@': 111}), 83: (1, {'@': 111}), 84: (1, {'@': 111}), 18: (1, {'@': 111}), 85: (1, {'@': 111}), 80: (1, {'@': 111}), 11: (1, {'@': 111}), 13: (1, {'@': 111})}, 74: {18: (1, {'@': 129}), 11: (1, {'@': 129}), 13: (1, {'@': 129})}, 75: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 50: (0, 77), 24: (0, 205), 51: (0, 211), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 56: (0, 60), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 67: (0, 206), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150), 105: (1, {'@': 123})}, 76: {106: (0, 204), 107: (0, 1), 108: (0, 151), 109: (0, 137), 110: (0, 31)}, 77: {71: (1, {'@': 116})}, 78: {111: (0, 38), 112: (0, 124)}, 79: {20: (1, {'@': 120})}, 80: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 50: (0, 77), 24: (0, 205), 51: (0, 211), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 56: (0, 84), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 67: (0, 206), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150)}, 81: {96: (0, 128), 13: (1, {'@': 207})}, 82: {1: (0, 187)}, 83: {9: (0, 71), 95: (0, 99), 4: (0, 0), 19: (0, 19), 6: (0, 49), 5: (0, 69)}, 84: {11: (1, {'@': 138}), 13: (1, {'@': 138})}, 85: {113: (0, 46)}, 86: {1: (1, {'@': 99})}, 87: {21: (0, 139), 22: (0, 140), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 160), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 20: (0, 199), 35: (0, 171), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 88: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 50: (0, 77), 24: (0, 205), 51: (0, 211), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 56: (0, 68), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 67: (0, 206), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150)}, 89: {83: (0, 13)}, 90: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 114: (0, 144), 50: (0, 77), 24: (0, 205), 51: (0, 211), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 115: (0, 113), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 56: (0, 30), 30: (0, 27), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 65: (0, 192), 64: (0, 63), 66: (0, 132), 36: (0, 87), 67: (0, 206), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150)}, 91: {18: (1, {'@': 159}), 11: (1, {'@': 159}), 13: (1, {'@': 159})}, 92: {20: (1, {'@': 117})}, 93: {11: (1, {'@': 153}), 13: (1, {'@': 153})}, 94: {21: (0, 139), 22: (0, 140), 24: (0, 205), 28: (0, 161), 25: (0, 33), 27: (0, 110), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 20: (0, 199), 35: (0, 171), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 95: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 26: (0, 134), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 96: {11: (1, {'@': 140}), 13: (1, {'@': 140})}, 97: {0: (1, {'@': 190}), 1: (1, {'@': 190}), 2: (1, {'@': 190}), 3: (1, {'@': 190}), 4: (1, {'@': 190}), 5: (1, {'@': 190}), 6: (1, {'@': 190}), 7: (1, {'@': 190}), 8: (1, {'@': 190}), 9: (1, {'@': 190}), 10: (1, {'@': 190}), 11: (1, {'@': 190}), 12: (1, {'@': 190}), 13: (1, {'@': 190}), 14: (1, {'@': 190}), 15: (1, {'@': 190}), 16: (1, {'@': 190}), 17: (1, {'@': 190}), 18: (1, {'@': 190}), 19: (1, {'@': 190})}, 98: {1: (0, 80)}, 99: {1: (1, {'@': 165})}, 100: {16: (1, {'@': 182}), 5: (1, {'@': 182}), 4: (1, {'@': 182}), 6: (1, {'@': 182}), 9: (1, {'@': 182}), 18: (1, {'@': 182}), 10: (1, {'@': 182}), 19: (1, {'@': 182}), 11: (1, {'@': 182}), 13: (1, {'@': 182}), 14: (1, {'@': 182}), 17: (1, {'@': 182}), 12: (1, {'@': 182}), 15: (1, {'@': 182}), 1: (1, {'@': 182}), 0: (1, {'@': 182}), 2: (1, {'@': 182}), 3: (1, {'@': 182}), 7: (1, {'@': 182}), 8: (1, {'@': 182})}, 101: {1: (1, {'@': 136})}, 102: {0: (1, {'@': 188}), 1: (1, {'@': 188}), 2: (1, {'@': 188}), 3: (1, {'@': 188}), 4: (1, {'@': 188}), 5: (1, {'@': 188}), 6: (1, {'@': 188}), 7: (1, {'@': 188}), 8: (1, {'@': 188}), 9: (1, {'@': 188}), 10: (1, {'@': 188}), 11: (1, {'@': 188}), 12: (1, {'@': 188}), 13: (1, {'@': 188}), 14: (1, {'@': 188}), 15: (1, {'@': 188}), 16: (1, {'@': 188}), 17: (1, {'@': 188}), 18: (1, {'@': 188}), 19: (1, {'@': 188})}, 103: {1: (1, {'@': 103})}, 104: {103: (0, 56), 104: (0, 9)}, 105: {85: (0, 158)}, 106: {42: (0, 127), 43: (0, 154), 44: (0, 178), 45: (0, 168), 49: (0, 89), 46: (0, 59), 47: (0, 141), 48: (0, 47)}, 107: {42: (0, 127), 43: (0, 154), 44: (0, 178), 45: (0, 168), 46: (0, 59), 47: (0, 141), 49: (0, 210), 48: (0, 47)}, 108: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150), 26: (0, 207)}, 109: {0: (1, {'@': 195}), 1: (1, {'@': 195}), 2: (1, {'@': 195}), 3: (1, {'@': 195}), 4: (1, {'@': 195}), 5: (1, {'@': 195}), 6: (1, {'@': 195}), 7: (1, {'@': 195}), 8: (1, {'@': 195}), 9: (1, {'@': 195}), 10: (1, {'@': 195}), 11: (1, {'@': 195}), 12: (1, {'@': 195}), 13: (1, {'@': 195}), 14: (1, {'@': 195}), 15: (1, {'@': 195}), 16: (1, {'@': 195}), 17: (1, {'@': 195}), 18: (1, {'@': 195}), 19: (1, {'@': 195})}, 110: {16: (1, {'@': 181}), 5: (1, {'@': 181}), 4: (1, {'@': 181}), 6: (1, {'@': 181}), 9: (1, {'@': 181}), 18: (1, {'@': 181}), 10: (1, {'@': 181}), 19: (1, {'@': 181}), 11: (1, {'@': 181}), 13: (1, {'@': 181}), 14: (1, {'@': 181}), 17: (1, {'@': 181}), 12: (1, {'@': 181}), 15: (1, {'@': 181}), 1: (1, {'@': 181}), 0: (1, {'@': 181}), 2: (1, {'@': 181}), 3: (1, {'@': 181}), 7: (1, {'@': 181}), 8: (1, {'@': 181})}, 111: {116: (0, 12), 117: (0, 190)}, 112: {24: (1, {'@': 187}), 27: (1, {'@': 187}), 29: (1, {'@': 187}), 30: (1, {'@': 187}), 32: (1, {'@': 187}), 35: (1, {'@': 187}), 38: (1, {'@': 187}), 40: (1, {'@': 187}), 25: (1, {'@': 187}), 21: (1, {'@': 187}), 41: (1, {'@': 187}), 20: (1, {'@': 187}), 37: (1, {'@': 187})}, 113: {105: (1, {'@': 121})}, 114: {21: (0, 139), 22: (0, 140), 24: (0, 205), 25: (0, 33), 28: (0, 57), 27: (0, 110), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 20: (0, 199), 35: (0, 171), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 115: {18: (1, {'@': 161}), 11: (1, {'@': 161}), 13: (1, {'@': 161})}, 116: {18: (1, {'@': 132}), 11: (1, {'@': 132}), 13: (1, {'@': 132})}, 117: {18: (0, 174)}, 118: {79: (1, {'@': 198}), 42: (1, {'@': 198}), 45: (1, {'@': 198}), 80: (1, {'@': 198}), 81: (1, {'@': 198}), 11: (1, {'@': 198}), 13: (1, {'@': 198}), 82: (1, {'@': 198}), 83: (1, {'@': 198}), 84: (1, {'@': 198}), 18: (1, {'@': 198}), 85: (1, {'@': 198})}, 119: {71: (0, 147)}, 120: {1: (0, 88)}, 121: {18: (1, {'@': 158}), 11: (1, {'@': 158}), 13: (1, {'@': 158})}, 122: {111: (1, {'@': 151}), 112: (1, {'@': 151})}, 123: {24: (1, {'@': 184}), 27: (1, {'@': 184}), 29: (1, {'@': 184}), 30: (1, {'@': 184}), 32: (1, {'@': 184}), 35: (1, {'@': 184}), 38: (1, {'@': 184}), 40: (1, {'@': 184}), 25: (1, {'@': 184}), 21: (1, {'@': 184}), 41: (1, {'@': 184}), 20: (1, {'@': 184}), 37: (1, {'@': 184})}, 124: {89: (0, 86), 90: (0, 146), 91: (0, 173), 92: (0, 103), 88: (0, 126), 93: (0, 2)}, 125: {1: (1, {'@': 146}), 18: (1, {'@': 146}), 11: (1, {'@': 146}), 13: (1, {'@': 146})}, 126: {1: (1, {'@': 147})}, 127: {42: (0, 127), 43: (0, 154), 44: (0, 178), 45: (0, 168), 49: (0, 73), 46: (0, 59), 47: (0, 141), 48: (0, 47)}, 128: {18: (1, {'@': 124}), 13: (1, {'@': 124})}, 129: {111: (1, {'@': 150}), 112: (1, {'@': 150})}, 130: {79: (1, {'@': 199}), 42: (1, {'@': 199}), 45: (1, {'@': 199}), 80: (1, {'@': 199}), 81: (1, {'@': 199}), 11: (1, {'@': 199}), 13: (1, {'@': 199}), 82: (1, {'@': 199}), 83: (1, {'@': 199}), 84: (1, {'@': 199}), 18: (1, {'@': 199}), 85: (1, {'@': 199})}, 131: {96: (0, 128), 13: (1, {'@': 206})}, 132: {18: (1, {'@': 131}), 11: (1, {'@': 131}), 13: (1, {'@': 131})}, 133: {84: (0, 91)}, 134: {2: (0, 107)}, 135: {11: (1, {'@': 154}), 13: (1, {'@': 154})}, 136: {1: (1, {'@': 135})}, 137: {118: (0, 92)}, 138: {42: (0, 127), 43: (0, 154), 44: (0, 178), 45: (0, 168), 49: (0, 52), 46: (0, 59), 47: (0, 141), 48: (0, 47)}, 139: {24: (1, {'@': 186}), 27: (1, {'@': 186}), 29: (1, {'@': 186}), 30: (1, {'@': 186}), 32: (1, {'@': 186}), 35: (1, {'@': 186}), 38: (1, {'@': 186}), 40: (1, {'@': 186}), 25: (1, {'@': 186}), 21: (1, {'@': 186}), 41: (1, {'@': 186}), 20: (1, {'@': 186}), 37: (1, {'@': 186})}, 140: {16: (1, {'@': 174}), 4: (1, {'@': 174}), 6: (1, {'@': 174}), 9: (1, {'@': 174}), 18: (1, {'@': 174}), 10: (1, {'@': 174}), 19: (1, {'@': 174}), 11: (1, {'@': 174}), 13: (1, {'@': 174}), 14: (1, {'@': 174}), 17: (1, {'@': 174}), 12: (1, {'@': 174}), 15: (1, {'@': 174}), 1: (1, {'@': 174}), 0: (1, {'@': 174}), 2: (1, {'@': 174}), 3: (1, {'@': 174}), 7: (1, {'@': 174}), 8: (1, {'@': 174})}, 141: {82: (1, {'@': 112}), 83: (1, {'@': 112}), 84: (1, {'@': 112}), 18: (1, {'@': 112}), 85: (1, {'@': 112}), 80: (1, {'@': 112}), 81: (1, {'@': 112}), 11: (1, {'@': 112}), 13: (1, {'@': 112})}, 142: {18: (0, 174), 13: (1, {'@': 205})}, 143: {79: (0, 70), 45: (0, 191), 82: (1, {'@': 113}), 83: (1, {'@': 113}), 42: (1, {'@': 113}), 84: (1, {'@': 113}), 18: (1, {'@': 113}), 85: (1, {'@': 113}), 80: (1, {'@': 113}), 81: (1, {'@': 113}), 13: (1, {'@': 113})}, 144: {}, 145: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 50: (0, 77), 24: (0, 205), 51: (0, 211), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 56: (0, 142), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 67: (0, 206), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150), 105: (1, {'@': 122})}, 146: {92: (0, 8)}, 147: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 26: (0, 32), 40: (0, 55), 41: (0, 150)}, 148: {86: (1, {'@': 96})}, 149: {94: (0, 18), 95: (0, 102), 18: (1, {'@': 166}), 11: (1, {'@': 166}), 13: (1, {'@': 166}), 17: (1, {'@': 166}), 14: (1, {'@': 166}), 12: (1, {'@': 166}), 15: (1, {'@': 166}), 1: (1, {'@': 166}), 0: (1, {'@': 166}), 2: (1, {'@': 166}), 3: (1, {'@': 166}), 7: (1, {'@': 166}), 8: (1, {'@': 166})}, 150: {27: (0, 110), 38: (0, 100), 20: (0, 199), 22: (0, 67), 40: (0, 55), 25: (0, 33)}, 151: {119: (0, 11)}, 152: {21: (0, 139), 22: (0, 140), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 51), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 20: (0, 199), 35: (0, 171), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 153: {18: (1, {'@': 128}), 11: (1, {'@': 128}), 13: (1, {'@': 128})}, 154: {42: (0, 197), 82: (1, {'@': 107}), 83: (1, {'@': 107}), 84: (1, {'@': 107}), 18: (1, {'@': 107}), 85: (1, {'@': 107}), 80: (1, {'@': 107}), 81: (1, {'@': 107}), 11: (1, {'@': 107}), 13: (1, {'@': 107})}, 155: {106: (0, 4), 108: (0, 151), 107: (0, 1), 109: (0, 137), 110: (0, 31)}, 156: {0: (1, {'@': 192}), 1: (1, {'@': 192}), 2: (1, {'@': 192}), 3: (1, {'@': 192}), 4: (1, {'@': 192}), 5: (1, {'@': 192}), 6: (1, {'@': 192}), 7: (1, {'@': 192}), 8: (1, {'@': 192}), 9: (1, {'@': 192}), 10: (1, {'@': 192}), 11: (1, {'@': 192}), 12: (1, {'@': 192}), 13: (1, {'@': 192}), 14: (1, {'@': 192}), 15: (1, {'@': 192}), 16: (1, {'@': 192}), 17: (1, {'@': 192}), 18: (1, {'@': 192}), 19: (1, {'@': 192})}, 157: {1: (1, {'@': 134})}, 158: {120: (0, 148), 121: (0, 22), 122: (0, 23), 123: (0, 186), 124: (0, 40)}, 159: {16: (1, {'@': 176}), 4: (1, {'@': 176}), 5: (1, {'@': 176}), 6: (1, {'@': 176}), 9: (1, {'@': 176}), 18: (1, {'@': 176}), 10: (1, {'@': 176}), 19: (1, {'@': 176}), 11: (1, {'@': 176}), 13: (1, {'@': 176}), 14: (1, {'@': 176}), 17: (1, {'@': 176}), 12: (1, {'@': 176}), 15: (1, {'@': 176}), 1: (1, {'@': 176}), 0: (1, {'@': 176}), 2: (1, {'@': 176}), 3: (1, {'@': 176}), 7: (1, {'@': 176}), 8: (1, {'@': 176})}, 160: {94: (0, 18), 95: (0, 102), 18: (1, {'@': 167}), 11: (1, {'@': 167}), 13: (1, {'@': 167}), 17: (1, {'@': 167}), 14: (1, {'@': 167}), 12: (1, {'@': 167}), 15: (1, {'@': 167}), 1: (1, {'@': 167}), 0: (1, {'@': 167}), 2: (1, {'@': 167}), 3: (1, {'@': 167}), 7: (1, {'@': 167}), 8: (1, {'@': 167})}, 161: {94: (0, 18), 95: (0, 102), 18: (1, {'@': 171}), 11: (1, {'@': 171}), 13: (1, {'@': 171}), 14: (1, {'@': 171}), 17: (1, {'@': 171}), 12: (1, {'@': 171}), 15: (1, {'@': 171}), 1: (1, {'@': 171}), 0: (1, {'@': 171}), 2: (1, {'@': 171}), 3: (1, {'@': 171}), 7: (1, {'@': 171}), 8: (1, {'@': 171})}, 162: {36: (0, 106)}, 163: {82: (1, {'@': 197}), 83: (1, {'@': 197}), 84: (1, {'@': 197}), 18: (1, {'@': 197}), 85: (1, {'@': 197}), 80: (1, {'@': 197}), 48: (1, {'@': 197}), 81: (1, {'@': 197}), 11: (1, {'@': 197}), 13: (1, {'@': 197})}, 164: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 50: (0, 77), 24: (0, 205), 51: (0, 211), 67: (0, 81), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 56: (0, 117), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150)}, 165: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 50: (0, 77), 24: (0, 205), 51: (0, 211), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 56: (0, 93), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 67: (0, 206), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150)}, 166: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 26: (0, 53), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 167: {18: (1, {'@': 160}), 11: (1, {'@': 160}), 13: (1, {'@': 160})}, 168: {79: (0, 198), 125: (0, 143), 45: (0, 130), 82: (1, {'@': 114}), 83: (1, {'@': 114}), 42: (1, {'@': 114}), 84: (1, {'@': 114}), 18: (1, {'@': 114}), 85: (1, {'@': 114}), 80: (1, {'@': 114}), 81: (1, {'@': 114}), 13: (1, {'@': 114})}, 169: {18: (1, {'@': 130}), 11: (1, {'@': 130}), 13: (1, {'@': 130})}, 170: {82: (1, {'@': 110}), 83: (1, {'@': 110}), 84: (1, {'@': 110}), 18: (1, {'@': 110}), 85: (1, {'@': 110}), 80: (1, {'@': 110}), 81: (1, {'@': 110}), 11: (1, {'@': 110}), 13: (1, {'@': 110})}, 171: {27: (0, 110), 38: (0, 100), 22: (0, 20), 20: (0, 199), 40: (0, 55), 25: (0, 33)}, 172: {113: (1, {'@': 104})}, 173: {1: (1, {'@': 101})}, 174: {21: (0, 139), 22: (0, 140), 23: (0, 152), 26: (0, 21), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 102: (0, 193), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 175: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 50: (0, 77), 24: (0, 205), 51: (0, 211), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 56: (0, 117), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 68: (0, 153), 69: (0, 169), 67: (0, 131), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150)}, 176: {71: (1, {'@': 115})}, 177: {79: (1, {'@': 203}), 42: (1, {'@': 203}), 45: (1, {'@': 203}), 80: (1, {'@': 203}), 81: (1, {'@': 203}), 11: (1, {'@': 203}), 13: (1, {'@': 203}), 82: (1, {'@': 203}), 83: (1, {'@': 203}), 84: (1, {'@': 203}), 18: (1, {'@': 203}), 85: (1, {'@': 203})}, 178: {48: (0, 163), 82: (1, {'@': 105}), 83: (1, {'@': 105}), 84: (1, {'@': 105}), 18: (1, {'@': 105}), 85: (1, {'@': 105}), 80: (1, {'@': 105}), 81: (1, {'@': 105}), 11: (1, {'@': 105}), 13: (1, {'@': 105})}, 179: {45: (0, 185)}, 180: {82: (0, 79)}, 181: {21: (0, 139), 22: (0, 140), 26: (0, 159), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 41: (0, 150)}, 182: {13: (0, 145)}, 183: {0: (1, {'@': 191}), 1: (1, {'@': 191}), 2: (1, {'@': 191}), 3: (1, {'@': 191}), 4: (1, {'@': 191}), 5: (1, {'@': 191}), 6: (1, {'@': 191}), 7: (1, {'@': 191}), 8: (1, {'@': 191}), 9: (1, {'@': 191}), 10: (1, {'@': 191}), 11: (1, {'@': 191}), 12: (1, {'@': 191}), 13: (1, {'@': 191}), 14: (1, {'@': 191}), 15: (1, {'@': 191}), 16: (1, {'@': 191}), 17: (1, {'@': 191}), 18: (1, {'@': 191}), 19: (1, {'@': 191})}, 184: {80: (0, 209)}, 185: {79: (1, {'@': 200}), 42: (1, {'@': 200}), 45: (1, {'@': 200}), 80: (1, {'@': 200}), 81: (1, {'@': 200}), 11: (1, {'@': 200}), 13: (1, {'@': 200}), 82: (1, {'@': 200}), 83: (1, {'@': 200}), 84: (1, {'@': 200}), 18: (1, {'@': 200}), 85: (1, {'@': 200})}, 186: {86: (0, 36)}, 187: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 50: (0, 77), 24: (0, 205), 51: (0, 211), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 56: (0, 203), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 67: (0, 206), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150)}, 188: {82: (1, {'@': 109}), 83: (1, {'@': 109}), 84: (1, {'@': 109}), 18: (1, {'@': 109}), 85: (1, {'@': 109}), 80: (1, {'@': 109}), 11: (1, {'@': 109}), 13: (1, {'@': 109})}, 189: {42: (0, 127), 43: (0, 154), 49: (0, 133), 44: (0, 178), 45: (0, 168), 46: (0, 59), 47: (0, 141), 48: (0, 47)}, 190: {77: (1, {'@': 93})}, 191: {79: (1, {'@': 202}), 42: (1, {'@': 202}), 45: (1, {'@': 202}), 80: (1, {'@': 202}), 81: (1, {'@': 202}), 11: (1, {'@': 202}), 13: (1, {'@': 202}), 82: (1, {'@': 202}), 83: (1, {'@': 202}), 84: (1, {'@': 202}), 18: (1, {'@': 202}), 85: (1, {'@': 202})}, 192: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 78: (0, 82), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 40: (0, 55), 26: (0, 45), 41: (0, 150)}, 193: {18: (1, {'@': 143}), 11: (1, {'@': 143}), 13: (1, {'@': 143})}, 194: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 50: (0, 77), 24: (0, 205), 51: (0, 211), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 56: (0, 96), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 67: (0, 206), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150)}, 195: {18: (1, {'@': 156}), 11: (1, {'@': 156}), 13: (1, {'@': 156})}, 196: {103: (0, 56), 104: (0, 208)}, 197: {42: (0, 127), 43: (0, 154), 44: (0, 178), 45: (0, 168), 49: (0, 188), 46: (0, 59), 47: (0, 141), 48: (0, 47)}, 198: {45: (0, 118)}, 199: {16: (1, {'@': 183}), 5: (1, {'@': 183}), 4: (1, {'@': 183}), 6: (1, {'@': 183}), 9: (1, {'@': 183}), 18: (1, {'@': 183}), 10: (1, {'@': 183}), 19: (1, {'@': 183}), 11: (1, {'@': 183}), 13: (1, {'@': 183}), 14: (1, {'@': 183}), 17: (1, {'@': 183}), 12: (1, {'@': 183}), 15: (1, {'@': 183}), 1: (1, {'@': 183}), 0: (1, {'@': 183}), 2: (1, {'@': 183}), 3: (1, {'@': 183}), 7: (1, {'@': 183}), 8: (1, {'@': 183})}, 200: {21: (0, 139), 22: (0, 140), 5: (0, 104), 23: (0, 152), 50: (0, 77), 24: (0, 205), 51: (0, 211), 67: (0, 54), 25: (0, 33), 52: (0, 196), 53: (0, 115), 27: (0, 110), 54: (0, 108), 55: (0, 138), 28: (0, 149), 29: (0, 181), 30: (0, 27), 56: (0, 117), 31: (0, 112), 57: (0, 43), 58: (0, 62), 59: (0, 111), 32: (0, 72), 33: (0, 94), 34: (0, 114), 60: (0, 116), 61: (0, 119), 20: (0, 199), 62: (0, 189), 35: (0, 171), 63: (0, 65), 64: (0, 63), 65: (0, 192), 66: (0, 132), 36: (0, 87), 68: (0, 153), 69: (0, 169), 26: (0, 17), 70: (0, 74), 71: (0, 66), 37: (0, 123), 72: (0, 14), 39: (0, 29), 38: (0, 100), 73: (0, 6), 74: (0, 24), 75: (0, 44), 40: (0, 55), 76: (0, 176), 41: (0, 150)}, 201: {126: (0, 172)}, 202: {1: (1, {'@': 144}), 18: (1, {'@': 144}), 11: (1, {'@': 144}), 13: (1, {'@': 144})}, 203: {11: (1, {'@': 152}), 13: (1, {'@': 152})}, 204: {20: (0, 26)}, 205: {24: (1, {'@': 98}), 27: (1, {'@': 98}), 29: (1, {'@': 98}), 30: (1, {'@': 98}), 32: (1, {'@': 98}), 35: (1, {'@': 98}), 38: (1, {'@': 98}), 40: (1, {'@': 98}), 25: (1, {'@': 98}), 21: (1, {'@': 98}), 41: (1, {'@': 98}), 20: (1, {'@': 98}), 37: (1, {'@': 98})}, 206: {96: (0, 128), 18: (1, {'@': 125}), 13: (1, {'@': 125})}, 207: {18: (1, {'@': 139}), 11: (1, {'@': 139}), 13: (1, {'@': 139})}, 208: {1: (0, 194)}, 209: {21: (0, 139), 22: (0, 140), 23: (0, 152), 24: (0, 205), 25: (0, 33), 27: (0, 110), 28: (0, 149), 29: (0, 181), 30: (0, 27), 31: (0, 112), 32: (0, 72), 33: (0, 94), 34: (0, 114), 20: (0, 199), 35: (0, 171), 36: (0, 87), 37: (0, 123), 38: (0, 100), 39: (0, 29), 26: (0, 183), 40: (0, 55), 41: (0, 150)}, 210: {18: (1, {'@': 157}), 11: (1, {'@': 157}), 13: (1, {'@': 157})}, 211: {127: (0, 101), 128: (0, 157), 129: (0, 25), 130: (0, 136)}}, 'start_states': {'start': 90}, 'end_states': {'start': 144}}, '__type__': 'ParsingFrontend'}, 'rules': [{'@': 93}, {'@': 94}, {'@': 95}, {'@': 96}, {'@': 97}, {'@': 98}, {'@': 99}, {'@': 100}, {'@': 101}, {'@': 102}, {'@': 103}, {'@': 104}, {'@': 105}, {'@': 106}, {'@': 107}, {'@': 108}, {'@': 109}, {'@': 110}, {'@': 111}, {'@': 112}, {'@': 113}, {'@': 114}, {'@': 115}, {'@': 116}, {'@': 117}, {'@': 118}, {'@': 119}, {'@': 120}, {'@': 121}, {'@': 122}, {'@': 123}, {'@': 124}, {'@': 125}, {'@': 126}, {'@': 127}, {'@': 128}, {'@': 129}, {'@': 130}, {'@': 131}, {'@': 132}, {'@': 133}, {'@': 134}, {'@': 135}, {'@': 136}, {'@': 137}, {'@': 138}, {'@': 139}, {'@': 140}, {'@': 141}, {'@': 142}, {'@': 143}, {'@': 144}, {'@': 145}, {'@': 146}, {'@': 147}, {'@': 148}, {'@': 149}, {'@': 150}, {'@': 151}, {'@': 152}, {'@': 153}, {'@': 154}, {'@': 155}, {'@': 156}, {'@': 157}, {'@': 158}, {'@': 159}, {'@': 160}, {'@': 161}, {'@': 162}, {'@': 163}, {'@': 164}, {'@': 165}, {'@': 166}, {'@': 167}, {'@': 168}, {'@': 169}, {'@': 170}, {'@': 171}, {'@': 172}, {'@': 173}, {'@': 174}, {'@': 175}, {'@': 176}, {'@': 177}, {'@': 178}, {'@': 179}, {'@': 180}, {'@': 181}, {'@': 182}, {'@': 183}, {'@': 184}, {'@': 185}, {'@': 186}, {'@': 187}, {'@': 188}, {'@': 189}, {'@': 190}, {'@': 191}, {'@': 192}, {'@': 193}, {'@': 194}, {'@': 195}, {'@': 196}, {'@': 197}, {'@': 198}, {'@': 199}, {'@': 200}, {'@': 201}, {'@': 202}, {'@': 203}, {'@': 204}, {'@': 205}, {'@': 206}, {'@': 207}], 'options': {'debug': False, 'strict': False, 'keep_all_tokens': False, 'tree_class': None, 'cache': False, 'cache_grammar': False, 'postlex': None, 'parser': 'lalr', 'lexer': 'contextual', 'transformer': None, 'start': ['start'], 'priority': 'normal', 'ambiguity': 'auto', 'regex': False, 'propagate_positions': False, 'lexer_callbacks': {}, 'maybe_placeholders': True, 'edit_terminals': None, 'g_regex_flags': 0, 'use_bytes': False, 'ordered_sets': True, 'import_paths': [], 'source_path': None, '_plugins': {}}, '__type__': 'Lark'}
+)
+MEMO = (
+{0: {'name': 'DIGIT', 'pattern': {'value': '[0-9]', 'flags': [], 'raw': None, '_width': [1, 1], '__type__': 'PatternRE'}, 'priority': 0, '__type__': 'TerminalDef'}, 1: {'name': 'WS', 'pattern': {'value': '(?:[ \t\x0c\r\n])+', 'flags': [], 'raw': None, '_width': [1, 18446744073709551616], '__type__': 'PatternRE'}, 'priority': 0, '__type__': 'TerminalDef'}, 2: {'name': 'DOT', 'pattern': {'value': '.', 'flags': [], 'raw': '"."', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 3: {'name': 'COMMA', 'pattern': {'value': ',', 'flags': [], 'raw': '","', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 4: {'name': 'WORDNUM', 'pattern': {'value': '(zero|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|thirteen|fourteen|fifteen|sixteen|seventeen|eighteen|nineteen|twenty|thirty|forty|fifty|sixty|seventy|eighty|ninety|hundred|thousand|million|billion|trillion)', 'flags': [], 'raw': '/(zero|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|thirteen|fourteen|fifteen|sixteen|seventeen|eighteen|nineteen|twenty|thirty|forty|fifty|sixty|seventy|eighty|ninety|hundred|thousand|million|billion|trillion)/', '_width': [3, 9], '__type__': 'PatternRE'}, 'priority': 0, '__type__': 'TerminalDef'}, 5: {'name': 'LEXICON_MODEL_KEYWORD', 'pattern': {'value': '(?:character|infantry|monsters|neurogaunt|psyker|synapse|t(?:ermagants|itanic|yranids))(?![a-z0-9])', 'flags': [], 'raw': '/(?:character|infantry|monsters|neurogaunt|psyker|synapse|t(?:ermagants|itanic|yranids))(?![a-z0-9])/', '_width': [6, 10], '__type__': 'PatternRE'}, 'priority': 0, '__type__': 'TerminalDef'}, 6: {'name': 'LEADERSHIP', 'pattern': {'value': 'leadership', 'flags': [], 'raw': '"leadership"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 7: {'name': 'PLUS', 'pattern': {'value': '+', 'flags': [], 'raw': '"+"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 8: {'name': 'MINUS', 'pattern': {'value': '-', 'flags': [], 'raw': '"-"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 9: {'name': 'HIT', 'pattern': {'value': 'hit', 'flags': [], 'raw': '"hit"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 10: {'name': 'WOUND', 'pattern': {'value': 'wound', 'flags': [], 'raw': '"wound"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 11: {'name': 'ADVANCE', 'pattern': {'value': 'advance', 'flags': [], 'raw': '"advance"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 12: {'name': 'CHARGE', 'pattern': {'value': 'charge', 'flags': [], 'raw': '"charge"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 13: {'name': '__ANON_0', 'pattern': {'value': 'fight phase', 'flags': [], 'raw': '"fight phase"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 14: {'name': '__ANON_1', 'pattern': {'value': 'movement phase', 'flags': [], 'raw': '"movement phase"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 15: {'name': '__ANON_2', 'pattern': {'value': 'shooting phase', 'flags': [], 'raw': '"shooting phase"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 16: {'name': 'COMMAND', 'pattern': {'value': 'command', 'flags': [], 'raw': '"command"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 17: {'name': 'PHASE', 'pattern': {'value': 'phase', 'flags': [], 'raw': '"phase"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 18: {'name': '__ANON_3', 'pattern': {'value': 'battle-shock', 'flags': [], 'raw': '"battle-shock"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 19: {'name': 'STEP', 'pattern': {'value': 'step', 'flags': [], 'raw': '"step"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 20: {'name': 'D', 'pattern': {'value': 'd', 'flags': [], 'raw': '"d"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 21: {'name': '__ANON_4', 'pattern': {'value': 'the result', 'flags': [], 'raw': '"the result"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 22: {'name': 'AND', 'pattern': {'value': 'and', 'flags': [], 'raw': '"and"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 23: {'name': 'RANGED', 'pattern': {'value': 'ranged', 'flags': [], 'raw': '"ranged"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 24: {'name': 'MELEE', 'pattern': {'value': 'melee', 'flags': [], 'raw': '"melee"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 25: {'name': '__ANON_6', 'pattern': {'value': '[devastating', 'flags': [], 'raw': '"[devastating"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 26: {'name': '__ANON_7', 'pattern': {'value': 'wounds]', 'flags': [], 'raw': '"wounds]"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 27: {'name': '__ANON_8', 'pattern': {'value': '[lethal', 'flags': [], 'raw': '"[lethal"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 28: {'name': '__ANON_9', 'pattern': {'value': 'hits]', 'flags': [], 'raw': '"hits]"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 29: {'name': '__ANON_10', 'pattern': {'value': '[assault]', 'flags': [], 'raw': '"[assault]"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 30: {'name': '__ANON_11', 'pattern': {'value': '[sustained hits', 'flags': [], 'raw': '"[sustained hits"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 31: {'name': 'RSQB', 'pattern': {'value': ']', 'flags': [], 'raw': '"]"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 32: {'name': '__ANON_13', 'pattern': {'value': 'once per', 'flags': [], 'raw': '"once per"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 33: {'name': '__ANON_14', 'pattern': {'value': 'battle round', 'flags': [], 'raw': '"battle round"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 34: {'name': 'TURN', 'pattern': {'value': 'turn', 'flags': [], 'raw': '"turn"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 35: {'name': 'BATTLE', 'pattern': {'value': 'battle', 'flags': [], 'raw': '"battle"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 36: {'name': '__ANON_15', 'pattern': {'value': 'in addition,', 'flags': [], 'raw': '"in addition,"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 37: {'name': 'UNTIL', 'pattern': {'value': 'until', 'flags': [], 'raw': '"until"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 38: {'name': '__ANON_16', 'pattern': {'value': 'select one', 'flags': [], 'raw': '"select one"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 39: {'name': 'AT', 'pattern': {'value': 'at', 'flags': [], 'raw': '"at"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 40: {'name': '__ANON_17', 'pattern': {'value': 'each time', 'flags': [], 'raw': '"each time"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 41: {'name': 'IN', 'pattern': {'value': 'in', 'flags': [], 'raw': '"in"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 42: {'name': 'WHEN', 'pattern': {'value': 'when', 'flags': [], 'raw': '"when"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 43: {'name': '__ANON_18', 'pattern': {'value': 'makes an attack', 'flags': [], 'raw': '"makes an attack"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 44: {'name': 'DESTROYS', 'pattern': {'value': 'destroys', 'flags': [], 'raw': '"destroys"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 45: {'name': '__ANON_19', 'pattern': {'value': 'is targeted with', 'flags': [], 'raw': '"is targeted with"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 46: {'name': 'THE', 'pattern': {'value': 'the', 'flags': [], 'raw': '"the"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 47: {'name': '__ANON_20', 'pattern': {'value': 'of any phase', 'flags': [], 'raw': '"of any phase"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 48: {'name': '__ANON_21', 'pattern': {'value': "of your opponent's", 'flags': [], 'raw': '"of your opponent\'s"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 49: {'name': '__ANON_22', 'pattern': {'value': 'of the', 'flags': [], 'raw': '"of the"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 50: {'name': 'START', 'pattern': {'value': 'start', 'flags': [], 'raw': '"start"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 51: {'name': 'END', 'pattern': {'value': 'end', 'flags': [], 'raw': '"end"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 52: {'name': 'WHILE', 'pattern': {'value': 'while', 'flags': [], 'raw': '"while"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 53: {'name': 'IF', 'pattern': {'value': 'if', 'flags': [], 'raw': '"if"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 54: {'name': '__ANON_23', 'pattern': {'value': 'if it does,', 'flags': [], 'raw': '"if it does,"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 55: {'name': 'SUBTRACT', 'pattern': {'value': 'subtract', 'flags': [], 'raw': '"subtract"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 56: {'name': '__ANON_24', 'pattern': {'value': 'from the', 'flags': [], 'raw': '"from the"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 57: {'name': 'ROLL', 'pattern': {'value': 'roll', 'flags': [], 'raw': '"roll"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 58: {'name': '__ANON_25', 'pattern': {'value': 'you gain', 'flags': [], 'raw': '"you gain"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 59: {'name': 'CP', 'pattern': {'value': 'cp', 'flags': [], 'raw': '"cp"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 60: {'name': '__ANON_26', 'pattern': {'value': 'worsen the', 'flags': [], 'raw': '"worsen the"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 61: {'name': '__ANON_27', 'pattern': {'value': 'characteristic of', 'flags': [], 'raw': '"characteristic of"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 62: {'name': 'BY', 'pattern': {'value': 'by', 'flags': [], 'raw': '"by"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 63: {'name': '__ANON_28', 'pattern': {'value': 'must take a battle-shock test', 'flags': [], 'raw': '"must take a battle-shock test"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 64: {'name': '__ANON_29', 'pattern': {'value': 'reduce the cp cost of that usage of that stratagem by', 'flags': [], 'raw': '"reduce the cp cost of that usage of that stratagem by"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 65: {'name': '__ANON_30', 'pattern': {'value': 'can use', 'flags': [], 'raw': '"can use"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 66: {'name': 'HAS', 'pattern': {'value': 'has', 'flags': [], 'raw': '"has"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 67: {'name': 'A', 'pattern': {'value': 'a', 'flags': [], 'raw': '"a"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 68: {'name': '__ANON_31', 'pattern': {'value': '+ invulnerable save', 'flags': [], 'raw': '"+ invulnerable save"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 69: {'name': '__ANON_32', 'pattern': {'value': 'weapons equipped by', 'flags': [], 'raw': '"weapons equipped by"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 70: {'name': '__ANON_33', 'pattern': {'value': 'have the', 'flags': [], 'raw': '"have the"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 71: {'name': 'ABILITY', 'pattern': {'value': 'ability', 'flags': [], 'raw': '"ability"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 72: {'name': 'IS', 'pattern': {'value': 'is', 'flags': [], 'raw': '"is"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 73: {'name': 'AN', 'pattern': {'value': 'an', 'flags': [], 'raw': '"an"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 74: {'name': 'ONE', 'pattern': {'value': 'one', 'flags': [], 'raw': '"one"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 75: {'name': 'THIS', 'pattern': {'value': 'this', 'flags': [], 'raw': '"this"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 76: {'name': 'THAT', 'pattern': {'value': 'that', 'flags': [], 'raw': '"that"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 77: {'name': 'SUCH', 'pattern': {'value': 'such', 'flags': [], 'raw': '"such"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 78: {'name': 'IT', 'pattern': {'value': 'it', 'flags': [], 'raw': '"it"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 79: {'name': 'UNIT', 'pattern': {'value': 'unit', 'flags': [], 'raw': '"unit"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 80: {'name': 'MODEL', 'pattern': {'value': 'model', 'flags': [], 'raw': '"model"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 81: {'name': 'MODELS', 'pattern': {'value': 'models', 'flags': [], 'raw': '"models"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 82: {'name': 'STRATAGEM', 'pattern': {'value': 'stratagem', 'flags': [], 'raw': '"stratagem"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 83: {'name': 'ENEMY', 'pattern': {'value': 'enemy', 'flags': [], 'raw': '"enemy"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 84: {'name': 'ALLIED', 'pattern': {'value': 'allied', 'flags': [], 'raw': '"allied"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 85: {'name': 'FRIENDLY', 'pattern': {'value': 'friendly', 'flags': [], 'raw': '"friendly"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 86: {'name': '__ANON_34', 'pattern': {'value': 'from your army', 'flags': [], 'raw': '"from your army"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 87: {'name': '__ANON_35', 'pattern': {'value': 'with this ability', 'flags': [], 'raw': '"with this ability"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 88: {'name': 'WITHIN', 'pattern': {'value': 'within', 'flags': [], 'raw': '"within"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 89: {'name': '__ANON_36', 'pattern': {'value': '" of', 'flags': [], 'raw': '"\\" of"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 90: {'name': 'LEADING', 'pattern': {'value': 'leading', 'flags': [], 'raw': '"leading"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 91: {'name': '__ANON_37', 'pattern': {'value': 'below its starting strength', 'flags': [], 'raw': '"below its starting strength"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 92: {'name': '__ANON_38', 'pattern': {'value': 'within engagement range of', 'flags': [], 'raw': '"within engagement range of"', '__type__': 'PatternStr'}, 'priority': 0, '__type__': 'TerminalDef'}, 93: {'origin': {'name': 'characteristic', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'LEADERSHIP', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'leadership', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 94: {'origin': {'name': 'roll_kind', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'HIT', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'hit_roll', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 95: {'origin': {'name': 'roll_kind', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'WOUND', 'filter_out': True, '__type__': 'Terminal'}], 'order': 1, 'alias': 'wound_roll', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 96: {'origin': {'name': 'roll_kind', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'ADVANCE', 'filter_out': True, '__type__': 'Terminal'}], 'order': 2, 'alias': 'advance_roll', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 97: {'origin': {'name': 'roll_kind', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'CHARGE', 'filter_out': True, '__type__': 'Terminal'}], 'order': 3, 'alias': 'charge_roll', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 98: {'origin': {'name': 'model_keyword', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'LEXICON_MODEL_KEYWORD', 'filter_out': False, '__type__': 'Terminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 99: {'origin': {'name': 'phase_instant', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_0', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'fighting_phase', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 100: {'origin': {'name': 'phase_instant', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_1', 'filter_out': True, '__type__': 'Terminal'}], 'order': 1, 'alias': 'movement_phase', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 101: {'origin': {'name': 'phase_instant', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_2', 'filter_out': True, '__type__': 'Terminal'}], 'order': 2, 'alias': 'shooting_phase', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 102: {'origin': {'name': 'phase_instant', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'COMMAND', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'PHASE', 'filter_out': True, '__type__': 'Terminal'}], 'order': 3, 'alias': 'command_phase', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 103: {'origin': {'name': 'phase_instant', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'PHASE', 'filter_out': True, '__type__': 'Terminal'}], 'order': 4, 'alias': 'current_phase', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 104: {'origin': {'name': 'step_instant', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_3', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'STEP', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'battle_shock_step', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 105: {'origin': {'name': 'raw_number', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__raw_number_plus_0', '__type__': 'NonTerminal'}], 'order': 0, 'alias': 'number', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 106: {'origin': {'name': 'quantity', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'raw_number', '__type__': 'NonTerminal'}], 'order': 0, 'alias': 'raw_number_outer', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 107: {'origin': {'name': 'quantity', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'word_quantity', '__type__': 'NonTerminal'}], 'order': 1, 'alias': 'word_number', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 108: {'origin': {'name': 'quantity', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'word_quantity', '__type__': 'NonTerminal'}, {'name': 'D', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}, {'name': 'PLUS', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}], 'order': 2, 'alias': 'dice_value', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 109: {'origin': {'name': 'quantity', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'word_quantity', '__type__': 'NonTerminal'}, {'name': 'D', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}], 'order': 3, 'alias': 'dice_value', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (False, False, False, True), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 110: {'origin': {'name': 'quantity', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'D', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}, {'name': 'PLUS', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}], 'order': 4, 'alias': 'dice_value', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (True, False, False, False, False), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 111: {'origin': {'name': 'quantity', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'D', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}], 'order': 5, 'alias': 'dice_value', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (True, False, False, True), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 112: {'origin': {'name': 'quantity', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_4', 'filter_out': True, '__type__': 'Terminal'}], 'order': 6, 'alias': 'dice_result', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 113: {'origin': {'name': 'word_quantity', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'WORDNUM', 'filter_out': False, '__type__': 'Terminal'}, {'name': '__word_quantity_star_1', '__type__': 'NonTerminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 114: {'origin': {'name': 'word_quantity', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'WORDNUM', 'filter_out': False, '__type__': 'Terminal'}], 'order': 1, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 115: {'origin': {'name': 'weapon_qualifier', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'RANGED', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'ranged_weapon', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 116: {'origin': {'name': 'weapon_qualifier', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'MELEE', 'filter_out': True, '__type__': 'Terminal'}], 'order': 1, 'alias': 'melee_weapon', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 117: {'origin': {'name': 'weapon_ability', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_6', 'filter_out': True, '__type__': 'Terminal'}, {'name': '__ANON_7', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'devastating_wounds', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 118: {'origin': {'name': 'weapon_ability', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_8', 'filter_out': True, '__type__': 'Terminal'}, {'name': '__ANON_9', 'filter_out': True, '__type__': 'Terminal'}], 'order': 1, 'alias': 'letal_hits', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 119: {'origin': {'name': 'weapon_ability', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_10', 'filter_out': True, '__type__': 'Terminal'}], 'order': 2, 'alias': 'assault', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 120: {'origin': {'name': 'weapon_ability', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_11', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}, {'name': 'RSQB', 'filter_out': True, '__type__': 'Terminal'}], 'order': 3, 'alias': 'sustained_hits', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 121: {'origin': {'name': 'start', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'effect_seq', '__type__': 'NonTerminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 122: {'origin': {'name': 'effect_seq', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'effect', '__type__': 'NonTerminal'}, {'name': '__effect_seq_star_2', '__type__': 'NonTerminal'}, {'name': 'DOT', 'filter_out': False, '__type__': 'Terminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 123: {'origin': {'name': 'effect_seq', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'effect', '__type__': 'NonTerminal'}, {'name': 'DOT', 'filter_out': False, '__type__': 'Terminal'}], 'order': 1, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 124: {'origin': {'name': 'effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'single_effect', '__type__': 'NonTerminal'}, {'name': '__effect_star_3', '__type__': 'NonTerminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 125: {'origin': {'name': 'effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'single_effect', '__type__': 'NonTerminal'}], 'order': 1, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 126: {'origin': {'name': 'single_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'conditional_effect', '__type__': 'NonTerminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 127: {'origin': {'name': 'single_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'timed_effect', '__type__': 'NonTerminal'}], 'order': 1, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 128: {'origin': {'name': 'single_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'additional_effect', '__type__': 'NonTerminal'}], 'order': 2, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 129: {'origin': {'name': 'single_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'temporary_effect', '__type__': 'NonTerminal'}], 'order': 3, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 130: {'origin': {'name': 'single_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'imperative_rule', '__type__': 'NonTerminal'}], 'order': 4, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 131: {'origin': {'name': 'single_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'select_effect', '__type__': 'NonTerminal'}], 'order': 5, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 132: {'origin': {'name': 'single_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'modified_effect', '__type__': 'NonTerminal'}], 'order': 6, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 133: {'origin': {'name': 'modified_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_13', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'use_limit', '__type__': 'NonTerminal'}, {'name': 'COMMA', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'single_effect', '__type__': 'NonTerminal'}], 'order': 0, 'alias': 'once_per_effect', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 134: {'origin': {'name': 'use_limit', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_14', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'battle_round_limit', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 135: {'origin': {'name': 'use_limit', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'TURN', 'filter_out': True, '__type__': 'Terminal'}], 'order': 1, 'alias': 'turn_limit', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 136: {'origin': {'name': 'use_limit', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'BATTLE', 'filter_out': True, '__type__': 'Terminal'}], 'order': 2, 'alias': 'battle_limit', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 137: {'origin': {'name': 'additional_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_15', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'effect', '__type__': 'NonTerminal'}], 'order': 0, 'alias': 'additional_effect', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 138: {'origin': {'name': 'temporary_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'UNTIL', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'time_condition', '__type__': 'NonTerminal'}, {'name': 'COMMA', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'effect', '__type__': 'NonTerminal'}], 'order': 0, 'alias': 'until_effect', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 139: {'origin': {'name': 'select_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_16', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}], 'order': 0, 'alias': 'select_subject', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 140: {'origin': {'name': 'timed_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'AT', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'time_condition', '__type__': 'NonTerminal'}, {'name': 'COMMA', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'effect', '__type__': 'NonTerminal'}], 'order': 0, 'alias': 'at_event', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 141: {'origin': {'name': 'timed_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_17', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'event', '__type__': 'NonTerminal'}, {'name': 'COMMA', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'effect', '__type__': 'NonTerminal'}], 'order': 1, 'alias': 'each_time', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 142: {'origin': {'name': 'timed_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'IN', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'time_condition', '__type__': 'NonTerminal'}, {'name': 'COMMA', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'effect', '__type__': 'NonTerminal'}], 'order': 2, 'alias': 'at_event', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 143: {'origin': {'name': 'timed_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'effect', '__type__': 'NonTerminal'}, {'name': 'WHEN', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'event', '__type__': 'NonTerminal'}], 'order': 3, 'alias': 'trailing_when_effect', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 144: {'origin': {'name': 'event', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'subject', '__type__': 'NonTerminal'}, {'name': '__ANON_18', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'makes_an_attack', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 145: {'origin': {'name': 'event', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'subject', '__type__': 'NonTerminal'}, {'name': 'DESTROYS', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}], 'order': 1, 'alias': 'destroys', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 146: {'origin': {'name': 'event', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'subject', '__type__': 'NonTerminal'}, {'name': '__ANON_19', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}], 'order': 2, 'alias': 'is_targeted_with', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 147: {'origin': {'name': 'time_condition', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'THE', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'time_qualifier', '__type__': 'NonTerminal'}, {'name': '__ANON_22', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'phase_instant', '__type__': 'NonTerminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 148: {'origin': {'name': 'time_condition', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'THE', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'time_qualifier', '__type__': 'NonTerminal'}, {'name': '__ANON_20', 'filter_out': True, '__type__': 'Terminal'}], 'order': 1, 'alias': 'any_phase_instant', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 149: {'origin': {'name': 'time_condition', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'THE', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'step_instant', '__type__': 'NonTerminal'}, {'name': '__ANON_21', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'phase_instant', '__type__': 'NonTerminal'}], 'order': 2, 'alias': 'oppo_step_condition', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 150: {'origin': {'name': 'time_qualifier', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'START', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'time_start', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 151: {'origin': {'name': 'time_qualifier', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'END', 'filter_out': True, '__type__': 'Terminal'}], 'order': 1, 'alias': 'time_end', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 152: {'origin': {'name': 'conditional_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'WHILE', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'boolean_expression', '__type__': 'NonTerminal'}, {'name': 'COMMA', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'effect', '__type__': 'NonTerminal'}], 'order': 0, 'alias': 'while_true_effect', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 153: {'origin': {'name': 'conditional_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'IF', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'boolean_expression', '__type__': 'NonTerminal'}, {'name': 'COMMA', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'effect', '__type__': 'NonTerminal'}], 'order': 1, 'alias': 'if_effect', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 154: {'origin': {'name': 'conditional_effect', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_23', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'effect', '__type__': 'NonTerminal'}], 'order': 2, 'alias': 'if_it_does', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 155: {'origin': {'name': 'imperative_rule', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'SUBTRACT', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}, {'name': '__ANON_24', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'roll_kind', '__type__': 'NonTerminal'}, {'name': 'ROLL', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'subtract_effect', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 156: {'origin': {'name': 'imperative_rule', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_25', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}, {'name': 'CP', 'filter_out': True, '__type__': 'Terminal'}], 'order': 1, 'alias': 'gain_cps', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 157: {'origin': {'name': 'imperative_rule', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_26', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'characteristic', '__type__': 'NonTerminal'}, {'name': '__ANON_27', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}, {'name': 'BY', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}], 'order': 2, 'alias': 'worsen_characteristic', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 158: {'origin': {'name': 'imperative_rule', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'subject', '__type__': 'NonTerminal'}, {'name': '__ANON_28', 'filter_out': True, '__type__': 'Terminal'}], 'order': 3, 'alias': 'generate_battle_shock_test', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 159: {'origin': {'name': 'imperative_rule', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_29', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}, {'name': 'CP', 'filter_out': True, '__type__': 'Terminal'}], 'order': 4, 'alias': 'reduce_cp_cost', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 160: {'origin': {'name': 'imperative_rule', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'subject', '__type__': 'NonTerminal'}, {'name': '__ANON_30', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}], 'order': 5, 'alias': 'can_use', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 161: {'origin': {'name': 'imperative_rule', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'obtainable_property', '__type__': 'NonTerminal'}], 'order': 6, 'alias': 'subject_obtains_property', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 162: {'origin': {'name': 'obtainable_property', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'subject', '__type__': 'NonTerminal'}, {'name': 'HAS', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'A', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}, {'name': '__ANON_31', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'obtains_invulnerable_save', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 163: {'origin': {'name': 'obtainable_property', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'weapon_qualifier', '__type__': 'NonTerminal'}, {'name': '__ANON_32', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}, {'name': '__ANON_33', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'weapon_ability', '__type__': 'NonTerminal'}, {'name': 'ABILITY', 'filter_out': True, '__type__': 'Terminal'}], 'order': 1, 'alias': 'obtain_weapon_ability', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 164: {'origin': {'name': 'obtainable_property', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_32', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}, {'name': '__ANON_33', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'weapon_ability', '__type__': 'NonTerminal'}, {'name': 'ABILITY', 'filter_out': True, '__type__': 'Terminal'}], 'order': 2, 'alias': 'obtain_weapon_ability', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (True, False, False, False, False, False), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 165: {'origin': {'name': 'boolean_expression', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'subject', '__type__': 'NonTerminal'}, {'name': 'IS', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'is_constraint', '__type__': 'NonTerminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 166: {'origin': {'name': 'subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'constrained_subject', '__type__': 'NonTerminal'}], 'order': 0, 'alias': 'list_of_subjects', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 167: {'origin': {'name': 'subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'A', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'constrained_subject', '__type__': 'NonTerminal'}], 'order': 1, 'alias': 'singular_subject', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 168: {'origin': {'name': 'subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'AN', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'constrained_subject', '__type__': 'NonTerminal'}], 'order': 2, 'alias': 'singular_subject', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 169: {'origin': {'name': 'subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'ONE', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'constrained_subject', '__type__': 'NonTerminal'}], 'order': 3, 'alias': 'singular_subject', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 170: {'origin': {'name': 'constrained_subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'constrained_subject', '__type__': 'NonTerminal'}, {'name': 'constraint', '__type__': 'NonTerminal'}], 'order': 0, 'alias': 'constrained_subject_with_constraint', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 171: {'origin': {'name': 'constrained_subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'forward_constraint', '__type__': 'NonTerminal'}, {'name': 'constrained_subject', '__type__': 'NonTerminal'}], 'order': 1, 'alias': 'forward_constrained_subject', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 172: {'origin': {'name': 'constrained_subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'THIS', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject_type', '__type__': 'NonTerminal'}], 'order': 2, 'alias': 'this_model', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 173: {'origin': {'name': 'constrained_subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'base_subject', '__type__': 'NonTerminal'}], 'order': 3, 'alias': 'base_subject', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 174: {'origin': {'name': 'base_subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'subject_type', '__type__': 'NonTerminal'}], 'order': 0, 'alias': 'any', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 175: {'origin': {'name': 'base_subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'THAT', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject_type', '__type__': 'NonTerminal'}], 'order': 1, 'alias': 'such_subject_type', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 176: {'origin': {'name': 'base_subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'SUCH', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}], 'order': 2, 'alias': 'such_subject', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 177: {'origin': {'name': 'base_subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'subject_type', '__type__': 'NonTerminal'}, {'name': 'IN', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}], 'order': 3, 'alias': 'in_subject', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 178: {'origin': {'name': 'base_subject', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'IT', 'filter_out': True, '__type__': 'Terminal'}], 'order': 4, 'alias': 'it_subject', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 179: {'origin': {'name': 'subject_type', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'UNIT', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'unit', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 180: {'origin': {'name': 'subject_type', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'MODEL', 'filter_out': True, '__type__': 'Terminal'}], 'order': 1, 'alias': 'model', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 181: {'origin': {'name': 'subject_type', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'MODELS', 'filter_out': True, '__type__': 'Terminal'}], 'order': 2, 'alias': 'model', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 182: {'origin': {'name': 'subject_type', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'STRATAGEM', 'filter_out': True, '__type__': 'Terminal'}], 'order': 3, 'alias': 'stratagem_subject_type', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 183: {'origin': {'name': 'subject_type', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'ABILITY', 'filter_out': True, '__type__': 'Terminal'}], 'order': 4, 'alias': 'ability_subject', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 184: {'origin': {'name': 'forward_constraint', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'ENEMY', 'filter_out': True, '__type__': 'Terminal'}], 'order': 0, 'alias': 'enemy', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 185: {'origin': {'name': 'forward_constraint', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'ALLIED', 'filter_out': True, '__type__': 'Terminal'}], 'order': 1, 'alias': 'allied', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 186: {'origin': {'name': 'forward_constraint', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'FRIENDLY', 'filter_out': True, '__type__': 'Terminal'}], 'order': 2, 'alias': 'allied', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 187: {'origin': {'name': 'forward_constraint', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'model_keyword', '__type__': 'NonTerminal'}], 'order': 3, 'alias': 'keyworded_constraint', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 188: {'origin': {'name': 'constraint', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'is_constraint', '__type__': 'NonTerminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 189: {'origin': {'name': 'constraint', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_34', 'filter_out': True, '__type__': 'Terminal'}], 'order': 1, 'alias': 'from_your_army', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 190: {'origin': {'name': 'constraint', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_35', 'filter_out': True, '__type__': 'Terminal'}], 'order': 2, 'alias': 'with_this_ability', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 191: {'origin': {'name': 'is_constraint', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'WITHIN', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'quantity', '__type__': 'NonTerminal'}, {'name': '__ANON_36', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}], 'order': 0, 'alias': 'within_constraint', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 192: {'origin': {'name': 'is_constraint', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'LEADING', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}], 'order': 1, 'alias': 'leading_constraint', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 193: {'origin': {'name': 'is_constraint', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_37', 'filter_out': True, '__type__': 'Terminal'}], 'order': 2, 'alias': 'below_its_starting_strenght', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 194: {'origin': {'name': 'is_constraint', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__ANON_38', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}], 'order': 3, 'alias': 'within_engagement_range', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 195: {'origin': {'name': 'is_constraint', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'IN', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'subject', '__type__': 'NonTerminal'}], 'order': 4, 'alias': 'subject_in_subject', 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 196: {'origin': {'name': '__raw_number_plus_0', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'DIGIT', 'filter_out': False, '__type__': 'Terminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 197: {'origin': {'name': '__raw_number_plus_0', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__raw_number_plus_0', '__type__': 'NonTerminal'}, {'name': 'DIGIT', 'filter_out': False, '__type__': 'Terminal'}], 'order': 1, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 198: {'origin': {'name': '__word_quantity_star_1', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'MINUS', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'WORDNUM', 'filter_out': False, '__type__': 'Terminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 199: {'origin': {'name': '__word_quantity_star_1', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'WORDNUM', 'filter_out': False, '__type__': 'Terminal'}], 'order': 1, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 200: {'origin': {'name': '__word_quantity_star_1', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'AND', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'WORDNUM', 'filter_out': False, '__type__': 'Terminal'}], 'order': 2, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 201: {'origin': {'name': '__word_quantity_star_1', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__word_quantity_star_1', '__type__': 'NonTerminal'}, {'name': 'MINUS', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'WORDNUM', 'filter_out': False, '__type__': 'Terminal'}], 'order': 3, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 202: {'origin': {'name': '__word_quantity_star_1', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__word_quantity_star_1', '__type__': 'NonTerminal'}, {'name': 'WORDNUM', 'filter_out': False, '__type__': 'Terminal'}], 'order': 4, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 203: {'origin': {'name': '__word_quantity_star_1', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__word_quantity_star_1', '__type__': 'NonTerminal'}, {'name': 'AND', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'WORDNUM', 'filter_out': False, '__type__': 'Terminal'}], 'order': 5, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 204: {'origin': {'name': '__effect_seq_star_2', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'DOT', 'filter_out': False, '__type__': 'Terminal'}, {'name': 'effect', '__type__': 'NonTerminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 205: {'origin': {'name': '__effect_seq_star_2', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__effect_seq_star_2', '__type__': 'NonTerminal'}, {'name': 'DOT', 'filter_out': False, '__type__': 'Terminal'}, {'name': 'effect', '__type__': 'NonTerminal'}], 'order': 1, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 206: {'origin': {'name': '__effect_star_3', '__type__': 'NonTerminal'}, 'expansion': [{'name': 'AND', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'single_effect', '__type__': 'NonTerminal'}], 'order': 0, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}, 207: {'origin': {'name': '__effect_star_3', '__type__': 'NonTerminal'}, 'expansion': [{'name': '__effect_star_3', '__type__': 'NonTerminal'}, {'name': 'AND', 'filter_out': True, '__type__': 'Terminal'}, {'name': 'single_effect', '__type__': 'NonTerminal'}], 'order': 1, 'alias': None, 'options': {'keep_all_tokens': False, 'expand1': False, 'priority': None, 'template_source': None, 'empty_indices': (), '__type__': 'RuleOptions'}, '__type__': 'Rule'}}
+)
+Shift = 0
+Reduce = 1
+def Lark_StandAlone(**kwargs):
+  return Lark._load_from_dict(DATA, MEMO, **kwargs)
@@ -0,0 +1,346 @@
+from lark import Lark, Tree, UnexpectedInput
+from lark.common import ParserConf
+from lark.load_grammar import load_grammar
+from lark.parsers.lalr_analysis import LALR_Analyzer, ParseTable, IntParseTable, Shift, Reduce
+from lark.parsers.lalr_parser import LALR_Parser, _Parser
+from .budget import meter_earley_parser
+from .disambiguate import rank_ambiguities
+from .lexicon import get_lexicon, lexicon_path_for
+import lark
+import hashlib
+import importlib
+import io
+import os
+import pickle
+import re
+import sys
+import tempfile
+import types
+
+GRAMMAR_PATH = "./40k.lark"
+# bump when the layout of the pickled parsers changes, to invalidate existing caches
+PARSER_CACHE_VERSION = 3
+
+def cache_dir():
+    path = os.environ.get("RULE_PARSER_CACHE_DIR")
+    if path is None:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+        path = os.path.join(base, "rule_parser")
+    return path
+
+def grammar_digest(grammar: str, **options):
+    options_str = "".join(f"{key}={value};" for key, value in sorted(options.items()))
+    content = grammar + options_str + lark.__version__ + str(sys.version_info[:2]) + str(PARSER_CACHE_VERSION)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+# lark keeps a reference to the re module inside the lexer configuration, which pickle refuses
+# to serialize, and compares LALR actions by identity, so both are stored by name and looked up
+# again when the parser is loaded.
+LALR_ACTIONS = {Shift.name: Shift, Reduce.name: Reduce}
+
+class _ParserPickler(pickle.Pickler):
+    def persistent_id(self, obj):
+        if isinstance(obj, types.ModuleType):
+            return ("module", obj.__name__)
+        if obj is Shift or obj is Reduce:
+            return ("lalr_action", obj.name)
+        return None
+
+class _ParserUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        (kind, name) = pid
+        if kind == "module":
+            return importlib.import_module(name)
+        return LALR_ACTIONS[name]
+
+# the grammar is 40k.lark plus the terminals generated from the lexicon next to it, when there is one
+def grammar_sources(grammar_path: str = GRAMMAR_PATH):
+    lexicon_path = lexicon_path_for(grammar_path)
+    return [grammar_path, lexicon_path] if os.path.exists(lexicon_path) else [grammar_path]
+
+def grammar_signature(grammar_path: str = GRAMMAR_PATH):
+    signature = []
+    for path in grammar_sources(grammar_path):
+        stat = os.stat(path)
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+def read_grammar(grammar_path: str = GRAMMAR_PATH):
+    with open(grammar_path, encoding="utf-8") as f:
+        grammar = f.read()
+    lexicon_path = lexicon_path_for(grammar_path)
+    if os.path.exists(lexicon_path):
+        grammar = grammar + "\n" + get_lexicon(lexicon_path).terminal_definitions()
+    return grammar
+
+def build_parser(grammar: str, **options):
+    return rank_ambiguities(meter_earley_parser(Lark(grammar, start="start", **options)))
+
+def write_atomically(path: str, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# loads the fully analyzed parser from disk if the grammar was already compiled with the same
+# options and lark version, otherwise builds it and stores it for the next process.
+def load_parser(grammar: str, use_disk_cache=True, **options):
+    if not use_disk_cache:
+        return build_parser(grammar, **options)
+
+    path = os.path.join(cache_dir(), f"parser_{grammar_digest(grammar, **options)}.pickle")
+    try:
+        with open(path, "rb") as f:
+            # parsers pickled before the ranking existed get it on load
+            return rank_ambiguities(_ParserUnpickler(f).load())
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"discarding unreadable parser cache {path}: {e}", file=sys.stderr)
+
+    parser = build_parser(grammar, **options)
+    try:
+        write_atomically(path, lambda f: _ParserPickler(f, protocol=pickle.HIGHEST_PROTOCOL).dump(parser))
+    except OSError as e:
+        print(f"could not write parser cache {path}: {e}", file=sys.stderr)
+    return parser
+
+# process wide parsers, reloaded only when the grammar file changes on disk.
+class ParserCache:
+    def __init__(self, use_disk_cache=True):
+        self.use_disk_cache = use_disk_cache
+        self.parsers = {}
+
+    def get(self, grammar_path: str = GRAMMAR_PATH, **options):
+        signature = grammar_signature(grammar_path)
+        key = (os.path.abspath(grammar_path), repr(sorted(options.items())))
+
+        cached = self.parsers.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        parser = load_parser(read_grammar(grammar_path), self.use_disk_cache, **options)
+        self.parsers[key] = (signature, parser)
+        return parser
+
+    def clear(self):
+        self.parsers.clear()
+
+parser_cache = ParserCache()
+
+def get_parser(grammar_path: str = GRAMMAR_PATH, **options):
+    return parser_cache.get(grammar_path, **options)
+
+grammar_file_digests = {}
+
+# the digest of every file the output depends on, the lexicon holds both the phrases the grammar
+# matches and the values ToAst lowers them to
+def grammar_file_digest(grammar_path: str = GRAMMAR_PATH):
+    signature = grammar_signature(grammar_path)
+    key = os.path.abspath(grammar_path)
+    cached = grammar_file_digests.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    for path in grammar_sources(grammar_path):
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    digest = digest.hexdigest()
+    grammar_file_digests[key] = (signature, digest)
+    return digest
+
+class LALRConflict:
+    def __init__(self, kind: str, terminal: str, rules):
+        self.kind = kind
+        self.terminal = terminal
+        self.rules = list(rules)
+
+    def __repr__(self):
+        return f"LALRConflict({self.kind}, {self.terminal}, {self.rules})"
+
+# lark refuses to build a LALR table for a grammar with reduce/reduce conflicts and silently resolves
+# shift/reduce ones as shifts. Here every conflicting lookahead is instead dropped from the table, so
+# a sentence that reaches one is rejected by the LALR parser and can be handed to earley, while any
+# sentence the table accepts has a single derivation, the same one earley would produce.
+class ConflictFreeLALRAnalyzer(LALR_Analyzer):
+    def compute_lalr1_states(self):
+        self.conflicts = []
+        states = {}
+        for itemset in self.lr0_itemsets:
+            actions = {la: (Shift, next_state.closure) for la, next_state in itemset.transitions.items()}
+            for la, rules in itemset.lookaheads.items():
+                if len(rules) > 1:
+                    self.conflicts.append(LALRConflict("reduce/reduce", la.name, rules))
+                    actions.pop(la, None)
+                    continue
+
+                (rule, ) = rules
+                if la in actions:
+                    shifted = {item.rule for item in itemset.closure if not item.is_satisfied and item.next == la}
+                    self.conflicts.append(LALRConflict("shift/reduce", la.name, [rule, *shifted]))
+                    del actions[la]
+                    continue
+                actions[la] = (Reduce, rule)
+            states[itemset.closure] = {la.name: action for la, action in actions.items()}
+
+        end_states = {}
+        for state in states:
+            for rule_ptr in state:
+                for start in self.lr0_start_states:
+                    if rule_ptr.rule.origin.name == ('$root_' + start) and rule_ptr.is_satisfied:
+                        end_states[start] = state
+
+        start_states = {start: state.closure for start, state in self.lr0_start_states.items()}
+        self.parse_table = IntParseTable.from_ParseTable(ParseTable(states, start_states, end_states))
+
+class ConflictFreeLALRParser(LALR_Parser):
+    def __init__(self, parser_conf: ParserConf, debug: bool = False, strict: bool = False):
+        analysis = ConflictFreeLALRAnalyzer(parser_conf, debug=debug, strict=strict)
+        analysis.compute_lalr()
+        self.conflicts = analysis.conflicts
+        self._parse_table = analysis.parse_table
+        self.parser_conf = parser_conf
+        self.parser = _Parser(analysis.parse_table, parser_conf.callbacks, debug)
+
+LALR_OPTIONS = {"parser": "lalr", "lexer": "contextual", "_plugins": {"LALR_Parser": ConflictFreeLALRParser}}
+
+# The LALR parser of 40k.lark is also shipped pregenerated, as a standalone module written by
+# lark's standalone tool, so that a fresh process neither analyzes the grammar nor needs the disk
+# cache. The module records the digest of the grammar it was generated from and is ignored once
+# the grammar changes, until it is generated again with main.py --generate-parser.
+STANDALONE_MODULE = "rule_parser.generated_lalr_parser"
+STANDALONE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generated_lalr_parser.py")
+
+def standalone_digest(grammar_path: str = GRAMMAR_PATH):
+    options_str = "".join(f"{key}={value};" for key, value in sorted(LALR_OPTIONS.items()))
+    content = read_grammar(grammar_path) + options_str + str(PARSER_CACHE_VERSION)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def generate_standalone_parser(grammar_path: str = GRAMMAR_PATH, path: str = STANDALONE_PATH):
+    from lark.tools.standalone import gen_standalone
+    parser = build_parser(read_grammar(grammar_path), **LALR_OPTIONS)
+    # the plugin only matters while the table is analyzed, the generated module gets the table
+    parser.options.options["_plugins"] = {}
+    out = io.StringIO()
+    out.write(f"# generated by main.py --generate-parser from {os.path.basename(grammar_path)}, do not edit\n")
+    out.write(f"GRAMMAR_DIGEST = {standalone_digest(grammar_path)!r}\n")
+    gen_standalone(parser, out=out, compress=False)
+    write_atomically(path, lambda f: f.write(out.getvalue().encode("utf-8")))
+
+# the standalone module defines its own copy of the lark classes, its trees are built as lark
+# trees and its parse errors are raised again as lark ones
+class StandaloneParser:
+    def __init__(self, module, transformer=None):
+        self.module = module
+        self.parser = module.Lark_StandAlone(tree_class=Tree, transformer=transformer)
+        self.terminals = self.parser.terminals
+
+    def parse(self, text: str):
+        try:
+            return self.parser.parse(text)
+        except self.module.UnexpectedInput as e:
+            raise UnexpectedInput(str(e)) from e
+
+standalone_parsers = {}
+
+# a transformer, such as InlineToAst, runs as the reductions of the parser
+def load_standalone_parser(grammar_path: str = GRAMMAR_PATH, transformer=None):
+    signature = grammar_signature(grammar_path)
+    key = (os.path.abspath(grammar_path), transformer)
+    cached = standalone_parsers.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    parser = None
+    try:
+        module = importlib.import_module(STANDALONE_MODULE)
+    except ImportError:
+        module = None
+    if module is not None and module.GRAMMAR_DIGEST == standalone_digest(grammar_path):
+        parser = StandaloneParser(module, transformer)
+    elif module is not None and grammar_path == GRAMMAR_PATH:
+        print(f"{STANDALONE_PATH} is older than {grammar_path}, regenerate it with main.py --generate-parser", file=sys.stderr)
+    standalone_parsers[key] = (signature, parser)
+    return parser
+
+# the transformer only runs inline with the pregenerated parser, the parsers built at runtime are
+# shared and cached on disk without one, and keep returning plain trees
+def get_lalr_parser(grammar_path: str = GRAMMAR_PATH, transformer=None):
+    standalone = load_standalone_parser(grammar_path, transformer)
+    if standalone is not None:
+        return standalone
+    return get_parser(grammar_path, **LALR_OPTIONS)
+
+# tries the deterministic LALR table first and only pays for earley when the sentence hits a
+# conflict or is rejected by the LALR lexer or parser.
+class FastPathParser:
+    def __init__(self, lalr: Lark, grammar_path: str = GRAMMAR_PATH):
+        self.lalr = lalr
+        self.grammar_path = grammar_path
+        self.lalr_parses = 0
+        self.earley_parses = 0
+
+    # only loaded once a sentence needs it, a run the LALR table covers never loads it
+    @property
+    def earley(self):
+        return get_parser(self.grammar_path, parser="earley")
+
+    def parse(self, text: str):
+        try:
+            tree = self.lalr.parse(text)
+            self.lalr_parses = self.lalr_parses + 1
+            return tree
+        except UnexpectedInput:
+            pass
+        self.earley_parses = self.earley_parses + 1
+        return self.earley.parse(text)
+
+fast_path_parsers = {}
+
+def get_fast_path_parser(grammar_path: str = GRAMMAR_PATH, transformer=None):
+    lalr = get_lalr_parser(grammar_path, transformer)
+    cached = fast_path_parsers.get((grammar_path, transformer))
+    if cached is None or cached.lalr is not lalr:
+        cached = FastPathParser(lalr, grammar_path)
+        fast_path_parsers[(grammar_path, transformer)] = cached
+    return cached
+
+# maps the helper rules lark generates for ebnf operators, such as __effect_star_3, back to the rule
+# they were written in.
+def production_name(rule):
+    origin = rule.origin.name
+    match = re.match(r"^__(.+)_[a-z]+_\d+$", origin)
+    if match is not None:
+        origin = match.group(1)
+    if rule.alias is not None:
+        return f"{origin} -> {rule.alias}"
+    return origin
+
+def lalr_conflicts(grammar_path: str = GRAMMAR_PATH):
+    grammar, _ = load_grammar(read_grammar(grammar_path), grammar_path, [], False)
+    terminals, rules, _ = grammar.compile(["start"], set())
+    analysis = ConflictFreeLALRAnalyzer(ParserConf(rules, None, ["start"]))
+    analysis.compute_lalr()
+    return analysis.conflicts, {terminal.name: terminal for terminal in terminals}
+
+def report_lalr_conflicts(out, grammar_path: str = GRAMMAR_PATH):
+    conflicts, terminals = lalr_conflicts(grammar_path)
+    by_production = {}
+    for conflict in conflicts:
+        terminal = terminals.get(conflict.terminal)
+        lookahead = repr(terminal.pattern.value) if terminal is not None and conflict.terminal.startswith("__ANON") else conflict.terminal
+        for name in {production_name(rule) for rule in conflict.rules}:
+            entry = by_production.setdefault(name, [0, set(), set()])
+            entry[0] = entry[0] + 1
+            entry[1].add(conflict.kind)
+            entry[2].add(lookahead)
+
+    out.write(f"{len(conflicts)} LALR conflicts, {len(by_production)} productions involved\n")
+    for name, (count, kinds, lookaheads) in sorted(by_production.items(), key=lambda item: (-item[1][0], item[0])):
+        out.write(f"{count:5} {name} ({', '.join(sorted(kinds))} on {', '.join(sorted(lookaheads))})\n")
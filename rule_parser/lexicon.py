@@ -0,0 +1,86 @@
+import configparser
+import os
+import re
+
+LEXICON_PATH = "./40k.lexicon"
+
+# the grammar rules whose alternatives come from the lexicon, each one becomes a single terminal
+LEXICON_CATEGORIES = ["model_keyword", "unit_name", "stratagem", "weapon_name"]
+
+def lexicon_path_for(grammar_path: str):
+    return os.path.splitext(grammar_path)[0] + ".lexicon"
+
+def terminal_name(category: str):
+    return "LEXICON_" + category.upper()
+
+def normalize_phrase(phrase: str):
+    return " ".join(phrase.lower().split())
+
+# A lexicon is an ini file with one section per category, mapping the phrase found in the rule
+# text to the value ToAst lowers it to:
+#
+#   [model_keyword]
+#   tyranids = tyranid
+class Lexicon:
+    def __init__(self, categories=None):
+        self.categories = {category: {} for category in LEXICON_CATEGORIES}
+        for category, entries in (categories or {}).items():
+            for phrase, value in entries.items():
+                self.add(category, phrase, value)
+
+    def add(self, category: str, phrase: str, value: str):
+        if category not in self.categories:
+            raise ValueError(f"unknown lexicon category {category}, expected one of {', '.join(LEXICON_CATEGORIES)}")
+        self.categories[category][normalize_phrase(phrase)] = value
+
+    def lookup(self, category: str, phrase: str):
+        return self.categories[category][normalize_phrase(phrase)]
+
+    # one terminal per category, matching any of its phrases through a regex shaped like the trie
+    # of the phrases, so that matching costs the length of the phrase and not the number of entries
+    def terminal_definitions(self):
+        definitions = []
+        for category, entries in self.categories.items():
+            if len(entries) == 0:
+                continue
+            pattern = trie_pattern(build_trie(entries.keys())).replace("/", "\\/")
+            definitions.append(f"{terminal_name(category)}: /{pattern}(?![a-z0-9])/")
+        return "\n".join(definitions) + "\n"
+
+def load_lexicon(path: str = LEXICON_PATH):
+    parser = configparser.ConfigParser(delimiters=("=", ), comment_prefixes=("#", ), interpolation=None)
+    with open(path, encoding="utf-8") as f:
+        parser.read_file(f)
+    return Lexicon({section: dict(parser.items(section)) for section in parser.sections()})
+
+def build_trie(phrases):
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return trie
+
+def trie_pattern(node):
+    alternatives = [re.escape(char) + trie_pattern(child) for char, child in sorted(node.items()) if char != ""]
+    if len(alternatives) == 0:
+        return ""
+    ends_here = "" in node
+    if len(alternatives) == 1 and not ends_here:
+        return alternatives[0]
+    return "(?:" + "|".join(alternatives) + ")" + ("?" if ends_here else "")
+
+lexicons = {}
+
+def get_lexicon(path: str = LEXICON_PATH):
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    key = os.path.abspath(path)
+    cached = lexicons.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    lexicon = load_lexicon(path)
+    lexicons[key] = (signature, lexicon)
+    return lexicon
@@ -0,0 +1,68 @@
+# Rule text is canonicalized once before it is parsed, so that the grammar can spell its literals
+# exactly: lower case, straight quotes, plain hyphens, single spaces and no spaces inside the
+# brackets of ability names. The offset of every normalized character in the original text is
+# kept, so that errors still point at what the user wrote.
+
+# characters replaced one for one, every other whitespace character is a space
+REPLACED = {
+    "‘": "'", "’": "'", "‚": "'", "′": "'", "ʼ": "'",
+    "“": "\"", "”": "\"", "„": "\"", "″": "\"",
+    # hyphen, non breaking hyphen, figure dash, en dash, em dash and minus sign
+    "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2013": "-", "\u2014": "-", "\u2212": "-",
+}
+
+# soft hyphens and zero width characters, which only matter to the layout of the text
+REMOVED = {"\u00ad", "\u200b", "\u200c", "\u200d", "\u2060", "\ufeff"}
+
+# the line and column, both starting at 1, of a position of text
+def text_location(text: str, position: int):
+    line = text.count("\n", 0, position) + 1
+    column = position - (text.rfind("\n", 0, position) + 1) + 1
+    return line, column
+
+class NormalizedText:
+    def __init__(self, original: str, text: str, offsets):
+        self.original = original
+        self.text = text
+        # offsets[i] is the position in the original text of text[i], with one more entry for the end
+        self.offsets = offsets
+
+    def original_position(self, position: int):
+        return self.offsets[max(0, min(position, len(self.text)))]
+
+    # the original text of text[start:end]
+    def original_text(self, start: int, end: int):
+        if end <= start:
+            return ""
+        return self.original[self.original_position(start):self.original_position(end - 1) + 1]
+
+    # moves an error raised on text, or on the sentence of text starting at start, onto the original
+    def relocate(self, error, start: int = 0):
+        if getattr(error, "pos_in_stream", None) is None:
+            return error
+        position = self.original_position(error.pos_in_stream + start)
+        if getattr(error, "char", None) is not None and position < len(self.original):
+            error.char = self.original[position]
+        error.pos_in_stream = position
+        error.line, error.column = text_location(self.original, position)
+        return error
+
+def normalize_text(text: str):
+    chars = []
+    offsets = []
+    for position, char in enumerate(text):
+        if char in REMOVED:
+            continue
+        char = REPLACED.get(char, char)
+        if char.isspace():
+            if len(chars) == 0 or chars[-1] in " [":
+                continue
+            char = " "
+        elif char == "]" and len(chars) != 0 and chars[-1] == " ":
+            chars.pop()
+            offsets.pop()
+        for lowered in char.lower():
+            chars.append(lowered)
+            offsets.append(position)
+    offsets.append(len(text))
+    return NormalizedText(text, "".join(chars), offsets)
@@ -0,0 +1,98 @@
+import json
+import time
+import tracemalloc
+
+# Records, for every pass of the pipelines it times, its wall time, the operations of the module
+# before and after it and by how much the memory traced by tracemalloc peaked over what was
+# allocated when the pass started. Tracing memory slows the passes down, times taken with
+# trace_memory are only comparable with each other. Passes that keep stats, like
+# DropUselessOperations, have them recorded as well.
+#
+# A timer can time any number of pipelines, the summary adds up the runs of every pass, and the
+# records of other timers, like those of the rules of a batch compiled in other processes, can be
+# added to it.
+class PassTimer:
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.records = []
+        self.started = None
+        self.ops_before = None
+        self.allocated = 0
+
+    def start(self, module):
+        self.ops_before = sum(1 for _ in module.walk())
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            self.allocated = tracemalloc.get_traced_memory()[0]
+        self.started = time.perf_counter()
+
+    def stop(self, module_pass, module):
+        seconds = time.perf_counter() - self.started
+        peak = tracemalloc.get_traced_memory()[1] - self.allocated if self.trace_memory else None
+        record = {"pass": module_pass.name, "seconds": seconds, "ops_before": self.ops_before, "ops_after": sum(1 for _ in module.walk()), "peak_bytes": peak}
+        if getattr(module_pass, "stats", None) is not None:
+            record["stats"] = module_pass.stats
+        self.records.append(record)
+
+    # runs a PassPipeline, timing each of its passes, its callback runs between them untimed. A
+    # pipeline that raises leaves no record, like the attempts of a partial compilation that are
+    # retried without a sentence
+    def apply(self, pipeline, ctx, module):
+        callback = pipeline.callback
+        def timed(previous, module, next):
+            self.stop(previous, module)
+            if callback is not None:
+                callback(previous, module, next)
+            self.start(module)
+
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        first = len(self.records)
+        try:
+            self.start(module)
+            type(pipeline)(pipeline.passes, timed).apply(ctx, module)
+            self.stop(pipeline.passes[-1], module)
+        except BaseException:
+            del self.records[first:]
+            raise
+        finally:
+            if tracing:
+                tracemalloc.stop()
+
+    def add_records(self, records):
+        self.records.extend(records)
+
+    # one row per pass, in the order they first ran, the peak is the largest of its runs
+    def summary(self):
+        rows = {}
+        for record in self.records:
+            row = rows.setdefault(record["pass"], {"pass": record["pass"], "runs": 0, "seconds": 0.0, "ops_before": 0, "ops_after": 0, "peak_bytes": None})
+            row["runs"] = row["runs"] + 1
+            row["seconds"] = row["seconds"] + record["seconds"]
+            row["ops_before"] = row["ops_before"] + record["ops_before"]
+            row["ops_after"] = row["ops_after"] + record["ops_after"]
+            if record["peak_bytes"] is not None:
+                row["peak_bytes"] = max(row["peak_bytes"] or 0, record["peak_bytes"])
+        return list(rows.values())
+
+    def to_json(self):
+        return {"passes": self.summary(), "records": self.records}
+
+    def write(self, out):
+        rows = self.summary()
+        total = sum(row["seconds"] for row in rows)
+        out.write(f"{'seconds':>9} {'share':>6} {'runs':>5} {'ops before':>10} {'ops after':>10} {'peak KiB':>9}  pass\n")
+        for row in rows:
+            share = row["seconds"] / total if total != 0 else 0.0
+            peak = f"{row['peak_bytes'] / 1024:9.1f}" if row["peak_bytes"] is not None else f"{'-':>9}"
+            out.write(f"{row['seconds']:9.4f} {share:6.1%} {row['runs']:5} {row['ops_before']:10} {row['ops_after']:10} {peak}  {row['pass']}\n")
+        out.write(f"{total:9.4f} total\n")
+
+    # the report selected by the --timing argument
+    def report(self, out, format: str = "table"):
+        if format == "json":
+            json.dump(self.to_json(), out, indent=2)
+            out.write("\n")
+        else:
+            self.write(out)
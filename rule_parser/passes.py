@@ -1,9 +1,17 @@
 from .dialect import *
 from typing import List
+from collections import Counter, deque
+from contextlib import contextmanager
 from functools import singledispatchmethod
+import bisect
+import heapq
 import sys
+import weakref
+from xdsl.pattern_rewriter import RewritePattern, op_type_rewrite_pattern
 
-def ancesor_of_type(op: Operation, ancestor_type: type):
+def ancesor_of_type(op: Operation, ancestor_type: type, analysis=None):
+    if analysis is not None:
+        return analysis.ancestor_of_type(op, ancestor_type)
     parent = op.parent_op()
     while parent is not None:
         if isinstance(parent, ancestor_type):
@@ -21,7 +29,9 @@ def move_region_content(dest: Region, src: Region):
         src.detach_block(block)
         dest.add_block(block)
 
-def find_parent_of_type(operation: Operation, type) -> Operation:
+def find_parent_of_type(operation: Operation, type, analysis=None) -> Operation:
+    if analysis is not None:
+        return analysis.ancestor_of_type(operation, type)
     parent = operation.parent_op()
     while parent is not None and not isinstance(parent, type):
         parent = parent.parent_op()
@@ -44,7 +54,9 @@ def move_all_ops(src: Block, dst: Block) -> None:
         dst.insert_ops_after(ops, dst.last_op)
 
 
-def dominates(dominator: Operation, dominatee: Operation):
+def dominates(dominator: Operation, dominatee: Operation, analysis=None):
+    if analysis is not None:
+        return analysis.dominates(dominator, dominatee)
     must_contain = dominator.parent_op()
     parent = dominatee
     while parent is not None:
@@ -55,8 +67,197 @@ def dominates(dominator: Operation, dominatee: Operation):
         parent = parent.parent_op()
     return False
 
+# the nearest enclosing operation of each of these types is recorded for every operation
+ANCESTOR_TYPES = (UntilEffect, RLCFunction, ConditionalEffect, MakesAnAttack)
+
+# containment across at most this many levels is answered by following the recorded parents
+MAX_PARENT_STEPS = 8
+
+class AncestorRecord:
+    def __init__(self, parent: Operation, depth: int, ancestors, pre: int = None):
+        self.parent = parent
+        self.depth = depth
+        self.ancestors = ancestors
+        self.pre = pre
+        self.post = None
+
+# Answers dominates, ancesor_of_type and find_parent_of_type for the operations of a module without
+# walking their parent_op() chains. The record of an operation holds its depth and its nearest
+# ancestors of ANCESTOR_TYPES, it is built from the record of its parent the first time the
+# operation is asked about. Containment is answered from the depths, by following the parents of
+# the inner operation up to the depth of the outer one. Once that takes more than MAX_PARENT_STEPS
+# the whole module is numbered in pre and post order, an operation contains another when its
+# interval contains the interval of the other. Erasing operations keeps the numbering valid,
+# operations created or moved afterwards have no number and answer through their parent.
+#
+# The records of the operations an AnalysisRewriter moves or erases are dropped, so are the ones of
+# an operation whose parent is not the recorded one anymore. Operations moved along with a parent
+# that was moved without the rewriter are not noticed, such moves go through notify_moved.
+class AncestorAnalysis:
+    def __init__(self, root: Operation):
+        self.root = root
+        self.records = {}
+        self.counter = None
+
+    def number_all(self):
+        self.counter = 0
+        self.number(self.root, self.root.parent_op(), 0, {})
+
+    def number(self, op: Operation, parent: Operation, depth: int, ancestors):
+        record = AncestorRecord(parent, depth, ancestors, self.counter)
+        self.counter = self.counter + 1
+        self.records[op] = record
+        if len(op.regions) != 0:
+            inner = self.inner_ancestors(op, ancestors)
+            for region in op.regions:
+                for block in region.blocks:
+                    for child in block.ops:
+                        self.number(child, op, depth + 1, inner)
+        record.post = self.counter
+        self.counter = self.counter + 1
+
+    # the ancestors of the operations directly inside op
+    def inner_ancestors(self, op: Operation, ancestors):
+        if not isinstance(op, ANCESTOR_TYPES):
+            return ancestors
+        inner = dict(ancestors)
+        for ancestor_type in ANCESTOR_TYPES:
+            if isinstance(op, ancestor_type):
+                inner[ancestor_type] = op
+        return inner
+
+    def record(self, op: Operation):
+        parent = op.parent_op()
+        record = self.records.get(op)
+        if record is not None and record.parent is parent:
+            return record
+        if record is not None:
+            self.ops_removed(op)
+        if parent is None:
+            record = AncestorRecord(None, 0, {})
+        else:
+            parent_record = self.record(parent)
+            record = AncestorRecord(parent, parent_record.depth + 1, self.inner_ancestors(parent, parent_record.ancestors))
+        self.records[op] = record
+        return record
+
+    # an operation without a record has no descendant with one, records are built parent first
+    def ops_removed(self, target):
+        if isinstance(target, Operation) and target not in self.records:
+            return
+        for op in target.walk():
+            self.records.pop(op, None)
+
+    def ops_added(self, target):
+        pass
+
+    def ops_modified(self, op: Operation):
+        pass
+
+    # the number of operations around op
+    def depth(self, op: Operation):
+        return self.record(op).depth
+
+    # true if op is ancestor or is inside it
+    def contains(self, ancestor: Operation, op: Operation):
+        ancestor_record = self.record(ancestor)
+        record = self.record(op)
+        if record.depth - ancestor_record.depth <= MAX_PARENT_STEPS:
+            while record.depth > ancestor_record.depth:
+                op = record.parent
+                record = self.record(op)
+            return op is ancestor
+
+        if self.counter is None:
+            self.number_all()
+            ancestor_record = self.record(ancestor)
+        while op is not None:
+            if op is ancestor:
+                return True
+            record = self.record(op)
+            if record.pre is not None:
+                return ancestor_record.pre is not None and ancestor_record.pre <= record.pre and record.post <= ancestor_record.post
+            op = record.parent
+        return False
+
+    def ancestor_of_type(self, op: Operation, ancestor_type: type):
+        if ancestor_type not in ANCESTOR_TYPES:
+            return ancesor_of_type(op, ancestor_type)
+        return self.record(op).ancestors.get(ancestor_type)
+
+    # same as dominates
+    def dominates(self, dominator: Operation, dominatee: Operation):
+        must_contain = dominator.parent_op()
+        if must_contain is None:
+            return False
+        until = dominatee if isinstance(dominatee, UntilEffect) else self.ancestor_of_type(dominatee, UntilEffect)
+        if until is not None and self.contains(must_contain, until):
+            return False
+        return self.contains(must_contain, dominatee)
+
+# a rewriter that tells the analyses it was given about the operations it moves, creates and erases
+class AnalysisRewriter(Rewriter):
+    def __init__(self, *analyses):
+        super().__init__()
+        self.analyses = [analysis for analysis in analyses if analysis is not None]
+
+    def ops_removed(self, target):
+        for analysis in self.analyses:
+            analysis.ops_removed(target)
+
+    def ops_added(self, target):
+        for analysis in self.analyses:
+            analysis.ops_added(target)
+
+    # for the operations whose operands changed
+    def ops_modified(self, op: Operation):
+        for analysis in self.analyses:
+            analysis.ops_modified(op)
+
+    def replace_all_uses_with(self, value: SSAValue, new_value: SSAValue):
+        users = [use.operation for use in value.uses]
+        value.replace_by(new_value)
+        for user in users:
+            self.ops_modified(user)
+
+    # for blocks and operations moved without the rewriter
+    def notify_moved(self, target):
+        self.ops_removed(target)
+        self.ops_added(target)
+
+    def erase_op(self, op: Operation, safe_erase: bool = True):
+        self.ops_removed(op)
+        super().erase_op(op, safe_erase)
+
+    def insert_op(self, op_or_ops, insertion_point: InsertPoint):
+        ops = (op_or_ops, ) if isinstance(op_or_ops, Operation) else list(op_or_ops)
+        for op in ops:
+            self.ops_removed(op)
+        super().insert_op(ops, insertion_point)
+        for op in ops:
+            self.ops_added(op)
+
+    def inline_block(self, source: Block, insertion_point: InsertPoint, arg_values=()):
+        ops = list(source.ops)
+        for op in ops:
+            self.ops_removed(op)
+        super().inline_block(source, insertion_point, arg_values)
+        for op in ops:
+            self.ops_added(op)
+
+    def replace_op(self, op: Operation, new_ops, new_results=None, safe_erase: bool = True):
+        new_ops = [new_ops] if isinstance(new_ops, Operation) else list(new_ops)
+        users = [use.operation for result in op.results for use in result.uses]
+        self.ops_removed(op)
+        super().replace_op(op, new_ops, new_results, safe_erase)
+        for new_op in new_ops:
+            self.ops_added(new_op)
+        for user in users:
+            self.ops_modified(user)
+
 class VerifyPass(ModulePass):
     name = "verify-pass"
+    maintains_op_index = True
 
 
     def apply(self, ctx: Context, module: ModuleOp):
@@ -64,6 +265,7 @@ class VerifyPass(ModulePass):
 
 class PrintModulePass(ModulePass):
     name = "print-module-pass"
+    maintains_op_index = True
 
     def __init__(self, out):
         super().__init__()
@@ -72,32 +274,283 @@ class PrintModulePass(ModulePass):
     def apply(self, ctx: Context, module: ModuleOp):
         self.printer.print_op(module)
 
+# true if op is root or is inside it
+def is_inside(op: Operation, root: Operation):
+    while op is not None and op is not root:
+        op = op.parent_op()
+    return op is root
+
+# the last operation of the walk of op
+def last_in_walk(op: Operation):
+    for region in reversed(list(op.regions)):
+        for block in reversed(list(region.blocks)):
+            if block.last_op is not None:
+                return last_in_walk(block.last_op)
+    return op
+
+# the operation a walk visits right before op
+def walk_predecessor(op: Operation):
+    if op.prev_op is not None:
+        return last_in_walk(op.prev_op)
+    block = op.parent_block()
+    parent = block.parent_op() if block is not None else None
+    if parent is None:
+        return None
+    previous = None
+    for region in parent.regions:
+        for other in region.blocks:
+            if other is block:
+                return last_in_walk(previous) if previous is not None else parent
+            if other.last_op is not None:
+                previous = other.last_op
+    return parent
+
+# the operation a walk of root visits right after op and everything inside it
+def walk_successor(op: Operation, root: Operation):
+    while op is not root:
+        if op.next_op is not None:
+            return op.next_op
+        block = op.parent_block()
+        parent = block.parent_op() if block is not None else None
+        if parent is None:
+            return None
+        after = False
+        for region in parent.regions:
+            for other in region.blocks:
+                if after and other.first_op is not None:
+                    return other.first_op
+                after = after or other is block
+        op = parent
+    return None
+
+# The live operations of a module by class, so that the passes find the operations of a type or
+# trait without walking the whole module. Every operation has a key that orders it as module.walk()
+# would, the operations of a class are kept sorted by key, so a query costs the operations it
+# finds.
+#
+# An AnalysisRewriter given the index keys the operations it inserts or moves between the keys of
+# the operations around their new place, and drops the ones it erases. Operations detached, erased
+# or inserted without the rewriter are not noticed: code that detaches an operation for good tells
+# the rewriter with ops_removed, and a pass that does any of it without telling does not maintain
+# the index, the pipeline rebuilds it after that pass.
+class OpIndex:
+    def __init__(self, root: Operation):
+        self.root = root
+        self.rebuild()
+
+    def rebuild(self):
+        # the keys and the operations of every class, in the order of the keys
+        self.ops = {}
+        self.keys = {}
+        for key, op in enumerate(self.root.walk()):
+            self.keys[op] = key
+            (keys, ops) = self.ops.setdefault(type(op), ([], []))
+            keys.append(key)
+            ops.append(op)
+        self.last_key = len(self.keys)
+        self.stale = False
+
+    def invalidate(self):
+        self.stale = True
+
+    def add(self, op: Operation, key: float):
+        self.keys[op] = key
+        (keys, ops) = self.ops.setdefault(type(op), ([], []))
+        position = bisect.bisect_right(keys, key)
+        keys.insert(position, key)
+        ops.insert(position, op)
+
+    def forget(self, op: Operation):
+        key = self.keys.pop(op, None)
+        if key is not None:
+            (keys, ops) = self.ops[type(op)]
+            position = bisect.bisect_left(keys, key)
+            del keys[position]
+            del ops[position]
+
+    # operations that were never added, like fresh clones, hold none that were, and those that
+    # were are keyed again when they are added back anyway
+    def ops_removed(self, target):
+        if self.stale or (isinstance(target, Operation) and target not in self.keys):
+            return
+        for op in target.walk():
+            self.forget(op)
+
+    # the operations of target get keys between the ones of the closest operations with a key the
+    # walk visits before and after them, the ones that are still to be added, like the rest of an
+    # inlined block, are skipped. The operations added outside the module get their keys once it
+    # is inserted
+    def ops_added(self, target):
+        if self.stale:
+            return
+        ops = list(target.walk())
+        if len(ops) == 0 or not is_inside(ops[0], self.root):
+            return
+        before = walk_predecessor(ops[0])
+        while before is not None and before not in self.keys:
+            before = walk_predecessor(before)
+        after = walk_successor(ops[0] if isinstance(target, Operation) else target.last_op, self.root)
+        while after is not None and after not in self.keys:
+            after = walk_successor(after, self.root)
+        if before is None:
+            self.stale = True
+            return
+        low = self.keys[before]
+        high = self.keys[after] if after is not None else self.last_key + 1
+        step = (high - low) / (len(ops) + 1)
+        # the gap ran out of precision, the keys are numbered again
+        if low + step <= low or high - step >= high:
+            self.stale = True
+            return
+        self.last_key = max(self.last_key, high)
+        for position, op in enumerate(ops):
+            self.forget(op)
+            self.add(op, low + step * (position + 1))
+
+    def ops_modified(self, op: Operation):
+        pass
+
+    # the operations of every matching class, merged in the order of their keys
+    def find(self, matches):
+        if self.stale:
+            self.rebuild()
+        found = [(keys, ops) for (op_type, (keys, ops)) in self.ops.items() if len(ops) != 0 and matches(op_type, ops[0])]
+        if len(found) == 1:
+            return list(found[0][1])
+        return [op for (_, op) in heapq.merge(*[zip(keys, ops) for (keys, ops) in found])]
+
+    def of_type(self, op_type: type):
+        return self.find(lambda found_type, op: issubclass(found_type, op_type))
+
+    # traits are declared by the class, any operation of a class stands for all of them
+    def with_trait(self, trait):
+        return self.find(lambda found_type, op: op.has_trait(trait))
+
+op_indexes = weakref.WeakKeyDictionary()
+
+def op_index(module: Operation):
+    return op_indexes.get(module)
+
+# the passes run on module while it is indexed query and maintain its index
+@contextmanager
+def indexed_ops(module: Operation):
+    op_indexes[module] = OpIndex(module)
+    try:
+        yield op_indexes[module]
+    finally:
+        del op_indexes[module]
+
+# a PassPipeline callback, the index is rebuilt after a pass that changed the module behind its back
+def refresh_op_index(previous: ModulePass, module: Operation, next: ModulePass):
+    index = op_index(module)
+    if index is not None and not getattr(previous, "maintains_op_index", False):
+        index.invalidate()
+
 def visit(module, type):
-    ops = [op for op in module.walk() if isinstance(op, type)]
+    index = op_index(module)
+    ops = index.of_type(type) if index is not None else [op for op in module.walk() if isinstance(op, type)]
     for op in ops:
         yield op
 
 def visit_traits(module, trait):
-    ops = [op for op in module.walk() if op.has_trait(trait)]
+    index = op_index(module)
+    ops = index.with_trait(trait) if index is not None else [op for op in module.walk() if op.has_trait(trait)]
     for op in ops:
         yield op
 
+# The operations a greedy rewrite still has to match. Every round matches the operations the
+# previous one queued: those the rewriter inserted, moved or changed the operands of, and those
+# that lost a use because an operation was erased. Operations already waiting in the current round
+# are not queued again.
+class RewriteWorklist:
+    def __init__(self):
+        self.current = deque()
+        self.waiting = set()
+        self.next = {}
+        self.changes = 0
+
+    def push(self, op: Operation):
+        if op not in self.waiting:
+            self.next[op] = None
+
+    def start_round(self, ops):
+        self.current = deque(ops)
+        self.waiting = set(self.current)
+        self.next = {}
+
+    def pop(self):
+        op = self.current.popleft()
+        self.waiting.discard(op)
+        return op
+
+    def ops_removed(self, target):
+        self.changes = self.changes + 1
+        if isinstance(target, Operation):
+            for operand in target.operands:
+                if isinstance(operand.owner, Operation):
+                    self.push(operand.owner)
+
+    def ops_added(self, target):
+        self.changes = self.changes + 1
+        for op in ((target, ) if isinstance(target, Operation) else target.ops):
+            self.push(op)
+
+    def ops_modified(self, op: Operation):
+        self.changes = self.changes + 1
+        self.push(op)
+
+# Applies rewrite patterns to the operations of a module until none of them matches anymore. The
+# first round matches every operation in walk order, the following ones only the operations
+# queued by the rewrites, see RewriteWorklist. The first pattern that changes an operation is the
+# only one applied to it in that round, if the operation is still there it is matched again in
+# the next one. Patterns rewrite through the AnalysisRewriter they are given, which keeps the
+# other analyses up to date as well.
+class GreedyRewriteDriver:
+    def __init__(self, patterns, *analyses):
+        self.patterns = patterns
+        self.worklist = RewriteWorklist()
+        self.rewriter = AnalysisRewriter(self.worklist, *analyses)
+        self.applications = Counter()
+        self.iterations = 0
+
+    def rewrite(self, module: Operation):
+        self.worklist.start_round(module.walk())
+        while len(self.worklist.current) != 0:
+            self.iterations = self.iterations + 1
+            while len(self.worklist.current) != 0:
+                op = self.worklist.pop()
+                if op is not module and is_inside(op, module):
+                    self.match(op)
+            self.worklist.start_round(self.worklist.next)
+
+    def match(self, op: Operation):
+        for pattern in self.patterns:
+            changes = self.worklist.changes
+            pattern.match_and_rewrite(op, self.rewriter)
+            if changes != self.worklist.changes:
+                self.applications[type(pattern).__name__] = self.applications[type(pattern).__name__] + 1
+                return
+
+    def stats(self):
+        return {"applications": dict(self.applications), "iterations": self.iterations}
+
 
 class ExtractTemporaryEffectsPass(ModulePass):
     name = "extract-temporary-effecs"
+    maintains_op_index = True
 
     # until effects must be hoisted out into the a global effect with captures
-    def extract_until_effects(self, rewriter, module):
+    def extract_until_effects(self, rewriter, module, ancestors=None):
 
         # mark as captured all non local references
         for op in visit(module, ThisSubject):
             op: ThisSubject
 
             # ToDo: generalize this by saying that some operations override what "this x" means
-            if op.result.type == AttackType() and ancesor_of_type(op, MakesAnAttack):
+            if op.result.type == AttackType() and ancesor_of_type(op, MakesAnAttack, ancestors):
                 continue
 
-            until = ancesor_of_type(op, UntilEffect)
+            until = ancesor_of_type(op, UntilEffect, ancestors)
             if until is None:
                 continue
 
@@ -139,15 +592,17 @@ class ExtractTemporaryEffectsPass(ModulePass):
 
 
     def apply(self, ctx: ModuleOp, module: ModuleOp):
-        rewriter = Rewriter()
-        self.extract_until_effects(rewriter, module)
+        ancestors = AncestorAnalysis(module)
+        rewriter = AnalysisRewriter(ancestors, op_index(module))
+        self.extract_until_effects(rewriter, module, ancestors)
 
 # Sometimes, effects are written in a different sentence than the logical place where they are triggered.
 class InlineDependantEffects(ModulePass):
     name = "inline-dependant-effects"
+    maintains_op_index = True
 
     # additional effects appear to specify that a dependant effect is to executed only if the conditional part of the previous sentence is true. that is, it is inlined in the true branch
-    def inline_additional_effects(self, rewriter: Rewriter, module: ModuleOp):
+    def inline_additional_effects(self, rewriter: Rewriter, module: ModuleOp, ancestors=None):
         for additional_effect in visit(module, AdditionalEffect):
             additional_effect: AdditionalEffect
             captured_references = list(visit(additional_effect, CapturedReference))
@@ -156,7 +611,7 @@ class InlineDependantEffects(ModulePass):
             reference: CapturedReference
             referred = reference.value.owner
             referred: Operation
-            conditional_effect = find_parent_of_type(referred, ConditionalEffect)
+            conditional_effect = find_parent_of_type(referred, ConditionalEffect, ancestors)
             conditional_effect: ConditionalEffect
             assert conditional_effect != None
 
@@ -172,51 +627,53 @@ class InlineDependantEffects(ModulePass):
 
 
     def apply(self, ctx: Context, module: ModuleOp):
-        rewriter = Rewriter()
-        objects = []
-        self.inline_additional_effects(rewriter, module)
+        ancestors = AncestorAnalysis(module)
+        rewriter = AnalysisRewriter(ancestors, op_index(module))
+        self.inline_additional_effects(rewriter, module, ancestors)
 
-        for top_level_object in list(module.body.ops):
-            objects.append([])
-            for op in visit(top_level_object, CapturedReference):
-                objects[-1].append(op)
+        # the first capture of every top level object
+        first_captures = {}
+        for op in visit(module, CapturedReference):
+            top_level_object = op
+            while top_level_object.parent_op() is not module:
+                top_level_object = top_level_object.parent_op()
+            first_captures.setdefault(top_level_object, op)
 
-        for top_level_object, objs in zip(list(module.body.ops), objects):
-            for obj in objs:
-                top_level_object.detach()
-                rewriter.insert_op(top_level_object, InsertPoint.after(obj.value.owner))
-                break
+        for top_level_object, capture in first_captures.items():
+            top_level_object.detach()
+            rewriter.insert_op(top_level_object, InsertPoint.after(capture.value.owner))
 
         for op in visit(module, CapturedReference):
             op: CapturedReference
-            if dominates(op.value.owner, op):
+            if dominates(op.value.owner, op, ancestors):
                 op.result.replace_by(op.value)
                 rewriter.erase_op(op)
 
 class RewriteEventsPass(ModulePass):
     name = "rewrite-events-pass"
+    maintains_op_index = True
 
     def inline_subject_constraint_region(self, to_inline: Region, func_arg: SSAValue, condition_region: Region, inline_at_start=True):
-        rewriter = Rewriter()
+        rewriter = self.rewriter
         yield_op = to_inline.first_block.last_op
         yield_op: Yield
         is_same = IsSame.make(func_arg, yield_op.value[0])
         yield_op.operands[0] = is_same.result
-        merge_preconditions(to_inline.first_block, condition_region, inline_at_start)
+        merge_preconditions(to_inline.first_block, condition_region, inline_at_start, rewriter)
         rewriter.insert_op(is_same, InsertPoint.before(condition_region.last_op.prev_op))
 
     def inline_subject_beloning_constraint_region(self, to_inline: Region, func_arg: SSAValue, condition_region: Region, inline_at_start=True):
-        rewriter = Rewriter()
+        rewriter = self.rewriter
         yield_op = to_inline.first_block.last_op
         yield_op: Yield
         is_same = BelongsTo.make(func_arg, yield_op.value[0])
         rewriter.insert_op(is_same, InsertPoint.before(yield_op))
         yield_op.operands[0] = is_same.result
-        merge_preconditions(to_inline.first_block, condition_region, insert_first=inline_at_start)
+        merge_preconditions(to_inline.first_block, condition_region, insert_first=inline_at_start, rewriter=rewriter)
 
     def rewrite_conditional_effect_as_function(self, op: MappableOntoFunction):
         new_op = RLCFunction.make(op)
-        rewriter = Rewriter()
+        rewriter = self.rewriter
 
         rewriter.insert_op(new_op, InsertPoint.before(op))
 
@@ -248,7 +705,8 @@ class RewriteEventsPass(ModulePass):
         return (new_op, if_stmt.condition.first_block, if_stmt.true_branch.first_block)
 
     def apply(self, ctx: ModuleOp, module: ModuleOp):
-        rewriter = Rewriter()
+        self.rewriter = AnalysisRewriter(op_index(module))
+        rewriter = self.rewriter
         for op in visit(module, ObtainWeaponAbility):
             (func, cond, true_branch) = self.rewrite_conditional_effect_as_function(op)
             self.inline_subject_beloning_constraint_region(op.beneficient, func.get_arg("evaluated_model"), cond, False)
@@ -285,141 +743,144 @@ class RewriteEventsPass(ModulePass):
             self.inline_subject_constraint_region(op.target, func.get_arg("target_model"), cond)
             rewriter.erase_op(op)
 
-def merge_preconditions(to_move: Block, target: Block, insert_first=True):
-    rewriter = Rewriter()
+def merge_preconditions(to_move: Block, target: Block, insert_first=True, rewriter=None):
+    rewriter = rewriter if rewriter is not None else Rewriter()
     for op in reversed(list(to_move.ops)[:-1]):
         op.detach()
-        target.insert_op_before(op, target.first_op if insert_first else target.last_op)
+        rewriter.insert_op(op, InsertPoint.before(target.first_op if insert_first else target.last_op))
 
     for arg1, arg2 in zip(to_move.args, target.args):
         arg1.replace_by(arg2)
 
     and_op = And.make(to_move.last_op.value, target.last_op.value)
-    target.insert_op_before(and_op, target.last_op)
+    rewriter.insert_op(and_op, InsertPoint.before(target.last_op))
     target.last_op.operands[0] = and_op.result
 
-class DropUselessOperations(ModulePass):
-    name = "drop-useless-operations-pass"
-
-    def apply(self, ctx: OpResult, module: ModuleOp):
-        rewriter = Rewriter()
-
-        # if thre is a belongs(subjectsIn(X)) just write belongsTo(x)
-        for op in visit(module, BelongsTo):
-            unit = op.rhs.owner
-            if isinstance(unit, SubjectsIn):
-                if unit.result.uses.get_length() == 1:
-                   unit.result.replace_by(unit.unit)
-                   rewriter.erase_op(unit)
-
-
-        # if there is a pure operation that returns a unit X, and that unit has two users, and those users are is_leading Y X and belongs_to Z X, then we can rewrite as X = leaded_unit Y, belongs_to Z X
-        for op in visit_traits(module, Pure):
-            op: Operation
-            if len(op.results) != 1 or not isinstance(op.result_types[0], UnitType):
-                continue
-
-            if op.results[0].uses.get_length() != 2:
-                continue
-            (belongs_to, leading) = op.results[0].uses
-            (belongs_to, leading) = (belongs_to.operation, leading.operation)
-            if not isinstance(belongs_to, BelongsTo):
-                (belongs_to, leading) = (leading, belongs_to)
-            if not isinstance(belongs_to, BelongsTo) or not isinstance(leading, Leading):
-                continue
-            leading: Leading
-            belongs_to: BelongsTo
-
-            leaded = LeadedUnit.make(leading.leader, UnitType())
-            op.results[0].replace_by(leaded.unit)
-            leading.result.replace_by(leaded.result)
-            rewriter.insert_op(leaded, InsertPoint.before(op))
-            rewriter.erase_op(leading)
-            rewriter.erase_op(op)
-
-
-
-        # if there is a Y = OneOf X followed by a IsSame Y Z, just replace them both with BelongsTo Z X
-        for op in visit(module, IsSame):
-            op: IsSame
-            if isinstance(op.rhs.owner, OneOf) and op.rhs.uses.get_length() == 1:
+# if thre is a belongs(subjectsIn(X)) just write belongsTo(x)
+class BelongsToSubjectsIn(RewritePattern):
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: BelongsTo, rewriter: AnalysisRewriter):
+        unit = op.rhs.owner
+        if isinstance(unit, SubjectsIn) and unit.result.uses.get_length() == 1:
+            rewriter.replace_all_uses_with(unit.result, unit.unit)
+            rewriter.erase_op(unit)
+
+# if there is a pure operation that returns a unit X, and that unit has two users, and those users are is_leading Y X and belongs_to Z X, then we can rewrite as X = leaded_unit Y, belongs_to Z X
+class LeadedUnitOfBelongsTo(RewritePattern):
+    def match_and_rewrite(self, op: Operation, rewriter: AnalysisRewriter):
+        if not op.has_trait(Pure) or len(op.results) != 1 or not isinstance(op.result_types[0], UnitType):
+            return
+        if op.results[0].uses.get_length() != 2:
+            return
+        (belongs_to, leading) = op.results[0].uses
+        (belongs_to, leading) = (belongs_to.operation, leading.operation)
+        if not isinstance(belongs_to, BelongsTo):
+            (belongs_to, leading) = (leading, belongs_to)
+        if not isinstance(belongs_to, BelongsTo) or not isinstance(leading, Leading):
+            return
+        leading: Leading
+        belongs_to: BelongsTo
+
+        leaded = LeadedUnit.make(leading.leader, UnitType())
+        rewriter.replace_all_uses_with(op.results[0], leaded.unit)
+        rewriter.replace_all_uses_with(leading.result, leaded.result)
+        rewriter.insert_op(leaded, InsertPoint.before(op))
+        rewriter.erase_op(leading)
+        rewriter.erase_op(op)
+
+# if there is a Y = OneOf X followed by a IsSame Y Z, just replace them both with BelongsTo Z X
+class IsSameOneOf(RewritePattern):
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: IsSame, rewriter: AnalysisRewriter):
+        for one_of, other in [(op.rhs, op.lhs), (op.lhs, op.rhs)]:
+            if isinstance(one_of.owner, OneOf) and one_of.uses.get_length() == 1:
                 any_of: OneOf
-                any_of = op.rhs.owner
+                any_of = one_of.owner
                 subject_list = any_of.base_subject.first_block.last_op.value
                 rewriter.erase_op(any_of.base_subject.first_block.last_op)
                 rewriter.inline_block(any_of.base_subject.first_block, InsertPoint.before(any_of))
-                belongs_to = BelongsTo.make(op.lhs, subject_list)
+                belongs_to = BelongsTo.make(other, subject_list)
                 rewriter.insert_op(belongs_to, InsertPoint.before(op))
-                op.result.replace_by(belongs_to.result)
+                rewriter.replace_all_uses_with(op.result, belongs_to.result)
                 rewriter.erase_op(op)
                 rewriter.erase_op(any_of)
+                return
+
+# if there is a BelongsTo(X, All()), replace with True
+class BelongsToAll(RewritePattern):
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: BelongsTo, rewriter: AnalysisRewriter):
+        unit = op.rhs.owner
+        if isinstance(unit, All) and unit.result.uses.get_length() == 1:
+            true_op = TrueOp.make()
+            rewriter.replace_all_uses_with(op.result, true_op.result)
+            rewriter.insert_op(true_op, InsertPoint.before(op))
+            rewriter.erase_op(op)
+            rewriter.erase_op(unit)
+
+# if there is a BelongsTo(X, FilterList(All(), constraint)), replace with the constraint of X
+class BelongsToFilteredAll(RewritePattern):
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: BelongsTo, rewriter: AnalysisRewriter):
+        unit = op.rhs.owner
+        unit: FilterList
+        if not isinstance(unit, FilterList) or not isinstance(unit.single_base_subject(), All):
+            return
+        if unit.result.uses.get_length() != 1:
+            return
+
+        rewriter.replace_all_uses_with(unit.constraint.first_block.args[0], op.model)
+        rewriter.replace_all_uses_with(op.result, unit.constraint.first_block.last_op.value[0])
+        rewriter.erase_op(unit.constraint.first_block.last_op)
+        rewriter.inline_block(unit.constraint.first_block, InsertPoint.before(op))
+        rewriter.erase_op(op)
+        rewriter.erase_op(unit)
+
+# if the condition of an if statement is just true, inline its true branch
+class IfTrue(RewritePattern):
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: IfStatement, rewriter: AnalysisRewriter):
+        if len(op.condition.first_block.ops) != 2:
+            return
+        yield_op = op.condition.first_block.last_op
+        if yield_op.value[0].owner != op.condition.first_block.first_op:
+            return
+        if isinstance(yield_op.value[0].owner, TrueOp):
+            rewriter.erase_op(op.true_branch.first_block.last_op)
+            rewriter.inline_block(op.true_branch.first_block, InsertPoint.before(op))
+            rewriter.erase_op(op)
 
-            if isinstance(op.lhs.owner, OneOf) and op.lhs.uses.get_length() == 1:
-                any_of: OneOf
-                any_of = op.lhs.owner
-                subject_list = any_of.base_subject.first_block.last_op.value
-                rewriter.erase_op(any_of.base_subject.first_block.last_op)
-                rewriter.inline_block(any_of.base_subject.first_block, InsertPoint.before(any_of))
-                belongs_to = BelongsTo.make(op.rhs, subject_list)
-                rewriter.insert_op(belongs_to, InsertPoint.before(op))
-                op.result.replace_by(belongs_to.result)
+# and(true, x) is just x, the true stays as long as something else uses it
+class AndTrue(RewritePattern):
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: And, rewriter: AnalysisRewriter):
+        for true_value, other in [(op.lhs, op.rhs), (op.rhs, op.lhs)]:
+            if isinstance(true_value.owner, TrueOp):
+                inner = true_value.owner
+                rewriter.replace_all_uses_with(op.result, other)
                 rewriter.erase_op(op)
-                rewriter.erase_op(any_of)
+                if inner.result.uses.get_length() == 0:
+                    rewriter.erase_op(inner)
+                return
 
-        # if there is a BelongsTo(X, All()), replace with True
-        for op in visit(module, BelongsTo):
-            unit = op.rhs.owner
-            if isinstance(unit, All):
-                if unit.result.uses.get_length() == 1:
-                   true_op = TrueOp.make()
-                   op.result.replace_by(true_op.result)
-                   rewriter.insert_op(true_op, InsertPoint.before(op))
-                   rewriter.erase_op(op)
-                   rewriter.erase_op(unit)
-
-        for op in visit(module, BelongsTo):
-            unit = op.rhs.owner
-            unit: FilterList
-            if isinstance(unit, FilterList) and isinstance(unit.single_base_subject(), All):
-                if unit.result.uses.get_length() != 1:
-                    continue
-
-                unit.constraint.first_block.args[0].replace_by(op.model)
-                op.result.replace_by(unit.constraint.first_block.last_op.value[0])
-                rewriter.erase_op(unit.constraint.first_block.last_op)
-                rewriter.inline_block(unit.constraint.first_block, InsertPoint.before(op))
-                rewriter.erase_op(op)
-                rewriter.erase_op(unit)
+DROP_USELESS_PATTERNS = [BelongsToSubjectsIn(), LeadedUnitOfBelongsTo(), IsSameOneOf(), BelongsToAll(), BelongsToFilteredAll(), IfTrue(), AndTrue()]
 
-        for op in visit(module, IfStatement):
-            op: IfStatement
-            if len(op.condition.first_block.ops) != 2:
-                continue
-            yield_op = op.condition.first_block.last_op
-            if yield_op.value[0].owner != op.condition.first_block.first_op:
-                continue
-            if isinstance(yield_op.value[0].owner, TrueOp):
-                rewriter.erase_op(op.true_branch.first_block.last_op)
-                rewriter.inline_block(op.true_branch.first_block, InsertPoint.before(op))
-                rewriter.erase_op(op)
+# the simplifications that one of them enables for another are applied by the same run, the
+# applications of every pattern and the rounds it took are kept in stats
+class DropUselessOperations(ModulePass):
+    name = "drop-useless-operations-pass"
+    maintains_op_index = True
 
-        for op in visit(module, And):
-            if isinstance(op.lhs.op, TrueOp):
-                op.result.replace_by(op.rhs)
-                inner = op.lhs.op
-                rewriter.erase_op(op)
-                rewriter.erase_op(inner)
-                continue
-            if isinstance(op.rhs.op, TrueOp):
-                op.result.replace_by(op.lhs)
-                inner = op.rhs.op
-                rewriter.erase_op(op)
-                rewriter.erase_op(inner)
+    def apply(self, ctx: OpResult, module: ModuleOp):
+        driver = GreedyRewriteDriver(DROP_USELESS_PATTERNS, op_index(module))
+        driver.rewrite(module)
+        self.stats = driver.stats()
 
 
 
 class FlattenConditionalsPass(ModulePass):
     name = "flatten-conditionals-pass"
+    maintains_op_index = True
 
     # if a conditional effect has multiple prencoditionalble effects, we are going to split the conditional effect into multiple copies, each that contains one of the preconditionable effects.
     def split_conditional_effects(self, writer: Rewriter, module: ModuleOp):
@@ -440,14 +901,14 @@ class FlattenConditionalsPass(ModulePass):
 
 
     def apply(self, ctx: Context, module: ModuleOp):
-        rewriter = Rewriter()
+        rewriter = AnalysisRewriter(op_index(module))
 
         self.split_conditional_effects(rewriter, module)
 
         # if a conditional effect has only one conditional child, inline the conditional effect in the child
         for op in visit(module, ConditionalEffect):
             if len(op.effect.first_block.ops) == 2 and op.effect.first_block.first_op.has_trait(HasPreconditions):
-                merge_preconditions(op.condition.first_block, op.effect.first_block.first_op.condition.first_block)
+                merge_preconditions(op.condition.first_block, op.effect.first_block.first_op.condition.first_block, rewriter=rewriter)
                 rewriter.erase_op(op.effect.first_block.last_op)
                 rewriter.inline_block(op.effect.first_block, InsertPoint.before(op))
                 rewriter.erase_op(op)
@@ -457,21 +918,21 @@ class FlattenConditionalsPass(ModulePass):
             parent = op.parent_op()
             parent: HasPreconditions
             if parent.has_trait(HasPreconditions) and len(parent.effect.first_block.ops) == 2 and parent.effect.first_block.first_op == op:
-                merge_preconditions(op.condition.first_block, parent.condition.first_block, insert_first=False)
+                merge_preconditions(op.condition.first_block, parent.condition.first_block, insert_first=False, rewriter=rewriter)
                 rewriter.erase_op(op.effect.first_block.last_op)
                 rewriter.inline_block(op.effect.first_block, InsertPoint.before(op))
                 rewriter.erase_op(op)
 
 class ResolveAbsoluteReferencesPass(ModulePass):
     name = "resolve-absolute-references-pass"
+    maintains_op_index = True
 
     def apply(self, ctx: Context, module: ModuleOp):
-        rewriter = Rewriter()
+        ancestors = AncestorAnalysis(module)
+        rewriter = AnalysisRewriter(ancestors, op_index(module))
         for op in visit(module, ThisSubject):
             parent: RLCFunction
-            parent = op.parent_op()
-            while parent and not isinstance(parent, RLCFunction):
-                parent = parent.parent_op()
+            parent = find_parent_of_type(op, RLCFunction, ancestors)
             if not parent:
                 continue
             if isinstance(op.result.type, ModelType):
@@ -508,13 +969,18 @@ class ReplaceUnboundedSubjectsWithLoops(ModulePass):
 
 class OptimizeFilteringPass(ModulePass):
     name = "optimize-filtering-pass"
+    maintains_op_index = True
 
     def apply(self, ctx: Context, module: ModuleOp):
-        rewriter = Rewriter()
+        rewriter = AnalysisRewriter(op_index(module))
 
         for op in visit_traits(module, CanDefineOperand):
-            if isinstance(op.get_optionally_defined_operand().owner, All):
+            operand_op = op.get_optionally_defined_operand().owner
+            if isinstance(operand_op, All):
                 op.replace_with_operand_defining_op(rewriter)
+                # both are detached by the operation itself
+                rewriter.ops_removed(op)
+                rewriter.ops_removed(operand_op)
 
         for op in visit(module, FilterList):
             subject = op.single_base_subject()
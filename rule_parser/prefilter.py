@@ -0,0 +1,108 @@
+from lark import Token, UnexpectedCharacters
+from .grammar import GRAMMAR_PATH, get_lalr_parser, get_parser
+from .lexicon import LEXICON_CATEGORIES, get_lexicon, lexicon_path_for, terminal_name
+from .normalize import text_location
+import os
+import re
+
+# words, numbers and single symbols, the same way for the rule text and for the grammar literals,
+# so that "1CP" is "1" "CP" on both sides
+TOKEN = re.compile(r"[^\W\d_]+|\d+|[^\w\s]|_")
+
+class Rejection:
+    def __init__(self, kind: str, token: str, position: int):
+        self.kind = kind
+        self.token = token
+        self.position = position
+
+    @property
+    def reason(self):
+        return f"{self.kind} {self.token!r}"
+
+    def __repr__(self):
+        return f"Rejection({self.kind!r}, {self.token!r}, {self.position})"
+
+# raised instead of the error of a parse that was never attempted. It is the UnexpectedCharacters
+# the lexer would raise at the rejected token, with nothing allowed there, so that callers handling
+# parse errors handle rejections too and lark's helpers such as get_context work on it
+class RejectedText(UnexpectedCharacters):
+    def __init__(self, rejection: Rejection, text: str):
+        (line, column) = text_location(text, rejection.position)
+        super().__init__(text, rejection.position, line, column, allowed=set())
+        # lark's initializer drops the arguments, they are what pickle rebuilds the error from
+        self.args = (rejection, text)
+        self.rejection = rejection
+        self.token = Token("REJECTED", rejection.token, rejection.position, line, column)
+
+    def __str__(self):
+        return f"{self.rejection.reason} at line {self.line} col {self.column} is not in the grammar"
+
+# A sentence can only parse if every one of its tokens is either part of some literal of the grammar
+# or matched by its regex terminals. Checking that costs a set lookup per token, against a chart
+# per sentence for the parser, and never rejects text the grammar accepts: case is ignored and a
+# literal only has to contain the token somewhere.
+class Prefilter:
+    def __init__(self, terminals, phrases=()):
+        self.words = set()
+        self.patterns = []
+        for terminal in terminals:
+            if terminal.pattern.type == "str":
+                self.add_phrase(terminal.pattern.value)
+            else:
+                self.patterns.append(re.compile(terminal.pattern.to_regexp()))
+        for phrase in phrases:
+            self.add_phrase(phrase)
+        self.matched = {}
+
+    def add_phrase(self, phrase: str):
+        self.words.update(token.lower() for token in TOKEN.findall(phrase))
+
+    # tokens such as "12" are made of several regex matches, DIGIT DIGIT
+    def covered_by_patterns(self, token: str):
+        covered = self.matched.get(token)
+        if covered is not None:
+            return covered
+        position = 0
+        while position < len(token):
+            end = max((match.end() for match in (pattern.match(token, position) for pattern in self.patterns) if match is not None), default=position)
+            if end == position:
+                break
+            position = end
+        covered = position == len(token)
+        self.matched[token] = covered
+        return covered
+
+    def check(self, text: str):
+        for match in TOKEN.finditer(text):
+            token = match.group()
+            if token.lower() in self.words or self.covered_by_patterns(token):
+                continue
+            kind = "unknown word" if token[0].isalnum() else "unknown symbol"
+            return Rejection(kind, token, match.start())
+        return None
+
+    def reject(self, text: str):
+        rejection = self.check(text)
+        if rejection is not None:
+            raise RejectedText(rejection, text)
+
+# the lexicon terminals are tries over whole phrases, their words are added one by one
+def lexicon_phrases(grammar_path: str, terminals):
+    lexicon_path = lexicon_path_for(grammar_path)
+    if not os.path.exists(lexicon_path):
+        return []
+    names = {terminal.name for terminal in terminals}
+    lexicon = get_lexicon(lexicon_path)
+    return [phrase for category in LEXICON_CATEGORIES if terminal_name(category) in names for phrase in lexicon.categories[category]]
+
+prefilters = {}
+
+# both parsers are compiled from the same grammar and have the same terminals, the prefilter is
+# built from the one the parse is going to load anyway
+def get_prefilter(grammar_path: str = GRAMMAR_PATH, fast_path=False):
+    parser = get_lalr_parser(grammar_path) if fast_path else get_parser(grammar_path, parser="earley")
+    cached = prefilters.get((grammar_path, fast_path))
+    if cached is None or cached[0] is not parser:
+        cached = (parser, Prefilter(parser.terminals, lexicon_phrases(grammar_path, parser.terminals)))
+        prefilters[(grammar_path, fast_path)] = cached
+    return cached[1]
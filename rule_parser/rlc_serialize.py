@@ -2,6 +2,9 @@ from .dialect import *
 from functools import singledispatchmethod
 
 class RLCSerializer(ModulePass):
+    name = "rlc-serializer"
+    maintains_op_index = True
+
     def __init__(self, out):
         self.out = out
         self.value_to_var_name = {}
@@ -107,6 +110,11 @@ class RLCSerializer(ModulePass):
         self.println(f")")
 
 
+    @visit.register
+    def _(self, cond: UnsupportedSentence):
+        self.println(f"# unsupported: {' '.join(cond.text.data.split())}")
+        self.println(f"#   {cond.reason.data}")
+
     @visit.register
     def _(self, cond: GainCP):
         self.print("gain_cp(")
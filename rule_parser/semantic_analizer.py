@@ -1,6 +1,6 @@
 from .dialect import *
 from functools import singledispatchmethod
-from .passes import dominates, visit
+from .passes import AncestorAnalysis, AnalysisRewriter, dominates, visit
 from .passes import merge_preconditions, move_region_content
 
 def compare_filters(container1, lhs: SSAValue, container2, rhs: SSAValue):
@@ -43,6 +43,65 @@ def refers_to(subject: Operation, candidate: Operation):
 def one_of_refers_to(subject: OneOf, candidate):
     return refers_to( subject.base_subject.first_block.first_op, candidate.base_subject.first_block.first_op)
 
+# the shape of the subject an operation defines, which is all refers_to looks at besides filters
+def subject_shape(op: Operation):
+    if isinstance(op, All):
+        return ("all", op.result.type)
+    if isinstance(op, OneOf):
+        return ("one_of", subject_shape(op.base_subject.first_block.first_op))
+    if isinstance(op, FilterList):
+        return ("filter_list", subject_shape(op.base_subject.first_block.first_op))
+    return (op.name, ) if op is not None else None
+
+# the shapes of the candidates refers_to can accept for subject
+def referred_shapes(subject: Operation):
+    shapes = [("all", subject.result.type)]
+    if isinstance(subject, OneOf):
+        shapes += [("one_of", shape) for shape in referred_shapes(subject.base_subject.first_block.first_op)]
+    if isinstance(subject, FilterList):
+        shapes += [("filter_list", shape) for shape in referred_shapes(subject.base_subject.first_block.first_op)]
+    return shapes
+
+# The referrable subjects seen so far, indexed by type for such subjects and by shape for
+# constrained such subjects. A reference resolves to the latest subject it can refer to, a lookup
+# only looks at the latest entries of the shapes the reference accepts, instead of every subject
+# seen before it. The candidates of a shape still go through refers_to, which also compares filters.
+class SubjectTable:
+    def __init__(self):
+        self.subjects = []
+        self.by_type = {}
+        self.by_shape = {}
+
+    def add(self, subject: SSAValue):
+        self.subjects.append(subject)
+        self.by_type.setdefault(subject.type, []).append(subject)
+        shape = subject_shape(subject.owner) if isinstance(subject.owner, Operation) else None
+        self.by_shape.setdefault(shape, []).append((len(self.subjects) - 1, subject))
+
+    def last(self):
+        return self.subjects[-1]
+
+    def last_of_type(self, type: Attribute):
+        subjects = self.by_type.get(type)
+        return subjects[-1] if subjects else None
+
+    # the shapes whose latest subject is the most recent are looked at first, so that the others
+    # are skipped once a subject more recent than all of their entries is found
+    def referred_by(self, subject: Operation):
+        candidates = [self.by_shape[shape] for shape in referred_shapes(subject) if shape in self.by_shape]
+        found = None
+        for entries in sorted(candidates, key=lambda entries: -entries[-1][0]):
+            for position, candidate in reversed(entries):
+                if found is not None and position < found[0]:
+                    break
+                if refers_to(subject, candidate.owner):
+                    found = (position, candidate)
+                    break
+        return found[1] if found is not None else None
+
+    def __repr__(self):
+        return repr(self.subjects)
+
 class SemanticalAnalyzer(ModulePass):
     name = "semantical-analyze-pass"
 
@@ -56,6 +115,8 @@ class SemanticalAnalyzer(ModulePass):
 
     def apply(self, ctx: Context, module: ModuleOp):
         self.builder = Builder(InsertPoint.at_start(module.body.first_block))
+        self.ancestors = AncestorAnalysis(module)
+        self.rewriter = AnalysisRewriter(self.ancestors)
         self.analyze_subjects(module)
 
         self.visit(module)
@@ -64,7 +125,8 @@ class SemanticalAnalyzer(ModulePass):
         super().__init__()
         self.builder = None
         self.rewriter = Rewriter()
-        self.seen_subjects = []
+        self.ancestors = None
+        self.seen_subjects = SubjectTable()
         self.last_optionally_usable = None
 
     def add(self, operation):
@@ -113,6 +175,10 @@ class SemanticalAnalyzer(ModulePass):
     def _(self, cond: ModifyRoll):
         pass
 
+    @_visit.register
+    def _(self, op: UnsupportedSentence):
+        pass
+
     @_visit.register
     def _(self, cond: And):
         pass
@@ -165,7 +231,7 @@ class SemanticalAnalyzer(ModulePass):
 
     @_visit.register
     def _(self, cond: ItSubject):
-        cond.result.replace_by(self.seen_subjects[-1])
+        cond.result.replace_by(self.seen_subjects.last())
         self.rewriter.erase_op(cond)
 
 
@@ -176,16 +242,16 @@ class SemanticalAnalyzer(ModulePass):
         self.rewriter.replace_value_with_new_type(cond.result, cond.body.first_block.last_op.result.type)
         # we are going to assume that inside this guy there is always a OneOf FilterList
         subject = cond.body.first_block.first_op
-        for candidate in reversed(self.seen_subjects):
-            if refers_to(subject, candidate.owner):
-                if dominates(candidate.owner, cond):
-                    cond.result.replace_by(candidate)
-                else:
-                    caputured_reference = CapturedReference.make(candidate)
-                    cond.result.replace_by(caputured_reference.result)
-                    self.rewriter.insert_op(caputured_reference, InsertPoint.before(cond))
-                self.rewriter.erase_op(cond)
-                return
+        candidate = self.seen_subjects.referred_by(subject)
+        if candidate is not None:
+            if dominates(candidate.owner, cond, self.ancestors):
+                cond.result.replace_by(candidate)
+            else:
+                caputured_reference = CapturedReference.make(candidate)
+                cond.result.replace_by(caputured_reference.result)
+                self.rewriter.insert_op(caputured_reference, InsertPoint.before(cond))
+            self.rewriter.erase_op(cond)
+            return
 
         print("could not find referred candidate")
         print(self)
@@ -264,7 +330,7 @@ class SemanticalAnalyzer(ModulePass):
     @_visit.register
     def _(self, cond: MakeReferrable):
         if not isinstance(cond.subject, SuchSubject):
-            self.seen_subjects.append(cond.subject)
+            self.seen_subjects.add(cond.subject)
         self.rewriter.erase_op(cond)
 
     @_visit.register
@@ -283,6 +349,7 @@ class SemanticalAnalyzer(ModulePass):
         block = cond.effect.first_block
         cond.effect.detach_block(cond.effect.first_block)
         self.last_optionally_usable.effect.add_block(block)
+        self.rewriter.notify_moved(block)
         self.rewriter.erase_op(cond)
         for op in list(self.last_optionally_usable.effect.ops):
             self.visit(op)
@@ -357,11 +424,9 @@ class SemanticalAnalyzer(ModulePass):
     @_visit.register
     def _(self, ref: SuchSubject):
         sub: SSAValue
-        for sub in reversed(self.seen_subjects):
-            if ref.result.type != sub.type:
-                continue
-
-            if dominates(sub.owner, ref):
+        sub = self.seen_subjects.last_of_type(ref.result.type)
+        if sub is not None:
+            if dominates(sub.owner, ref, self.ancestors):
                 ref.result.replace_by(sub)
             else:
                 caputured_reference = CapturedReference.make(sub)
@@ -370,7 +435,7 @@ class SemanticalAnalyzer(ModulePass):
             self.rewriter.erase_op(ref)
 
             return
-        for op in self.seen_subjects:
+        for op in self.seen_subjects.subjects:
             print(op.owner)
         print(ref)
         raise NotImplementedError()
@@ -410,7 +475,7 @@ class SemanticalAnalyzer(ModulePass):
         if isinstance(base_subject, FilterList):
             base_subject.detach()
             self.rewriter.insert_op(base_subject, InsertPoint.before(ref))
-            merge_preconditions(ref.constraint.first_block, base_subject.constraint.first_block)
+            merge_preconditions(ref.constraint.first_block, base_subject.constraint.first_block, rewriter=self.rewriter)
             ref.result.replace_by(base_subject.result)
             self.rewriter.erase_op(ref)
             return
@@ -0,0 +1,159 @@
+from lark import Token, Tree, UnexpectedInput
+from .budget import ParseBudgetExceeded, ParseMeter, metered
+from .grammar import get_fast_path_parser, get_parser
+from .normalize import NormalizedText, normalize_text
+from .prefilter import Rejection, RejectedText, get_prefilter
+from .to_ast import InlineToAst
+
+class Sentence:
+    def __init__(self, text: str, start: int):
+        self.text = text
+        self.start = start
+
+    def __repr__(self):
+        return f"Sentence({self.start}, {self.text!r})"
+
+# splits ability text after every top level DOT, that is every dot that is not inside brackets,
+# each sentence keeps its dot so that it is still a valid effect_seq on its own.
+def split_sentences(text: str):
+    sentences = []
+    depth = 0
+    start = 0
+    for index, char in enumerate(text):
+        if char in "[(":
+            depth = depth + 1
+        elif char in "])":
+            depth = max(depth - 1, 0)
+        elif char == "." and depth == 0:
+            sentences.append(Sentence(text[start:index + 1], start))
+            start = index + 1
+
+    if text[start:].strip() != "":
+        sentences.append(Sentence(text[start:], start))
+    return [sentence for sentence in sentences if sentence.text.strip() != ""]
+
+inline_transformer = None
+
+def get_inline_transformer():
+    global inline_transformer
+    if inline_transformer is None:
+        inline_transformer = InlineToAst()
+    return inline_transformer
+
+# text is normalized, see normalize_text. With inline, the sentences the LALR fast path accepts come back with their leaves already
+# lowered, see InlineToAst
+def parse_sentence_text(text: str, fast_path=True, inline=False):
+    if not fast_path:
+        return get_parser(parser="earley").parse(text)
+    return get_fast_path_parser(transformer=get_inline_transformer() if inline else None).parse(text)
+
+# returns the tree and the meter of the parse, raises ParseBudgetExceeded once the sentence goes
+# over the budget. Sentences the LALR fast path accepts never reach the earley chart.
+def parse_sentence_metered(text: str, fast_path=True, budget=None, inline=False):
+    with metered(ParseMeter(budget)) as meter:
+        tree = parse_sentence_text(text, fast_path, inline)
+    return tree, meter
+
+# errors are raised with positions relative to the normalized sentence, move them back onto the
+# original text
+def relocate_error(error: UnexpectedInput, sentence: Sentence, normalized: NormalizedText):
+    return normalized.relocate(error, sentence.start)
+
+# the prefilter checks the normalized text, or only one of its sentences, and reports the word as
+# it is in the original
+def reject_text(normalized: NormalizedText, fast_path=True, sentence: Sentence = None):
+    (text, start) = (normalized.text, 0) if sentence is None else (sentence.text, sentence.start)
+    rejection = get_prefilter(fast_path=fast_path).check(text)
+    if rejection is not None:
+        position = start + rejection.position
+        token = normalized.original_text(position, position + len(rejection.token))
+        raise RejectedText(Rejection(rejection.kind, token, normalized.original_position(position)), normalized.original)
+
+# first line of the error, parse errors go on to list every expected terminal
+def describe_error(error: Exception):
+    lines = str(error).strip().splitlines()
+    return f"{type(error).__name__}: {lines[0]}" if lines else type(error).__name__
+
+# the original text of a sentence of the normalized text
+def original_sentence_text(sentence: Sentence, normalized: NormalizedText):
+    return normalized.original_text(sentence.start, sentence.start + len(sentence.text)).strip()
+
+# stands for a sentence that a partial parse left out, ToAst lowers it to an UnsupportedSentence
+def unsupported_sentence_tree(text: str, reason: str):
+    return Tree("start", [Tree("effect_seq", [Tree("unsupported_sentence", [text, reason]), Token("DOT", ".")])])
+
+# a partial parse never raises for a single sentence, the sentences the prefilter rejects, that do
+# not parse or that go over the budget become unsupported_sentence_tree and their stats record why
+def parse_sentences_partially(normalized: NormalizedText, sentences, parse_sentence, fast_path, prefilter, stats):
+    trees = []
+    for sentence in sentences:
+        chart_items = 0
+        seconds = 0.0
+        try:
+            if prefilter:
+                reject_text(normalized, fast_path, sentence)
+            tree, meter = parse_sentence(sentence)
+            trees.append(tree)
+            if stats is not None:
+                stats.append({"position": normalized.original_position(sentence.start), "chart_items": meter.chart_items, "seconds": meter.seconds})
+            continue
+        except RejectedText as e:
+            error = e
+        except UnexpectedInput as e:
+            error = relocate_error(e, sentence, normalized)
+        except ParseBudgetExceeded as e:
+            e.position = normalized.original_position(sentence.start)
+            (error, chart_items, seconds) = (e, e.chart_items, e.seconds)
+        trees.append(unsupported_sentence_tree(original_sentence_text(sentence, normalized), describe_error(error)))
+        if stats is not None:
+            stats.append({"position": normalized.original_position(sentence.start), "chart_items": chart_items, "seconds": seconds, "unsupported": describe_error(error)})
+    return trees
+
+# text the prefilter rejects raises RejectedText without building any chart. When stats is a list,
+# it receives the chart size and parse time of every sentence. Without an executor, sentence_cache
+# is an optional object whose parse method stands in for parse_sentence_metered, such as a
+# TemplateCache. Errors and positions refer to text, the sentences are parsed normalized. With
+# partial, see parse_sentences_partially, the sentences are parsed one by one without the executor.
+def parse_sentences(text: str, fast_path=True, executor=None, prefilter=True, budget=None, stats=None, inline=False, sentence_cache=None, partial=False):
+    normalized = normalize_text(text)
+    sentences = split_sentences(normalized.text)
+    if partial:
+        def parse_sentence(sentence):
+            if sentence_cache is not None:
+                return sentence_cache.parse(sentence.text, fast_path, budget, inline)
+            return parse_sentence_metered(sentence.text, fast_path, budget, inline)
+        return parse_sentences_partially(normalized, sentences, parse_sentence, fast_path, prefilter, stats)
+
+    if prefilter:
+        reject_text(normalized, fast_path)
+    if executor is None and sentence_cache is not None:
+        results = (sentence_cache.parse(sentence.text, fast_path, budget, inline) for sentence in sentences)
+    elif executor is None:
+        results = (parse_sentence_metered(sentence.text, fast_path, budget, inline) for sentence in sentences)
+    else:
+        results = executor.map(parse_sentence_metered, [sentence.text for sentence in sentences], [fast_path] * len(sentences), [budget] * len(sentences), [inline] * len(sentences))
+
+    trees = []
+    iterator = iter(results)
+    for sentence in sentences:
+        try:
+            tree, meter = next(iterator)
+        except UnexpectedInput as e:
+            raise relocate_error(e, sentence, normalized)
+        except ParseBudgetExceeded as e:
+            e.position = normalized.original_position(sentence.start)
+            raise
+        trees.append(tree)
+        if stats is not None:
+            stats.append({"position": normalized.original_position(sentence.start), "chart_items": meter.chart_items, "seconds": meter.seconds})
+    return trees
+
+# every sentence parses as start(effect_seq(effect, DOT)), concatenating the effect_seq children
+# gives back the tree of the whole paragraph, so a single ToAst walk still numbers referrable
+# subjects across sentence boundaries.
+def join_sentence_trees(trees):
+    children = []
+    for tree in trees:
+        (effect_seq, ) = tree.children
+        children.extend(effect_seq.children)
+    return Tree("start", [Tree("effect_seq", children)])
@@ -0,0 +1,83 @@
+from lark import Tree, UnexpectedInput
+from xdsl.dialects.builtin import ModuleOp
+from xdsl.ir import Block, Region
+from .budget import ParseBudget, ParseBudgetExceeded
+from .driver import make_context, run_pipeline
+from .normalize import normalize_text
+from .sentences import parse_sentence_metered, reject_text, relocate_error, split_sentences
+from .to_ast import ToAst
+import io
+
+# lowers the tree of a single sentence, numbering its referrable subjects from first_index on
+def lower_sentence(tree: Tree, first_index: int):
+    transformer = ToAst()
+    transformer.subject_index = first_index
+    fragment = transformer.visit(Tree("start", [tree.children[0]]))
+    return fragment, transformer.subject_index
+
+# Compiles successive versions of the same ability text, such as the buffer of an editor that
+# recompiles on every keystroke. The parse tree of every sentence and its lowered IR are kept from
+# one version to the next, so an edit only parses the sentences it changed and only lowers those
+# whose text or first subject index changed. The passes still run over the whole module, since
+# they resolve references across sentences.
+class CompileSession:
+    def __init__(self, args, ctx=None, budget: ParseBudget = None):
+        self.args = args
+        self.ctx = ctx if ctx is not None else make_context()
+        self.budget = budget if budget is not None else ParseBudget.from_args(args)
+        self.trees = {}
+        self.fragments = {}
+        self.parsed = 0
+        self.lowered = 0
+
+    # sentences are keyed without their surrounding whitespace, which the grammar ignores
+    def tree(self, sentence, normalized):
+        tree = self.trees.get(sentence.text.strip())
+        if tree is None:
+            try:
+                tree, _ = parse_sentence_metered(sentence.text, not self.args.earley, self.budget, self.args.inline_lowering)
+            except UnexpectedInput as e:
+                raise relocate_error(e, sentence, normalized)
+            except ParseBudgetExceeded as e:
+                e.position = normalized.original_position(sentence.start)
+                raise
+            self.parsed = self.parsed + 1
+        return tree
+
+    def fragment(self, sentence, tree: Tree, first_index: int):
+        fragment = self.fragments.get((sentence.text.strip(), first_index))
+        if fragment is None:
+            fragment = lower_sentence(tree, first_index)
+            self.lowered = self.lowered + 1
+        return fragment
+
+    # returns the output of the pipeline selected by args, like compile_text
+    def compile(self, text: str) -> str:
+        self.parsed = 0
+        self.lowered = 0
+        normalized = normalize_text(text)
+        reject_text(normalized, not self.args.earley)
+
+        trees = {}
+        fragments = {}
+        module = ModuleOp(Region(Block()))
+        next_index = 0
+        for sentence in split_sentences(normalized.text):
+            tree = self.tree(sentence, normalized)
+            trees[sentence.text.strip()] = tree
+            fragment, last_index = self.fragment(sentence, tree, next_index)
+            fragments[(sentence.text.strip(), next_index)] = (fragment, last_index)
+            next_index = last_index
+
+            # the passes rewrite the module in place, it gets a copy of the cached fragment
+            for op in list(fragment.clone().body.block.ops):
+                op.detach()
+                module.body.block.add_op(op)
+
+        # only the sentences of the latest version are kept
+        self.trees = trees
+        self.fragments = fragments
+
+        out = io.StringIO()
+        run_pipeline(module, self.args, out, self.ctx)
+        return out.getvalue()
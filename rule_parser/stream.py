@@ -0,0 +1,56 @@
+from .budget import ParseBudget, ParseBudgetExceeded
+from .driver import compile_partial, describe_error, parse, run_pipeline, make_context
+from .pass_timing import PassTimer
+from .templates import TemplateCache
+import io
+import json
+import time
+
+# compiles a single jsonl record, {"id": any, "text": str}, into a result record. Records without
+# an id are identified by their line number. With --timing, the result holds the record of every
+# pass under "passes", see PassTimer.
+def compile_record(line: str, line_number: int, args, ctx, templates=None):
+    start = time.perf_counter()
+    result = {"id": line_number}
+    timings = {}
+    stats = []
+    timer = PassTimer() if getattr(args, "timing", False) else None
+    try:
+        record = json.loads(line)
+        result["id"] = record.get("id", line_number)
+        if args.partial:
+            # the parse and the passes of a partial compilation are not timed apart
+            result["output"] = compile_partial(record["text"], args, ctx, stats, templates, timer)
+            result["unsupported"] = [sentence["unsupported"] for sentence in stats if "unsupported" in sentence]
+        else:
+            ast = parse(record["text"], fast_path=not args.earley, budget=ParseBudget.from_args(args), stats=stats, inline=args.inline_lowering, sentence_cache=templates)
+            timings["parse"] = time.perf_counter() - start
+
+            out = io.StringIO()
+            run_pipeline(ast, args, out, ctx, timer)
+            timings["pipeline"] = time.perf_counter() - start - timings["parse"]
+            result["output"] = out.getvalue()
+        result["error"] = None
+    except Exception as e:
+        result["output"] = None
+        result["error"] = describe_error(e)
+        if isinstance(e, ParseBudgetExceeded):
+            result["budget_exceeded"] = e.to_record()
+    result["chart_items"] = [sentence["chart_items"] for sentence in stats]
+    timings["total"] = time.perf_counter() - start
+    result["timings"] = timings
+    if timer is not None:
+        result["passes"] = timer.records
+    return result
+
+# one rule per input line, one result per output line, written as soon as the rule is compiled.
+# Nothing but the bounded template cache is kept across records, so memory does not grow with the
+# length of the stream.
+def compile_jsonl_stream(lines, out, args, ctx=None):
+    ctx = ctx if ctx is not None else make_context()
+    templates = TemplateCache() if args.template_cache else None
+    for line_number, line in enumerate(lines, start=1):
+        if line.strip() == "":
+            continue
+        out.write(json.dumps(compile_record(line, line_number, args, ctx, templates)) + "\n")
+        out.flush()
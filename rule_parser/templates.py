@@ -0,0 +1,146 @@
+from lark import Tree
+from .budget import ParseMeter
+from .grammar import GRAMMAR_PATH, get_parser, grammar_signature
+from .lexicon import build_trie, get_lexicon, lexicon_path_for, normalize_phrase, trie_pattern
+from .sentences import get_inline_transformer, parse_sentence_metered
+import copy
+import os
+import re
+
+# the parts of a sentence that are abstracted into slots, every other character of the sentence is
+# part of its template
+NUMBER_SLOT = "number"
+SLOT_CATEGORIES = ["model_keyword", "unit_name"]
+
+DEFAULT_MAX_TEMPLATES = 4096
+
+# the trees of the slots, in the order of the text
+def slot_nodes(tree: Tree, path=()):
+    for index, child in enumerate(tree.children):
+        if not isinstance(child, Tree):
+            continue
+        if child.data == NUMBER_SLOT or child.data in SLOT_CATEGORIES:
+            yield path + (index, ), child
+        else:
+            yield from slot_nodes(child, path + (index, ))
+
+def slot_lengths(slots):
+    return tuple(len(value) for (_, value) in slots)
+
+def slot_matches(node: Tree, kind: str, value: str):
+    if kind == NUMBER_SLOT:
+        return node.data == NUMBER_SLOT and "".join(node.children) == value
+    return node.data == kind and len(node.children) == 1 and normalize_phrase(node.children[0]) == normalize_phrase(value)
+
+# the earley parser ranks ambiguous derivations by the length of what they span, see
+# disambiguate.py, so a tree it chose holds only for slots of the lengths it was parsed with. A
+# tree of the LALR table holds for any slot values, lengths is None
+class Template:
+    def __init__(self, tree: Tree, paths, lengths=None):
+        self.tree = tree
+        self.paths = paths
+        self.lengths = lengths
+
+    def matches(self, slots):
+        return self.lengths is None or self.lengths == slot_lengths(slots)
+
+    # the tree of another sentence of the template, with its own slot values
+    def instantiate(self, slots):
+        tree = copy.deepcopy(self.tree)
+        for path, (kind, value) in zip(self.paths, slots):
+            node = tree
+            for index in path:
+                node = node.children[index]
+            if kind == NUMBER_SLOT:
+                node.children = [node.children[0].update(value=digit) for digit in value]
+            else:
+                node.children = [node.children[0].update(value=value)]
+        return tree
+
+# Sentences that only differ in their numbers, model keywords and unit names share a template.
+# The first sentence of a template is parsed and its tree kept, the following ones get a copy of
+# that tree with their own slot values instead of a parse. Lowering still walks the whole tree,
+# since the subject indices depend on the rest of the paragraph.
+#
+# A template whose tree does not hold exactly its slots, in the order of the text, is never
+# instantiated and its sentences are always parsed. Lexicon phrases that the grammar also spells
+# out are not abstracted, the parse of such a sentence may depend on which of the two it is.
+# Sentences that needed the earley parser are parsed again when their slots are of other lengths.
+#
+# The templates hold plain trees, with inline the trees given out are lowered by InlineToAst
+# after they are parsed or instantiated.
+class TemplateCache:
+    def __init__(self, grammar_path: str = GRAMMAR_PATH, max_templates: int = DEFAULT_MAX_TEMPLATES):
+        self.grammar_path = grammar_path
+        self.max_templates = max_templates
+        self.signature = None
+        self.slot_pattern = None
+        self.templates = {}
+        self.hits = 0
+        self.misses = 0
+
+    def build_slot_pattern(self):
+        literals = [terminal.pattern.value.lower() for terminal in get_parser(self.grammar_path, parser="earley").terminals if terminal.pattern.type == "str"]
+        alternatives = []
+        lexicon_path = lexicon_path_for(self.grammar_path)
+        lexicon = get_lexicon(lexicon_path) if os.path.exists(lexicon_path) else None
+        for category in SLOT_CATEGORIES:
+            phrases = [] if lexicon is None else [phrase for phrase in lexicon.categories[category] if not any(re.search(rf"(?<![a-z0-9]){re.escape(phrase)}(?![a-z0-9])", literal) for literal in literals)]
+            if len(phrases) != 0:
+                alternatives.append(f"(?<![a-z0-9])(?P<{category}>{trie_pattern(build_trie(phrases))})(?![a-z0-9])")
+        alternatives.append(f"(?P<{NUMBER_SLOT}>[0-9]+)")
+        return re.compile("|".join(alternatives), re.IGNORECASE)
+
+    # the slot pattern follows the grammar and the lexicon, the templates are dropped when they change
+    def refresh(self):
+        signature = grammar_signature(self.grammar_path)
+        if signature != self.signature:
+            self.slot_pattern = self.build_slot_pattern()
+            self.templates = {}
+            self.signature = signature
+
+    # the text with every slot replaced by its kind, and the kind and text of the slots
+    def abstract(self, text: str):
+        parts = []
+        slots = []
+        last = 0
+        for match in self.slot_pattern.finditer(text):
+            parts.append(text[last:match.start()])
+            parts.append(f"\0{match.lastgroup}\0")
+            slots.append((match.lastgroup, match.group()))
+            last = match.end()
+        parts.append(text[last:])
+        return "".join(parts), slots
+
+    # a sentence that built an earley chart was not parsed by the LALR table alone
+    def learn(self, tree: Tree, slots, meter: ParseMeter):
+        nodes = list(slot_nodes(tree))
+        if len(nodes) != len(slots) or not all(slot_matches(node, kind, value) for (_, node), (kind, value) in zip(nodes, slots)):
+            return None
+        return Template(tree, [path for path, _ in nodes], slot_lengths(slots) if meter.chart_items != 0 else None)
+
+    # same result as parse_sentence_metered, the meter of an instantiated sentence is empty
+    def parse(self, text: str, fast_path=True, budget=None, inline=False):
+        self.refresh()
+        key, slots = self.abstract(text.strip())
+        key = (key, fast_path)
+        template = self.templates.get(key)
+        if template is not None and template.matches(slots):
+            self.hits = self.hits + 1
+            meter = ParseMeter(budget)
+            meter.stop()
+            return self.lowered(template.instantiate(slots), inline), meter
+
+        self.misses = self.misses + 1
+        tree, meter = parse_sentence_metered(text, fast_path, budget)
+        if key not in self.templates:
+            if len(self.templates) >= self.max_templates:
+                del self.templates[next(iter(self.templates))]
+            self.templates[key] = self.learn(tree, slots, meter)
+        return self.lowered(tree, inline), meter
+
+    def lowered(self, tree: Tree, inline: bool):
+        return get_inline_transformer().transform(tree) if inline else tree
+
+    def stats(self):
+        return {"templates": len(self.templates), "hits": self.hits, "misses": self.misses}
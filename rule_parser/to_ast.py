@@ -1,9 +1,10 @@
 from lark import Lark, ast_utils, Tree, Token
-from lark.visitors import Interpreter
+from lark.visitors import Interpreter, Transformer
 from typing import List
 import sys
 from functools import singledispatchmethod
 from .dialect import *
+from .lexicon import Lexicon, get_lexicon
 
 class Scope:
     def __init__(self, to_ast: 'ToAst', region: Region= None, subject: SSAValue = None):
@@ -26,9 +27,18 @@ class Scope:
             self.to_ast.buider.insertion_point = self.insertion_point_to_restore
         self.to_ast.scopes.pop(-1)
 
+# marks the callbacks that build no operation and never look at the scope, the builder or the
+# subject index, so they return the same value when the parser calls them while reducing, see
+# InlineToAst, as when the walk does. Only values they read from the lexicon or from their
+# children may change what they return
+def inline_callback(method):
+    method.inline = True
+    return method
+
 class ToAst(Interpreter):
-    def __init__(self):
+    def __init__(self, lexicon: Lexicon = None):
         super().__init__()
+        self.lexicon = lexicon if lexicon is not None else get_lexicon()
         self.module = ModuleOp(Region(Block()))
         self.buider = Builder(InsertPoint(self.module.body.first_block))
         self.scopes = [Scope(self, None)]
@@ -48,6 +58,12 @@ class ToAst(Interpreter):
         print(tree, file=sys.stderr)
         raise NotImplementedError()
 
+    # subtrees lowered while parsing, see InlineToAst, are already values
+    def visit(self, tree):
+        if not isinstance(tree, Tree):
+            return tree
+        return super().visit(tree)
+
     def start(self, node: Tree):
         self.visit_children(node)
         return self.module
@@ -61,9 +77,16 @@ class ToAst(Interpreter):
     def single_effect(self, node):
         self.visit_children(node)
 
+    # the placeholder of a sentence a partial parse could not parse, see parse_sentences
+    def unsupported_sentence(self, node):
+        (text, reason) = node.children
+        return self.add(UnsupportedSentence.make(str(text), str(reason)))
+
+    @inline_callback
     def battle_shock_step(self, node):
         return TimeInstant.BATTLE_SHOCK_STEP
 
+    @inline_callback
     def command_phase(self, node):
         return TimeInstant.COMMAND_PHASE
 
@@ -94,31 +117,39 @@ class ToAst(Interpreter):
         (quantity, ) = self.visit_children(node)
         return self.add(ModifyCPCost.make(-1*quantity))
 
+    @inline_callback
     def ranged_weapon(self, node):
         return WeaponQualifierKindAttr.get(WeaponQualifierKind.RANGED)
 
 
+    @inline_callback
     def time_condition(self, node):
         (qualifier, instant) = self.visit_children(node)
         return TimeEventType.make(instant, qualifier)
 
+    @inline_callback
     def any_phase_instant(self, node):
         (qualifier, ) = self.visit_children(node)
         return TimeEventType.make(TimeInstant.ANY_PHASE, qualifier)
 
+    @inline_callback
     def oppo_step_condition(self, node):
         (step_instant, phase_instant) = self.visit_children(node)
         return TimeEventType.make(step_instant, TimeQualifier.DURING, player=Player.OPPONENT)
 
+    @inline_callback
     def time_end(self, node):
         return TimeQualifier.END
 
+    @inline_callback
     def time_start(self, node):
         return TimeQualifier.START
 
+    @inline_callback
     def fighting_phase(self, node):
         return TimeInstant.FIGHT_PHASE
 
+    @inline_callback
     def current_phase(self, node):
         return TimeInstant.CURRENT_PHASE
 
@@ -136,6 +167,7 @@ class ToAst(Interpreter):
 
         return self.add(OptionallyUse.make(user, used))
 
+    @inline_callback
     def stratagem_subject_type(self, node):
         return StratagemType()
 
@@ -160,6 +192,7 @@ class ToAst(Interpreter):
             self.add(Yield.make())
         return to_return
 
+    @inline_callback
     def ability_subject(self, node):
         return AbilityType()
 
@@ -189,12 +222,15 @@ class ToAst(Interpreter):
     def from_your_army(self, node):
         return self.add(IsOwnedBy.make(self.current_subject(), Player.YOU))
 
+    @inline_callback
     def battle_round_limit(self, node):
         return UseLimit.ROUND
 
+    @inline_callback
     def turn_limit(self, node):
         return UseLimit.TURN
 
+    @inline_callback
     def battle_limit(self, node):
         return UseLimit.BATTLE
 
@@ -238,16 +274,34 @@ class ToAst(Interpreter):
 
         return conditional_effect
 
+    @inline_callback
     def raw_number_outer(self, node):
         (number, ) = self.visit_children(node)
         return number
 
+    @inline_callback
     def hit_roll(self, node):
         return RollKind.HIT_ROLL
 
-    def character_keyword(self, node):
-        return Keyword.CHARACTER
+    # the lexicon categories are single tokens, lowered to the value the lexicon maps them to, a
+    # value that is not a member of the enum of its category raises ValueError
+    @inline_callback
+    def model_keyword(self, node):
+        return Keyword(self.lexicon.lookup("model_keyword", str(node.children[0])))
+
+    @inline_callback
+    def unit_name(self, node):
+        return UnitName(self.lexicon.lookup("unit_name", str(node.children[0])))
 
+    @inline_callback
+    def stratagem(self, node):
+        return StratagemName(self.lexicon.lookup("stratagem", str(node.children[0])))
+
+    @inline_callback
+    def weapon_name(self, node):
+        return WeaponName(self.lexicon.lookup("weapon_name", str(node.children[0])))
+
+    @inline_callback
     def number(self, node):
         return int("".join(node.children))
 
@@ -305,6 +359,7 @@ class ToAst(Interpreter):
             self.add(Yield.make())
         return  to_return
 
+    @inline_callback
     def leadership(self, node):
         return Characteristic.LEADERSHIP
 
@@ -337,9 +392,6 @@ class ToAst(Interpreter):
 
         return event
 
-    def tyranid_keyword(self, node):
-        return Keyword.TYRANID
-
     def is_targeted_with(self, node):
         op  = self.add(Targets.make())
         with self.make_scope(region=op.subjects) as scope:
@@ -451,9 +503,11 @@ class ToAst(Interpreter):
 
         return to_return
 
+    @inline_callback
     def devastating_wounds(self, node):
         return WeaponAbilityKindAttr(WeaponAbilityKind.DEVASTATING_WOUNDS)
 
+    @inline_callback
     def letal_hits(self, node):
         return WeaponAbilityKindAttr(WeaponAbilityKind.LETHAL_HITS)
 
@@ -475,6 +529,7 @@ class ToAst(Interpreter):
         typ = self.visit(node.children[0])
         return self.add(All.make(typ)).result
 
+    @inline_callback
     def subject(self, node):
         return self.visit(node.children[0])
 
@@ -503,6 +558,7 @@ class ToAst(Interpreter):
 
         return to_return
 
+    @inline_callback
     def base_subject(self, node):
         return self.visit_children(node)[0]
 
@@ -524,8 +580,40 @@ class ToAst(Interpreter):
         self.make_referrable(rhs, reserved_index)
         return self.add(SubjectsIn.make(rhs)).result
 
+    @inline_callback
     def unit(self, node):
         return UnitType()
 
+    @inline_callback
     def model(self, node):
         return ModelType()
+
+INLINE_CALLBACKS = [name for (name, method) in vars(ToAst).items() if getattr(method, "inline", False)]
+
+class ReducedNode:
+    __slots__ = ("data", "children")
+
+    def __init__(self, data, children):
+        self.data = data
+        self.children = children
+
+# Lowers the scope independent leaves of the parse as inline reductions of the LALR parser, so
+# that they never become trees. Everything that builds operations needs the scope its parent
+# opened first, it stays a tree and is lowered by the ToAst walk, which passes values through.
+class InlineToAst(Transformer):
+    def __init__(self, lexicon: Lexicon = None):
+        super().__init__(visit_tokens=False)
+        self.to_ast = ToAst(lexicon)
+
+def make_inline_callback(name: str):
+    method = getattr(ToAst, name)
+    def callback(self, children):
+        # a child that is still a tree needs the walk, and so does its parent
+        for child in children:
+            if isinstance(child, Tree):
+                return Tree(name, children)
+        return method(self.to_ast, ReducedNode(name, children))
+    return callback
+
+for name in INLINE_CALLBACKS:
+    setattr(InlineToAst, name, make_inline_callback(name))
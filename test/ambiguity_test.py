@@ -0,0 +1,44 @@
+import io
+import json
+from rule_parser import *
+from rule_parser.corpus import main as corpus_main
+
+def test_ambiguous_sentence_is_attributed_to_its_alternatives():
+    report = AmbiguityReport()
+    report.add_text("At the start of the Fight phase, select one enemy unit within Engagement Range of this model.")
+    assert report.sentences == 1
+    assert report.ambiguous_sentences == 1
+    ambiguous = {row["production"]: row["ambiguous_derivations"] for row in report.rows() if row["ambiguous_derivations"] != 0}
+    assert ambiguous == {"constrained_subject -> constrained_subject_with_constraint": 1, "constrained_subject -> forward_constrained_subject": 1}
+
+def test_productions_are_sorted_by_chart_items():
+    report = AmbiguityReport()
+    report.add_text("Each time this model destroys an enemy CHARACTER model, you gain 1CP.")
+    report.add_text("You gain 1 CP CP.")
+    assert report.failed == 1
+    assert report.ambiguous_sentences == 0
+    rows = report.rows()
+    assert sum(row["chart_items"] for row in rows) == report.chart_items > 0
+    assert [row["chart_items"] for row in rows] == sorted((row["chart_items"] for row in rows), reverse=True)
+    out = io.StringIO()
+    report.write(out, 3)
+    assert len(out.getvalue().splitlines()) == 5
+
+def test_corpus_ambiguity_report(tmp_path, capsys):
+    assert corpus_main(["./test/examples", "-o", str(tmp_path), "--ambiguity-report", "--report-limit", "5"]) == 0
+    report = json.loads((tmp_path / "ambiguity.json").read_text())
+    assert report["ambiguous_sentences"] == 4
+    assert len(report["productions"]) > 5
+    assert "chart items" in capsys.readouterr().out
+
+def test_unaliased_alternatives_are_attributed_apart(tmp_path):
+    grammar = tmp_path / "two.lark"
+    grammar.write_text('start: phrase "."\nphrase: phrase "and" phrase\n    | "units"\n    | "models"\n%ignore " "\n')
+    report = AmbiguityReport(str(grammar))
+    report.add_sentence("units and models and units.")
+    assert report.ambiguous_sentences == 1
+    ambiguous = {row["production"]: row["ambiguous_derivations"] for row in report.rows() if row["ambiguous_derivations"] != 0}
+    assert ambiguous == {"phrase: phrase AND phrase": 2}
+    report.add_sentence("models.")
+    assert report.ambiguous_sentences == 1
+    assert report.production("phrase: MODELS")["ambiguous_derivations"] == 0
@@ -0,0 +1,55 @@
+import pathlib
+import pytest
+import rule_parser.budget
+from rule_parser import *
+
+text = pathlib.Path("./test/examples/4.txt").read_text(encoding="utf-8")
+
+def test_chart_size_is_recorded_for_every_sentence():
+    stats = []
+    parse(text, fast_path=False, stats=stats)
+    assert [sentence["position"] for sentence in stats] == [sentence.start for sentence in split_sentences(text)]
+    assert all(sentence["chart_items"] > 0 for sentence in stats)
+
+def test_chart_budget_aborts_the_parse():
+    stats = []
+    parse(text, fast_path=False, stats=stats)
+    largest = max(sentence["chart_items"] for sentence in stats)
+    parse(text, fast_path=False, budget=ParseBudget(chart_items=largest))
+
+    with pytest.raises(ParseBudgetExceeded) as error:
+        parse(text, fast_path=False, budget=ParseBudget(chart_items=largest // 2))
+    assert error.value.limit == "chart_items"
+    assert error.value.to_record()["budget"]["chart_items"] == largest // 2
+
+def test_time_budget_aborts_the_parse():
+    with pytest.raises(ParseBudgetExceeded) as error:
+        parse(text, fast_path=False, budget=ParseBudget(seconds=0))
+    assert error.value.limit == "seconds"
+    assert error.value.position == 0
+
+# the chart of a sentence can fit in the budget and turning its forest into a tree still not
+class ForestOnlyMeter(ParseMeter):
+    def chart_column(self, column, to_scan):
+        pass
+
+def test_time_budget_covers_the_forest():
+    assert isinstance(get_parser(parser="earley").parser.parser, MeteredEarleyParser)
+    sentence = split_sentences(normalize_text(text).text)[0].text
+    with metered(ForestOnlyMeter(ParseBudget(seconds=60))):
+        parse_sentence_text(sentence, fast_path=False)
+    with pytest.raises(ParseBudgetExceeded) as error:
+        with metered(ForestOnlyMeter(ParseBudget(seconds=0))):
+            parse_sentence_text(sentence, fast_path=False)
+    assert error.value.limit == "seconds"
+
+def test_unknown_lark_versions_parse_without_a_budget(monkeypatch):
+    assert meterable_lark_version("1.3.1")
+    assert not meterable_lark_version("2.0.0")
+    monkeypatch.setattr(rule_parser.budget, "METERED_LARK_VERSIONS", [])
+    with pytest.warns(RuntimeWarning, match="parse budget"):
+        parser = load_parser(read_grammar(), use_disk_cache=False, parser="earley")
+    assert not isinstance(parser.parser.parser, MeteredEarleyParser)
+    sentence = split_sentences(normalize_text(text).text)[0].text
+    with metered(ParseMeter(ParseBudget(chart_items=0))):
+        parser.parse(sentence)
@@ -0,0 +1,76 @@
+import pathlib
+import sqlite3
+from rule_parser import *
+
+folder = pathlib.Path("./test/examples/")
+
+def test_cached_output_matches_compiled_output(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    args = get_arg_parser().parse_args([""])
+    text = (folder / "3.txt").read_text(encoding="utf-8")
+
+    compiled = compile_text(text, args, cache)
+    assert compile_text(text, args, cache) == compiled == compile_text(text, args)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+    unchecked = get_arg_parser().parse_args(["", "--unchecked"])
+    assert cache.key(text, unchecked) != cache.key(text, args)
+    earley = get_arg_parser().parse_args(["", "--earley"])
+    assert cache.key(text, earley) != cache.key(text, args)
+
+def test_verify_compiles_past_the_cache(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    args = get_arg_parser().parse_args(["", "--verify"])
+    text = (folder / "3.txt").read_text(encoding="utf-8")
+    cache.put(cache.key(text, args), "stale")
+    assert compile_text(text, args, cache) == compile_text(text, get_arg_parser().parse_args([""]))
+    assert cache.get(cache.key(text, args)) != "stale"
+
+def test_least_recently_used_outputs_are_evicted(tmp_path):
+    cache = CompileCache(str(tmp_path), max_size=10)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa"
+    cache.put("c", "cccc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa"
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["size"] == 8
+
+def test_hits_do_not_take_the_write_lock(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    cache.put("a", "aaaa")
+    writer = sqlite3.connect(str(tmp_path / "outputs.sqlite"), isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    cache.db.execute("PRAGMA busy_timeout = 0")
+    assert cache.get("a") == "aaaa"
+    assert cache.get("b") is None
+    writer.execute("COMMIT")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+def test_lookups_are_written_in_batches(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    other = CompileCache(str(tmp_path))
+    cache.put("a", "aaaa")
+    for _ in range(USE_BATCH - 1):
+        cache.get("a")
+    assert other.stats()["hits"] == 0
+    cache.get("a")
+    assert other.stats()["hits"] == USE_BATCH
+
+def test_lexicon_values_are_part_of_the_key(tmp_path):
+    grammar = tmp_path / "40k.lark"
+    grammar.write_text(pathlib.Path("./40k.lark").read_text(encoding="utf-8"), encoding="utf-8")
+    lexicon = tmp_path / "40k.lexicon"
+    lexicon.write_text(pathlib.Path("./40k.lexicon").read_text(encoding="utf-8"), encoding="utf-8")
+    cache = CompileCache(str(tmp_path / "cache"), grammar_path=str(grammar))
+    args = get_arg_parser().parse_args([""])
+    text = (folder / "3.txt").read_text(encoding="utf-8")
+    cache.put(cache.key(text, args), "compiled")
+
+    lexicon.write_text(lexicon.read_text(encoding="utf-8").replace("character = character", "character = infantry"), encoding="utf-8")
+    assert cache.get(cache.key(text, args)) is None
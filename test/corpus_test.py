@@ -0,0 +1,47 @@
+import json
+import pathlib
+from rule_parser.corpus import get_corpus_arg_parser, collect_entries, compile_corpus
+
+def test_corpus_keeps_going_after_failures(tmp_path):
+    args = get_corpus_arg_parser().parse_args(["./test", "-o", str(tmp_path), "-j", "2"])
+    entries = collect_entries(args.input)
+    summary = compile_corpus(entries, args, args.o, args.jobs)
+
+    assert summary["rules"] == len(entries)
+    assert 0 < summary["compiled"] < summary["rules"]
+    assert (tmp_path / "examples" / "3.rl").read_text(encoding="utf-8").startswith("def on_destruction(")
+    assert (tmp_path / "unsupported" / "11.err").exists()
+    assert 0 < summary["rejected"] <= summary["failed"]
+    with open(tmp_path / "summary.json", encoding="utf-8") as f:
+        assert json.load(f)["failed"] == summary["failed"]
+
+def test_corpus_dedup_matches_per_rule_parses(tmp_path):
+    for name in ["1.txt", "3.txt", "gsc1.txt"]:
+        text = (pathlib.Path("test/examples") / name).read_text(encoding="utf-8")
+        for copy in range(3):
+            (tmp_path / "rules" / str(copy)).mkdir(parents=True, exist_ok=True)
+            (tmp_path / "rules" / str(copy) / name).write_text(text, encoding="utf-8")
+    (tmp_path / "rules" / "bad.txt").write_text("This model nope.", encoding="utf-8")
+
+    outputs = {}
+    for jobs, flags in [("1", []), ("1", ["--dedup-sentences"]), ("2", ["--dedup-sentences", "--template-cache"])]:
+        output_dir = tmp_path / ("out" + jobs + "".join(flags))
+        args = get_corpus_arg_parser().parse_args([str(tmp_path / "rules"), "-o", str(output_dir), "-j", jobs] + flags)
+        summary = compile_corpus(collect_entries(args.input), args, args.o, args.jobs)
+        assert summary["failed"] == 1
+        outputs[output_dir.name] = {path.relative_to(output_dir): path.read_text(encoding="utf-8") for path in output_dir.rglob("*.rl")}
+        if flags:
+            # every sentence of the examples three times, and the rejected one once
+            assert summary["dedup"]["sentences"] == 3 * (summary["dedup"]["distinct"] - 1) + 1
+            assert summary["deduplicated"] == summary["dedup"]["sentences"] - 1
+
+    (plain, *deduplicated) = outputs.values()
+    assert len(plain) == 9
+    assert all(output == plain for output in deduplicated)
+
+def test_corpus_partial_compiles_what_it_can(tmp_path):
+    args = get_corpus_arg_parser().parse_args(["./test/unsupported", "-o", str(tmp_path), "-j", "1", "--partial"])
+    summary = compile_corpus(collect_entries(args.input), args, args.o, args.jobs)
+    assert summary["failed"] == 0
+    assert summary["unsupported"] >= summary["partial"] > 0
+    assert "# unsupported: " in (tmp_path / "7.rl").read_text(encoding="utf-8")
@@ -0,0 +1,75 @@
+import json
+import os
+import pathlib
+import pytest
+import socket
+import subprocess
+import sys
+import threading
+from rule_parser import *
+from rule_parser.daemon import CompileServer, SocketPathInUse
+
+folder = pathlib.Path("./test/examples/")
+
+def request(socket_path, payload):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+        connection.shutdown(socket.SHUT_WR)
+        with connection.makefile("rb") as reply:
+            return json.loads(reply.readline())
+
+def test_server_compiles_requests(tmp_path):
+    socket_path = str(tmp_path / "compile.sock")
+    server = CompileServer(socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        text = (folder / "2.txt").read_text(encoding="utf-8")
+        response = request(socket_path, {"id": 1, "text": text})
+        assert response["id"] == 1
+        assert response["output"] == compile_text(text, make_stage_args())
+
+        response = request(socket_path, {"text": text, "stages": ["canonicalized"]})
+        assert response["output"] == compile_text(text, make_stage_args(["canonicalized"]))
+
+        for _ in range(2):
+            response = request(socket_path, {"text": text, "session": "editor"})
+            assert response["output"] == compile_text(text, make_stage_args())
+
+        response = request(socket_path, {"text": "this is not a rule."})
+        assert response["error"].startswith("RejectedText: unknown word")
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+def test_server_only_replaces_stale_sockets(tmp_path):
+    taken = tmp_path / "taken.txt"
+    taken.write_text("not a socket", encoding="utf-8")
+    with pytest.raises(SocketPathInUse):
+        CompileServer(str(taken))
+    assert taken.read_text(encoding="utf-8") == "not a socket"
+
+    socket_path = str(tmp_path / "compile.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+    server = CompileServer(socket_path)
+    try:
+        with pytest.raises(SocketPathInUse):
+            CompileServer(socket_path)
+    finally:
+        server.server_close()
+    assert not os.path.exists(socket_path)
+
+def test_server_removes_its_socket_on_sigterm(tmp_path):
+    socket_path = tmp_path / "compile.sock"
+    server = subprocess.Popen([sys.executable, "main.py", "--serve", str(socket_path)], stderr=subprocess.PIPE)
+    try:
+        assert b"listening" in server.stderr.readline()
+        server.terminate()
+        assert server.wait(timeout=30) == 0
+    finally:
+        server.kill()
+    assert not socket_path.exists()
@@ -0,0 +1,29 @@
+from rule_parser import *
+
+def earley_tree(text: str):
+    return get_parser(parser="earley").parse(normalize_text(text).text)
+
+def test_earley_parser_ranks_ambiguities():
+    assert issubclass(get_parser(parser="earley").parser.parser.SymbolNode, RankedChildren)
+    assert not issubclass(get_parser(parser="earley", ambiguity="explicit").parser.parser.SymbolNode, RankedChildren)
+
+# only the forests of ambiguous sentences are walked
+def test_unambiguous_sentences_are_not_ranked(monkeypatch):
+    walks = []
+    visit = RankingVisitor.visit
+    monkeypatch.setattr(RankingVisitor, "visit", lambda visitor, root: walks.append(root) or visit(visitor, root))
+    earley_tree("Each time this model destroys an enemy CHARACTER model, you gain 1CP.")
+    assert walks == []
+    earley_tree("Select one enemy unit within Engagement Range of this model.")
+    assert len(walks) != 0
+
+def test_constraint_attaches_to_the_nearest_subject():
+    tree = earley_tree("Select one enemy unit within Engagement Range of this model.")
+    subject = next(tree.find_data("select_subject")).children[0].children[0]
+    assert subject.data == "forward_constrained_subject"
+    assert subject.children[1].data == "constrained_subject_with_constraint"
+
+def test_models_in_that_unit_are_the_models_of_the_unit():
+    tree = earley_tree("Worsen the Leadership characteristic of models in that unit by 1.")
+    assert len(list(tree.find_data("in_subject"))) == 1
+    assert len(list(tree.find_data("constrained_subject_with_constraint"))) == 0
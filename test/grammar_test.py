@@ -0,0 +1,78 @@
+import os
+import pathlib
+import pytest
+from rule_parser import *
+
+folder = pathlib.Path("./test/examples/")
+
+def test_disk_cached_parser_matches_fresh_parser(tmp_path, monkeypatch):
+    monkeypatch.setenv("RULE_PARSER_CACHE_DIR", str(tmp_path))
+    grammar = read_grammar(GRAMMAR_PATH)
+    fresh = load_parser(grammar, use_disk_cache=False, parser="earley")
+    stored = load_parser(grammar, parser="earley")
+    reloaded = load_parser(grammar, parser="earley")
+    assert len(os.listdir(tmp_path)) == 1
+
+    text = normalize_text((folder / "3.txt").read_text(encoding="utf-8")).text
+    assert fresh.parse(text) == stored.parse(text) == reloaded.parse(text)
+
+def test_parser_cache_reloads_changed_grammar(tmp_path, monkeypatch):
+    monkeypatch.setenv("RULE_PARSER_CACHE_DIR", str(tmp_path / "cache"))
+    grammar_path = tmp_path / "test.lark"
+    grammar_path.write_text('start: "a"\n', encoding="utf-8")
+    cache = ParserCache()
+
+    first = cache.get(str(grammar_path), parser="earley")
+    assert cache.get(str(grammar_path), parser="earley") is first
+
+    grammar_path.write_text('start: "b"\n', encoding="utf-8")
+    os.utime(grammar_path, ns=(0, 0))
+    second = cache.get(str(grammar_path), parser="earley")
+    assert second is not first
+    second.parse("b")
+
+def test_lalr_fast_path_agrees_with_earley(tmp_path, monkeypatch):
+    monkeypatch.setenv("RULE_PARSER_CACHE_DIR", str(tmp_path))
+    parser_cache.clear()
+    fast_path_parsers.clear()
+    for _ in range(2):
+        parser = get_fast_path_parser()
+        for filepath in sorted(folder.glob("*.txt")):
+            text = normalize_text(filepath.read_text(encoding="utf-8")).text
+            try:
+                expected = parser.earley.parse(text)
+            except Exception:
+                continue
+            assert parser.parse(text) == expected
+        assert parser.lalr_parses > 0
+        # the second round loads the parsers back from the disk cache
+        parser_cache.clear()
+
+def test_lalr_conflicts_are_reported():
+    conflicts, _ = lalr_conflicts()
+    names = {production_name(rule) for conflict in conflicts for rule in conflict.rules}
+    assert "timed_effect -> trailing_when_effect" in names
+
+def test_pregenerated_parser_is_up_to_date():
+    import rule_parser.generated_lalr_parser as generated
+    assert generated.GRAMMAR_DIGEST == standalone_digest(), "regenerate it with main.py --generate-parser"
+    assert isinstance(get_lalr_parser(), StandaloneParser)
+
+def test_pregenerated_parser_matches_runtime_parser(tmp_path, monkeypatch):
+    monkeypatch.setenv("RULE_PARSER_CACHE_DIR", str(tmp_path))
+    standalone = load_standalone_parser()
+    runtime = load_parser(read_grammar(), use_disk_cache=False, **LALR_OPTIONS)
+    for filepath in sorted(folder.glob("*.txt")):
+        for sentence in split_sentences(normalize_text(filepath.read_text(encoding="utf-8")).text):
+            try:
+                expected = runtime.parse(sentence.text)
+            except UnexpectedInput:
+                with pytest.raises(UnexpectedInput):
+                    standalone.parse(sentence.text)
+                continue
+            assert standalone.parse(sentence.text) == expected
+
+def test_pregenerated_parser_is_ignored_for_other_grammars(tmp_path):
+    grammar_path = tmp_path / "test.lark"
+    grammar_path.write_text('start: "a"\n', encoding="utf-8")
+    assert load_standalone_parser(str(grammar_path)) is None
@@ -0,0 +1,47 @@
+import os
+import pytest
+from lark import Token, Tree
+from rule_parser import *
+from rule_parser.lexicon import LEXICON_CATEGORIES, Lexicon, get_lexicon, terminal_name
+
+def test_trie_terminal_matches_every_phrase():
+    lexicon = Lexicon({"unit_name": {"spore mines": "spore_mines", "spore": "spore", "ripper swarms": "ripper_swarms", "a/b": "slash"}})
+    grammar = "start: LEXICON_UNIT_NAME\n%ignore \" \"\n" + lexicon.terminal_definitions()
+    parser = load_parser(grammar, use_disk_cache=False, parser="earley")
+    for phrase in ["spore mines", "spore", "ripper swarms", "a/b"]:
+        (token, ) = parser.parse(phrase).children
+        assert lexicon.lookup("unit_name", str(token)) is not None
+
+def test_lexicon_entries_reach_the_grammar(tmp_path, monkeypatch):
+    monkeypatch.setenv("RULE_PARSER_CACHE_DIR", str(tmp_path / "cache"))
+    grammar_path = tmp_path / "test.lark"
+    lexicon_path = tmp_path / "test.lexicon"
+    grammar_path.write_text("start: model_keyword\nmodel_keyword: LEXICON_MODEL_KEYWORD\n", encoding="utf-8")
+    lexicon_path.write_text("[model_keyword]\ntyranids = tyranid\n", encoding="utf-8")
+    cache = ParserCache()
+    first = cache.get(str(grammar_path), parser="earley")
+    first.parse("tyranids")
+
+    # adding an entry only touches the lexicon, the grammar file stays the same
+    lexicon_path.write_text("[model_keyword]\ntyranids = tyranid\nmonsters = monster\n", encoding="utf-8")
+    os.utime(lexicon_path, ns=(0, 0))
+    second = cache.get(str(grammar_path), parser="earley")
+    assert second is not first
+    second.parse("monsters")
+
+def test_to_ast_lowers_keywords_through_the_lexicon():
+    lexicon = get_lexicon()
+    assert Keyword(lexicon.lookup("model_keyword", "TYRANIDS")) == Keyword.TYRANID
+    assert Keyword(lexicon.lookup("model_keyword", "monsters")) == Keyword.MONSTER
+    values = {"model_keyword": Keyword, "unit_name": UnitName, "stratagem": StratagemName, "weapon_name": WeaponName}
+    assert set(values) == set(LEXICON_CATEGORIES)
+    to_ast = ToAst(lexicon)
+    for category, phrases in lexicon.categories.items():
+        assert len(phrases) != 0
+        for phrase in phrases:
+            assert isinstance(getattr(to_ast, category)(Tree(category, [Token(terminal_name(category), phrase)])), values[category])
+
+    misspelt = ToAst(Lexicon({category: {"phrase": "misspelt_value"} for category in LEXICON_CATEGORIES}))
+    for category in LEXICON_CATEGORIES:
+        with pytest.raises(ValueError):
+            getattr(misspelt, category)(Tree(category, [Token(terminal_name(category), "phrase")]))
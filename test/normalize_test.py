@@ -0,0 +1,40 @@
+import io
+import pathlib
+import pytest
+from rule_parser import *
+
+folder = pathlib.Path("./test/examples/")
+
+def print_ir(module):
+    out = io.StringIO()
+    Printer(out).print_op(module)
+    return out.getvalue()
+
+def test_normalize_keeps_offsets():
+    text = "  Each  TIME­,\n[ Lethal Hits ] opponent’s Battle‑shock"
+    normalized = normalize_text(text)
+    assert normalized.text == "each time, [lethal hits] opponent's battle-shock"
+    for position, char in enumerate(normalized.text):
+        assert text[normalized.original_position(position)].lower() in (char, "’", "‑", "\n")
+    assert normalized.original_text(11, 24) == "[ Lethal Hits ]"
+    assert normalized.original_position(len(normalized.text)) == len(text)
+
+def test_typographic_variants_parse_the_same():
+    text = (folder / "4.txt").read_text(encoding="utf-8")
+    variant = text.upper().replace("-", "‑").replace(" ", "  ")
+    assert variant != text
+    assert print_ir(parse(variant)) == print_ir(parse(text))
+
+def test_errors_point_at_the_original_text():
+    text = "While this model is leading a unit, weapons­ equipped by models in that unit have the [DEVASTATING WOUNDS] ability.\n\nOnce per BATTLE,  at the start of any phase, this model can use this abilty."
+    with pytest.raises(RejectedText) as rejected:
+        parse(text)
+    assert rejected.value.rejection.token == "abilty"
+    assert rejected.value.pos_in_stream == text.index("abilty")
+    assert (rejected.value.line, rejected.value.column) == (3, text.index("abilty") - text.rindex("\n"))
+
+    text = "While this model is leading a unit, weapons equipped by models in that unit have the [DEVASTATING WOUNDS] ability.\n\nOnce per BATTLE,  At the start of any phase, this model can use ability this."
+    with pytest.raises(UnexpectedInput) as error:
+        parse(text, prefilter=False)
+    assert error.value.pos_in_stream >= text.index("Once per")
+    assert error.value.line == 3
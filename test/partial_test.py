@@ -0,0 +1,35 @@
+import pathlib
+import pytest
+from rule_parser import *
+
+unsupported = pathlib.Path("./test/unsupported/")
+
+def test_unsupported_sentences_become_comments():
+    args = make_stage_args()
+    args.partial = True
+    stats = []
+    output = compile_text((unsupported / "7.txt").read_text(encoding="utf-8"), args, stats=stats)
+    assert output.count("# unsupported: ") == 2
+    assert "# unsupported: If the target is Battle-shocked, add 1 to the Wound roll as well.\n" in output
+    assert [sentence["unsupported"].split(":")[0] for sentence in stats] == ["RejectedText", "RejectedText"]
+
+def test_supported_sentences_are_still_compiled():
+    supported = "At the end of the Fight phase, you gain 1CP."
+    text = "You gain D3CP. " + supported + " Subtract 1 from the Hit roll."
+    with pytest.raises(Exception):
+        compile_text(text, make_stage_args())
+
+    args = make_stage_args()
+    args.partial = True
+    stats = []
+    output = compile_text(text, args, stats=stats)
+    assert "# unsupported: You gain D3CP.\n" in output
+    assert "# unsupported: Subtract 1 from the Hit roll.\n" in output
+    assert "gain_cp(1)" in output
+    assert ["unsupported" in sentence for sentence in stats] == [True, False, True]
+
+def test_unsupported_sentence_is_an_op():
+    module = parse("You gain 1CP. This is not a rule.", partial=True)
+    ops = list(module.body.block.ops)
+    assert isinstance(ops[-1], UnsupportedSentence)
+    assert ops[-1].text.data == "This is not a rule."
@@ -0,0 +1,50 @@
+import io
+import json
+import pathlib
+import pytest
+from rule_parser import *
+from rule_parser.corpus import get_corpus_arg_parser, collect_entries, compile_corpus
+
+def test_timer_records_every_pass():
+    text = pathlib.Path("test/examples/2.txt").read_text(encoding="utf-8")
+    args = make_stage_args()
+    timer = PassTimer()
+    run_pipeline(parse(text), args, io.StringIO(), timer=timer)
+    names = [module_pass.name for module_pass in make_pipeline(args, io.StringIO())]
+    assert [record["pass"] for record in timer.records] == names
+    for record, next_record in zip(timer.records, timer.records[1:]):
+        assert record["ops_after"] == next_record["ops_before"]
+    assert all(record["seconds"] >= 0 and record["peak_bytes"] > 0 for record in timer.records)
+    assert timer.records[names.index("drop-useless-operations-pass")]["stats"]["iterations"] >= 1
+
+    untraced = PassTimer(trace_memory=False)
+    compile_text(text, args, timer=untraced)
+    compile_text(text, args, timer=untraced)
+    rows = untraced.summary()
+    assert [row["pass"] for row in rows] == names
+    assert all(row["runs"] == 2 and row["peak_bytes"] is None for row in rows)
+
+    out = io.StringIO()
+    untraced.report(out, "json")
+    assert json.loads(out.getvalue())["passes"] == rows
+    out = io.StringIO()
+    untraced.report(out)
+    assert out.getvalue().splitlines()[-1].endswith("total")
+
+def test_corpus_adds_up_the_passes_of_its_rules(tmp_path):
+    args = get_corpus_arg_parser().parse_args(["./test/examples", "-o", str(tmp_path), "-j", "1", "--timing"])
+    summary = compile_corpus(collect_entries(args.input), args, args.o, args.jobs)
+    compiled = [record for record in summary["records"] if record["ok"]]
+    serializer = [row for row in summary["passes"] if row["pass"] == "rlc-serializer"][0]
+    assert serializer["runs"] == len(compiled)
+    assert serializer["seconds"] == pytest.approx(sum(record["passes"][-1]["seconds"] for record in compiled))
+
+# the attempts a partial compilation retries without a sentence leave no record
+def test_timer_keeps_only_the_compiled_attempt():
+    args = make_stage_args()
+    args.partial = True
+    stats = []
+    timer = PassTimer(trace_memory=False)
+    compile_text(pathlib.Path("test/unsupported/5.txt").read_text(encoding="utf-8"), args, stats=stats, timer=timer)
+    assert any("unsupported" in sentence for sentence in stats)
+    assert [row["runs"] for row in timer.summary()] == [1] * len(make_pipeline(args, io.StringIO()))
@@ -0,0 +1,118 @@
+import io
+import pathlib
+import pytest
+import rule_parser.passes
+from rule_parser import *
+
+folder = pathlib.Path("./test/examples/")
+files = [f for f in folder.glob("*.txt") if f.name != "6.txt"]
+
+def analyzed_module(filepath):
+    module = parse(filepath.read_text(encoding="utf-8"))
+    SemanticalAnalyzer().apply(make_context(), module)
+    return module
+
+def check_ancestors(module):
+    analysis = AncestorAnalysis(module)
+    ops = list(module.walk())
+    for op in ops:
+        for ancestor_type in ANCESTOR_TYPES:
+            assert analysis.ancestor_of_type(op, ancestor_type) is ancesor_of_type(op, ancestor_type)
+        for other in ops:
+            assert analysis.dominates(other, op) == dominates(other, op)
+    return analysis
+
+# with no parent steps every containment query goes through the numbering
+@pytest.mark.parametrize("steps", [0, rule_parser.passes.MAX_PARENT_STEPS])
+@pytest.mark.parametrize("filepath", files, ids=[f.name for f in files])
+def test_ancestor_analysis_matches_parent_walks(filepath, steps, monkeypatch):
+    monkeypatch.setattr(rule_parser.passes, "MAX_PARENT_STEPS", steps)
+    module = analyzed_module(filepath)
+    check_ancestors(module)
+    InlineDependantEffects().apply(make_context(), module)
+    check_ancestors(module)
+
+@pytest.mark.parametrize("steps", [0, rule_parser.passes.MAX_PARENT_STEPS])
+def test_ancestor_analysis_follows_the_rewriter(steps, monkeypatch):
+    monkeypatch.setattr(rule_parser.passes, "MAX_PARENT_STEPS", steps)
+    module = analyzed_module(folder / "2.txt")
+    analysis = AncestorAnalysis(module)
+    rewriter = AnalysisRewriter(analysis)
+    first, last = module.body.first_block.first_op, module.body.first_block.last_op
+    assert analysis.dominates(first, last) == dominates(first, last)
+    until = next(visit(module, UntilEffect))
+    inner = [op for op in until.walk() if op is not until and len(op.regions) == 0][0]
+    assert analysis.ancestor_of_type(inner, UntilEffect) is until
+    inner.detach()
+    rewriter.insert_op(inner, InsertPoint.before(until))
+    added = TrueOp.make()
+    rewriter.insert_op(added, InsertPoint.at_start(until.effect.first_block))
+    for op in [inner, added, until]:
+        assert analysis.ancestor_of_type(op, UntilEffect) is ancesor_of_type(op, UntilEffect)
+        assert analysis.depth(op) == analysis.depth(op.parent_op()) + 1
+    assert analysis.dominates(inner, added) == dominates(inner, added) == False
+    assert analysis.dominates(until, inner) == dominates(until, inner) == True
+
+@pytest.mark.parametrize("filepath", files, ids=[f.name for f in files])
+def test_op_index_matches_walks(filepath, monkeypatch):
+    queries = []
+    of_type, with_trait = OpIndex.of_type, OpIndex.with_trait
+    def checked_of_type(index, op_type):
+        found = of_type(index, op_type)
+        assert found == [op for op in index.root.walk() if isinstance(op, op_type)]
+        queries.append(op_type)
+        return found
+    def checked_with_trait(index, trait):
+        found = with_trait(index, trait)
+        assert found == [op for op in index.root.walk() if op.has_trait(trait)]
+        queries.append(trait)
+        return found
+    monkeypatch.setattr(OpIndex, "of_type", checked_of_type)
+    monkeypatch.setattr(OpIndex, "with_trait", checked_with_trait)
+    module = parse(filepath.read_text(encoding="utf-8"))
+    run_pipeline(module, make_stage_args(["before_printing"]), io.StringIO())
+    assert len(queries) != 0
+
+def test_op_index_follows_the_rewriter():
+    module = analyzed_module(folder / "2.txt")
+    with indexed_ops(module) as index:
+        rewriter = AnalysisRewriter(index)
+        until = next(visit(module, UntilEffect))
+        inner = [op for op in until.walk() if op is not until and len(op.regions) == 0][0]
+        inner.detach()
+        rewriter.insert_op(inner, InsertPoint.before(until))
+        rewriter.insert_op(TrueOp.make(), InsertPoint.at_start(until.effect.first_block))
+        rewriter.insert_op(until.clone(), InsertPoint.after(until))
+        erased = module.body.first_block.first_op
+        rewriter.erase_op(erased)
+        assert not any(op in index.keys for op in erased.walk())
+        assert not index.stale
+        assert all(keys == sorted(keys) and len(keys) == len(ops) for (keys, ops) in index.ops.values())
+        assert index.of_type(Operation) == list(module.walk())
+        assert index.of_type(UntilEffect) == [op for op in module.walk() if isinstance(op, UntilEffect)]
+    assert op_index(module) is None
+
+@pytest.mark.parametrize("filepath", files, ids=[f.name for f in files])
+def test_drop_useless_operations_reaches_a_fixpoint(filepath):
+    module = parse(filepath.read_text(encoding="utf-8"))
+    passes = make_pipeline(make_stage_args(["before_bounding"]), io.StringIO())
+    drop_useless = [p for p in passes if isinstance(p, DropUselessOperations)][0]
+    with indexed_ops(module):
+        PassPipeline(passes[:passes.index(drop_useless) + 1], refresh_op_index).apply(make_context(), module)
+    assert drop_useless.stats["iterations"] >= 1
+    driver = GreedyRewriteDriver(DROP_USELESS_PATTERNS)
+    driver.rewrite(module)
+    assert driver.stats() == {"applications": {}, "iterations": 1}
+
+def test_and_true_keeps_a_shared_true():
+    block = Block(arg_types=[BoolType()])
+    true = TrueOp.make()
+    both = And.make(true.result, true.result)
+    shared = And.make(true.result, block.args[0])
+    block.add_ops([true, both, shared, Yield.build(operands=[[both.result, shared.result, true.result]])])
+    module = ModuleOp(Region(block))
+    driver = GreedyRewriteDriver(DROP_USELESS_PATTERNS)
+    driver.rewrite(module)
+    assert driver.applications["AndTrue"] == 2
+    assert [type(op) for op in block.ops] == [TrueOp, Yield]
+    assert list(block.last_op.operands) == [true.result, block.args[0], true.result]
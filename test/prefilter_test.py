@@ -0,0 +1,42 @@
+import pathlib
+import pickle
+import pytest
+from rule_parser import *
+
+examples = pathlib.Path("./test/examples/")
+unsupported = pathlib.Path("./test/unsupported/")
+
+def test_prefilter_accepts_every_parseable_sentence():
+    prefilter = get_prefilter()
+    for path in examples.glob("*.txt"):
+        for sentence in split_sentences(normalize_text(path.read_text(encoding="utf-8")).text):
+            try:
+                parse_sentence_text(sentence.text)
+            except UnexpectedInput:
+                continue
+            assert prefilter.check(sentence.text) is None, sentence
+
+def test_prefilter_rejects_with_a_reason():
+    rejection = get_prefilter().check("If the target is Battle-shocked, add 1 to the Wound roll as well.")
+    assert rejection.kind == "unknown word"
+    assert rejection.token == "target"
+    assert rejection.position == 7
+
+def test_rejected_text_is_not_parsed():
+    text = (unsupported / "7.txt").read_text(encoding="utf-8")
+    with pytest.raises(RejectedText) as error:
+        parse(text)
+    assert error.value.rejection.token == "add"
+    assert error.value.column == 85
+    with pytest.raises(UnexpectedInput) as error:
+        parse(text, prefilter=False)
+    assert not isinstance(error.value, RejectedText)
+
+def test_rejected_text_is_a_lark_error():
+    text = (unsupported / "7.txt").read_text(encoding="utf-8")
+    with pytest.raises(UnexpectedCharacters) as error:
+        parse(text)
+    assert "add" in error.value.get_context(text)
+    assert (error.value.state, error.value.allowed, str(error.value.token)) == (None, set(), "add")
+    copied = pickle.loads(pickle.dumps(error.value))
+    assert (str(copied), copied.rejection.token) == (str(error.value), "add")
@@ -0,0 +1,15 @@
+from rule_parser import *
+
+def test_subject_table_resolves_to_the_latest_matching_subject():
+    unit = All.make(UnitType()).result
+    models = [All.make(ModelType()).result for _ in range(3)]
+    table = SubjectTable()
+    table.add(unit)
+    for model in models:
+        table.add(model)
+    assert table.last() is models[-1]
+    assert table.last_of_type(unit.type) is unit
+    assert table.last_of_type(models[0].type) is models[-1]
+    assert table.referred_by(All.make(UnitType())) is unit
+    assert table.referred_by(All.make(ModelType())) is models[-1]
+    assert table.referred_by(All.make(AttackType())) is None
@@ -0,0 +1,49 @@
+import io
+import pathlib
+import pytest
+from rule_parser import *
+
+folder = pathlib.Path("./test/examples/")
+files = [f for f in folder.glob("*.txt") if f.name != "6.txt"]
+
+def print_ir(module):
+    out = io.StringIO()
+    Printer(out).print_op(module)
+    return out.getvalue()
+
+def test_split_sentences_keeps_offsets():
+    text = "Once per battle, this model can use this ability. If it does, [sustained hits 1.] applies.\n"
+    sentences = split_sentences(text)
+    assert [sentence.text[-1] for sentence in sentences] == [".", "."]
+    for sentence in sentences:
+        assert text[sentence.start:sentence.start + len(sentence.text)] == sentence.text
+
+@pytest.mark.parametrize("filepath", files, ids=[f.name for f in files])
+def test_sentence_split_parse_matches_whole_parse(filepath):
+    text = filepath.read_text(encoding="utf-8")
+    whole = ToAst().visit(get_parser(parser="earley").parse(normalize_text(text).text))
+    assert print_ir(parse(text)) == print_ir(whole)
+
+@pytest.mark.parametrize("filepath", files, ids=[f.name for f in files])
+def test_inline_lowering_matches_tree_lowering(filepath):
+    text = filepath.read_text(encoding="utf-8")
+    assert print_ir(parse(text, inline=True)) == print_ir(parse(text))
+    for stages in (["unchecked"], []):
+        inline = io.StringIO()
+        run_pipeline(parse(text, inline=True), make_stage_args(stages), inline)
+        tree = io.StringIO()
+        run_pipeline(parse(text), make_stage_args(stages), tree)
+        assert inline.getvalue() == tree.getvalue()
+
+def test_inline_lowering_reduces_leaves():
+    text = "each time this model destroys an enemy character model, you gain 1cp."
+    tree = parse_sentence_text(text, inline=True)
+    assert "model_keyword" in [subtree.data for subtree in parse_sentence_text(text).iter_subtrees()]
+    assert "model_keyword" not in [subtree.data for subtree in tree.iter_subtrees()]
+
+def test_inline_callbacks_never_touch_the_scope():
+    assert "model_keyword" in INLINE_CALLBACKS
+    for name in INLINE_CALLBACKS:
+        names = getattr(ToAst, name).__code__.co_names
+        assert not {"scopes", "add", "buider", "make_scope", "subject_index"} & set(names), name
+    assert not {"unsupported_sentence", "in_subject", "add", "effect"} & set(INLINE_CALLBACKS)
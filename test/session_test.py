@@ -0,0 +1,34 @@
+import pathlib
+from rule_parser import *
+from rule_parser.session import CompileSession
+
+folder = pathlib.Path("./test/examples/")
+
+def test_session_matches_compile_text():
+    for stages in [[], ["unchecked"], ["canonicalized"]]:
+        args = make_stage_args(stages)
+        for path in folder.glob("*.txt"):
+            if path.name == "6.txt":
+                continue
+            text = path.read_text(encoding="utf-8")
+            assert CompileSession(args).compile(text) == compile_text(text, args), path
+
+def test_session_reparses_only_changed_sentences():
+    args = make_stage_args()
+    session = CompileSession(args)
+    first = (folder / "2.txt").read_text(encoding="utf-8").strip()
+    second = (folder / "4.txt").read_text(encoding="utf-8").strip()
+    session.compile(first + " " + second)
+    assert session.parsed == 4
+
+    second = second.replace("6\"", "9\"")
+    edited = first + " " + second
+    assert session.compile(edited) == compile_text(edited, args)
+    assert session.parsed == 1
+    assert session.lowered == 1
+
+    # the sentences of 4.txt now come first, the ones after them get new subject indices and are
+    # lowered again from the trees they already had
+    edited = second + " " + first
+    assert session.compile(edited) == compile_text(edited, args)
+    assert session.parsed == 0
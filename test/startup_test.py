@@ -0,0 +1,54 @@
+import json
+import os
+import pytest
+import subprocess
+import sys
+import time
+
+# cold runs of main.py in a fresh interpreter, with the parser disk cache already filled. Wall
+# clock budgets only hold on a quiet machine, they are checked when RULE_PARSER_BENCHMARK is set
+BENCHMARK = os.environ.get("RULE_PARSER_BENCHMARK", "") not in ("", "0")
+STARTUP_BUDGET = {"help": 0.25, "unchecked": 1.5}
+ONE_SENTENCE = "Each time this model destroys an enemy CHARACTER model, you gain 1CP."
+
+# the heavy packages a run of main.py with these arguments has imported when it is done
+def imported_packages(argv):
+    code = f"""
+import io, contextlib, json, sys
+import main
+sys.argv = ["main.py"] + {argv!r}
+try:
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.main()
+except SystemExit:
+    pass
+print(json.dumps(sorted({{name.split(".")[0] for name in sys.modules}} & {{"xdsl", "lark"}})))
+"""
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+def fastest_run(argv, runs=3):
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "main.py"] + argv, capture_output=True, check=True)
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+def test_help_imports_no_compiler():
+    assert imported_packages(["--help"]) == []
+
+def test_cache_hit_imports_no_xdsl(tmp_path):
+    rule = tmp_path / "rule.txt"
+    rule.write_text(ONE_SENTENCE, encoding="utf-8")
+    argv = [str(rule), "--cache", "--cache-dir", str(tmp_path / "cache")]
+    assert "xdsl" in imported_packages(argv)
+    assert "xdsl" not in imported_packages(argv)
+
+@pytest.mark.skipif(not BENCHMARK, reason="set RULE_PARSER_BENCHMARK=1 to check the startup budget")
+def test_startup_budget(tmp_path):
+    rule = tmp_path / "rule.txt"
+    rule.write_text(ONE_SENTENCE, encoding="utf-8")
+    fastest_run([str(rule), "--unchecked"], runs=1)
+    assert fastest_run(["--help"]) < STARTUP_BUDGET["help"]
+    assert fastest_run([str(rule), "--unchecked"]) < STARTUP_BUDGET["unchecked"]
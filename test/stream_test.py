@@ -0,0 +1,21 @@
+import io
+import json
+import pathlib
+from rule_parser import *
+from rule_parser.stream import compile_jsonl_stream
+
+folder = pathlib.Path("./test/examples/")
+
+def test_jsonl_stream_emits_one_result_per_record():
+    text = (folder / "3.txt").read_text(encoding="utf-8")
+    lines = [json.dumps({"id": "three", "text": text}), "", "{not json", json.dumps({"text": "nope."})]
+    out = io.StringIO()
+    compile_jsonl_stream(iter(lines), out, make_stage_args())
+
+    results = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [result["id"] for result in results] == ["three", 3, 4]
+    assert results[0]["output"] == compile_text(text, make_stage_args())
+    assert results[0]["error"] is None
+    assert set(results[0]["timings"]) == {"parse", "pipeline", "total"}
+    assert results[1]["error"].startswith("JSONDecodeError")
+    assert results[2]["error"].startswith("RejectedText: unknown word 'nope'")
@@ -0,0 +1,57 @@
+import io
+import pathlib
+import pytest
+from rule_parser import *
+
+folder = pathlib.Path("./test/examples/")
+files = [f for f in folder.glob("*.txt") if f.name != "6.txt"]
+
+def print_ir(module):
+    out = io.StringIO()
+    Printer(out).print_op(module)
+    return out.getvalue()
+
+def variant(text: str):
+    return text.replace("1", "3").replace("6", "12").replace("4", "5").replace("CHARACTER", "PSYKER")
+
+def test_abstract_replaces_slots():
+    templates = TemplateCache()
+    templates.refresh()
+    key, slots = templates.abstract("Each time this model destroys an enemy CHARACTER model, you gain 12CP.")
+    assert key == "Each time this model destroys an enemy \0model_keyword\0 model, you gain \0number\0CP."
+    assert slots == [("model_keyword", "CHARACTER"), ("number", "12")]
+
+@pytest.mark.parametrize("filepath", files, ids=[f.name for f in files])
+def test_instantiated_templates_match_parses(filepath):
+    text = filepath.read_text(encoding="utf-8")
+    templates = TemplateCache()
+    assert print_ir(parse(text, sentence_cache=templates)) == print_ir(parse(text))
+    assert print_ir(parse(variant(text), sentence_cache=templates)) == print_ir(parse(variant(text)))
+    # sentences the earley parser ranked are parsed again when the variant changes a slot length
+    assert templates.hits + templates.misses == 2 * len(split_sentences(text))
+    assert templates.misses >= len(split_sentences(text)) and templates.hits != 0
+
+def test_template_keeps_failing_text_failing():
+    templates = TemplateCache()
+    parse("Each time this model destroys an enemy CHARACTER model, you gain 1CP.", sentence_cache=templates)
+    with pytest.raises(UnexpectedInput):
+        parse("Each time this model destroys an enemy CHARACTER model, you gain 1 CP CP.", sentence_cache=templates)
+
+def test_templates_lower_inline():
+    text = "Each time this model destroys an enemy CHARACTER model, you gain 1CP."
+    templates = TemplateCache()
+    for sentence in [text, variant(text)]:
+        (tree, ) = parse_sentences(sentence, inline=True, sentence_cache=templates)
+        assert "model_keyword" not in [subtree.data for subtree in tree.iter_subtrees()]
+        assert print_ir(parse(sentence, inline=True, sentence_cache=templates)) == print_ir(parse(sentence))
+    assert templates.hits != 0
+
+def test_earley_templates_hold_for_slots_of_the_same_length():
+    text = normalize_text("Each time this model destroys an enemy CHARACTER model, you gain 1CP.").text
+    templates = TemplateCache()
+    templates.parse(text, fast_path=False)
+    templates.parse(text.replace("1", "3"), fast_path=False)
+    assert (templates.hits, templates.misses) == (1, 1)
+    (tree, _) = templates.parse(text.replace("1", "12"), fast_path=False)
+    assert (templates.hits, templates.misses) == (1, 2)
+    assert tree == parse_sentence_text(text.replace("1", "12"), fast_path=False)